@@ -1,11 +1,28 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory
+import startup_profile
+startup_profile.enable_from_environment()
+
+from flask import Flask, Response, render_template, request, jsonify, send_from_directory
 from flask_cors import CORS
 import os
 import json
-import sqlite3
-from datetime import datetime
+import hashlib
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+from werkzeug.http import is_resource_modified
+import metrics
+import serialization
+from config import Config
+from model_registry import get_registry
+from persistence import HISTORY_FIELDS, AnalysisStore, decode_cursor, encode_cursor
+from response_format import shaped_response
+from result_cache import ResultCache, analysis_settings, hash_image_bytes, model_version
+from job_queue import JobManager, JobQueueFull
+from upload_ingest import UploadRequest
 
 app = Flask(__name__)
+# Uploads are hashed and checked while they stream in; larger bodies get 413 before parsing
+app.request_class = UploadRequest
+app.config['MAX_CONTENT_LENGTH'] = Config.MAX_CONTENT_LENGTH
 CORS(app)
 
 # Configuration
@@ -17,26 +34,24 @@ DATABASE = 'microplastic_analysis.db'
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 os.makedirs(RESULTS_FOLDER, exist_ok=True)
 
-# Components will be imported only when needed
+# Components are loaded lazily, once per process, through the model registry
+registry = get_registry()
+
+# Results of previously analyzed images, keyed by content hash
+result_cache = ResultCache()
+
+# Pooled connections and optional write-behind inserts for analysis records
+store = AnalysisStore(DATABASE)
 
 # Initialize database
 def init_db():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('''
-        CREATE TABLE IF NOT EXISTS analyses (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            filename TEXT NOT NULL,
-            analysis_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            microplastic_types TEXT,
-            confidence_scores TEXT,
-            particle_count INTEGER,
-            size_distribution TEXT,
-            recommendations TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+    store.init_db()
+    job_manager.init_db()
+
+def start_background_jobs():
+    """Create tables and resume analyses interrupted by a restart"""
+    init_db()
+    job_manager.resume_pending()
 
 @app.route('/')
 def index():
@@ -55,8 +70,46 @@ def index():
 def health():
     return 'OK', 200
 
+@app.route('/ready')
+def ready():
+    """200 once the model is loaded, 503 while it is still warming up or after a failed background load"""
+    if registry.stats['loaded']:
+        return 'OK', 200
+    if registry.stats.get('preload_error'):
+        return jsonify({'error': f"Model preload failed: {registry.stats['preload_error']}"}), 503
+    return 'Loading model', 503
+
+@app.route('/model/status')
+def model_status():
+    return jsonify(registry.get_stats())
+
+@app.route('/metrics')
+def prometheus_metrics():
+    # Per-process histograms; each gunicorn worker reports its own
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/db/stats')
+def db_stats():
+    return jsonify(store.get_stats())
+
+@app.route('/cache/stats')
+def cache_stats():
+    return jsonify(result_cache.get_stats())
+
+@app.errorhandler(413)
+@app.errorhandler(415)
+def upload_rejected(e):
+    return jsonify({'error': e.description}), e.code
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
+    """Analyze an uploaded image
+    
+    ?view=compact returns the de-duplicated compact schema and ?fields=
+    keeps only the listed dotted paths. The body is gzipped and/or sent as
+    MessagePack when the client's Accept-Encoding and Accept headers ask
+    for it.
+    """
     if 'file' not in request.files:
         return jsonify({'error': 'No file uploaded'}), 400
     
@@ -66,122 +119,235 @@ def upload_file():
     
     if file:
         filename = file.filename
-        filepath = os.path.join(UPLOAD_FOLDER, filename)
-        file.save(filepath)
+        # Streamed in by UploadRequest: already hashed, size-checked and sniffed
+        upload = file.stream.finish()
+        if Config.UPLOAD_PERSIST or request.form.get('persist', '').lower() in ('1', 'true', 'yes'):
+            upload.persist(UPLOAD_FOLDER)
         
-        # Analyze the image
+        # Analyze the image; the decoder reads the buffer in place
         try:
-            # Import components only when needed
-            from microplastic_analyzer import MicroplasticAnalyzer
-            from data_comparator import DataComparator
-            from solution_recommender import SolutionRecommender
-            import numpy as np
-            
-            analyzer = MicroplasticAnalyzer()
-            comparator = DataComparator()
-            recommender = SolutionRecommender()
-            
-            analysis_result = analyzer.analyze_image(filepath)
-            
-            # Compare with internet data
-            comparison_data = comparator.compare_with_online_data(analysis_result)
-            
-            # Get recommendations
-            recommendations = recommender.get_recommendations(analysis_result, comparison_data)
-            
-            # Convert numpy types to native Python types for JSON serialization
-            def convert_numpy_types(obj):
-                if isinstance(obj, np.integer):
-                    return int(obj)
-                elif isinstance(obj, np.floating):
-                    return float(obj)
-                elif isinstance(obj, np.ndarray):
-                    return obj.tolist()
-                elif isinstance(obj, dict):
-                    return {key: convert_numpy_types(value) for key, value in obj.items()}
-                elif isinstance(obj, list):
-                    return [convert_numpy_types(item) for item in obj]
-                return obj
-            
-            # Clean all data for JSON serialization
-            analysis_result_clean = convert_numpy_types(analysis_result)
-            comparison_data_clean = convert_numpy_types(comparison_data)
-            recommendations_clean = convert_numpy_types(recommendations)
-            
-            # Save to database
-            save_analysis_to_db(filename, analysis_result_clean, recommendations_clean)
-            
-            # Generate visualization
-            visualization_data = create_visualization(analysis_result_clean)
-            
-            return jsonify({
-                'success': True,
-                'analysis': analysis_result_clean,
-                'comparison': comparison_data_clean,
-                'recommendations': recommendations_clean,
-                'visualization': visualization_data
-            })
+            response_body, cache_status = run_analysis_pipeline(upload.view(), filename,
+                                                                site=request.form.get('site') or None,
+                                                                image_hash=upload.sha256)
+            response = shaped_response(response_body)
+            response.headers['X-Cache'] = cache_status
+            response.headers['X-Content-SHA256'] = upload.sha256
+            return response
             
         except Exception as e:
             return jsonify({'error': f'Analysis failed: {str(e)}'}), 500
 
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    if 'file' not in request.files:
+        return jsonify({'error': 'No file uploaded'}), 400
+    
+    file = request.files['file']
+    if file.filename == '':
+        return jsonify({'error': 'No file selected'}), 400
+    
+    try:
+        job_id = job_manager.submit(file.stream.finish().view(), file.filename,
+                                    site=request.form.get('site') or None)
+    except JobQueueFull:
+        response = jsonify({'error': 'Too many analyses queued, please retry later'})
+        response.headers['Retry-After'] = '10'
+        return response, 503
+    
+    return jsonify({
+        'job_id': job_id,
+        'status': 'queued',
+        'status_url': f'/jobs/{job_id}'
+    }), 202
+
+@app.route('/jobs/<job_id>')
+def get_job(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job)
+
+@metrics.instrument('pipeline_total')
+def run_analysis_pipeline(image_bytes, filename, progress_callback=None, site=None, image_hash=None):
+    """Run detection, comparison and recommendations; returns (response JSON bytes, cache status)
+    
+    image_bytes may be any bytes-like buffer. site optionally names the
+    sampling location the analysis is rolled up under; image_hash is the
+    SHA-256 of image_bytes when the caller already computed it.
+    """
+    def report(progress, stage):
+        if progress_callback is not None:
+            progress_callback(progress, stage)
+    
+    # Re-submitted images are answered from the cache without decoding them
+    image_hash = image_hash or hash_image_bytes(image_bytes)
+    settings = analysis_settings()
+    version = model_version()
+    cache_key = result_cache.make_key(image_hash, version, settings)
+    cached_response = result_cache.get(cache_key)
+    if cached_response is not None:
+        cached = json.loads(cached_response)
+        metrics.set_labels(particles=cached['analysis'].get('particle_count', 0))
+        save_analysis_to_db(filename, cached['analysis'], cached['recommendations'], site)
+        return cached_response, 'HIT'
+    
+    # Shared per-process components; the model is loaded only once
+    report(0.05, 'loading_model')
+    analyzer = registry.get_analyzer()
+    comparator = registry.get_comparator()
+    recommender = registry.get_recommender()
+    
+    # Classification dominates, so it reports progress per inference batch
+    report(0.1, 'analyzing')
+    analysis_result = analyzer.analyze_image(
+        image_bytes,
+        progress_callback=lambda done, total: report(0.1 + 0.7 * done / max(total, 1), 'classifying')
+    )
+    
+    # Compare with internet data
+    report(0.8, 'comparing')
+    comparison_data = comparator.compare_with_online_data(analysis_result)
+    
+    # Get recommendations
+    report(0.85, 'recommending')
+    recommendations = recommender.get_recommendations(analysis_result, comparison_data)
+    
+    # Generate visualization
+    visualization_data = create_visualization(analysis_result)
+    
+    # Each part is encoded once, NumPy values included; the comparison embeds
+    # the analysis, so its bytes are spliced in rather than encoded again
+    with metrics.timed('response_encoding'):
+        analysis_json = serialization.dumps(analysis_result)
+        recommendations_json = serialization.dumps(recommendations)
+        comparison_json = serialization.join_object(
+            (key, analysis_json if value is analysis_result else serialization.dumps(value))
+            for key, value in comparison_data.items()
+        )
+        response_body = serialization.join_object([
+            ('success', b'true'),
+            ('analysis', analysis_json),
+            ('comparison', comparison_json),
+            ('recommendations', recommendations_json),
+            ('visualization', serialization.dumps(visualization_data))
+        ])
+    
+    # Save to database; the stored recommendations are the response bytes
+    report(0.9, 'saving')
+    save_analysis_to_db(filename, analysis_result, recommendations_json, site)
+    
+    # On a fresh deployment the first analysis creates the model file, so the
+    # result is stored under the version that produced it
+    produced_by = model_version()
+    if produced_by != version:
+        cache_key = result_cache.make_key(image_hash, produced_by, settings)
+    result_cache.put(cache_key, response_body)
+    
+    return response_body, 'MISS'
+
+# Fields returned by /history when ?fields= is not given
+DEFAULT_HISTORY_FIELDS = ('id', 'filename', 'date', 'microplastic_types', 'particle_count')
+# Fields stored as JSON text, with the value returned when a row has none
+JSON_HISTORY_FIELDS = {'microplastic_types': list, 'confidence_scores': list,
+                       'size_distribution': dict, 'recommendations': dict}
+
 @app.route('/history')
 def get_history():
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    cursor.execute('SELECT * FROM analyses ORDER BY analysis_date DESC LIMIT 10')
-    results = cursor.fetchall()
-    conn.close()
-    
-    history = []
-    for result in results:
-        history.append({
-            'id': result[0],
-            'filename': result[1],
-            'date': result[2],
-            'microplastic_types': json.loads(result[3]) if result[3] else [],
-            'particle_count': result[5]
-        })
-    
-    return jsonify(history)
-
-def save_analysis_to_db(filename, analysis_result, recommendations):
-    conn = sqlite3.connect(DATABASE)
-    cursor = conn.cursor()
-    
-    # Convert numpy types to native Python types for JSON serialization
-    def convert_numpy_types(obj):
-        if isinstance(obj, np.integer):
-            return int(obj)
-        elif isinstance(obj, np.floating):
-            return float(obj)
-        elif isinstance(obj, np.ndarray):
-            return obj.tolist()
-        elif isinstance(obj, dict):
-            return {key: convert_numpy_types(value) for key, value in obj.items()}
-        elif isinstance(obj, list):
-            return [convert_numpy_types(item) for item in obj]
-        return obj
-    
-    # Convert all numpy types before JSON serialization
-    analysis_result_clean = convert_numpy_types(analysis_result)
-    recommendations_clean = convert_numpy_types(recommendations)
-    
-    cursor.execute('''
-        INSERT INTO analyses (filename, microplastic_types, confidence_scores, 
-                            particle_count, size_distribution, recommendations)
-        VALUES (?, ?, ?, ?, ?, ?)
-    ''', (
-        filename,
-        json.dumps(analysis_result_clean.get('types', [])),
-        json.dumps(analysis_result_clean.get('confidence_scores', [])),
-        int(analysis_result_clean.get('particle_count', 0)),
-        json.dumps(analysis_result_clean.get('size_distribution', {})),
-        json.dumps(recommendations_clean)
-    ))
-    conn.commit()
-    conn.close()
+    """Newest analyses first, one page per request
+    
+    Query parameters: limit (max 100), cursor (from the X-Next-Cursor header
+    of the previous page), type, min_particles, max_particles, since, until
+    and fields (comma-separated). Responses carry an ETag and Last-Modified
+    derived from the newest stored analysis, so unchanged pages return 304.
+    """
+    fields = request.args.get('fields')
+    fields = [field.strip() for field in fields.split(',') if field.strip()] if fields else list(DEFAULT_HISTORY_FIELDS)
+    unknown = [field for field in fields if field not in HISTORY_FIELDS]
+    if unknown:
+        return jsonify({'error': f"Unknown fields: {', '.join(unknown)}"}), 400
+    
+    try:
+        after = decode_cursor(request.args['cursor']) if 'cursor' in request.args else None
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    limit = max(1, min(request.args.get('limit', 10, type=int), 100))
+    
+    # Every insert changes the newest id, so this identifies the page's content
+    last_id, last_date = store.history_version()
+    etag = hashlib.sha256(f"{last_id}|{request.query_string.decode('latin-1')}".encode('utf-8')).hexdigest()[:32]
+    last_modified = (datetime.strptime(last_date, '%Y-%m-%d %H:%M:%S').replace(tzinfo=timezone.utc)
+                     if last_date else None)
+    
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = Response(status=304)
+    else:
+        rows, next_key = store.history(
+            fields,
+            limit=limit,
+            after=after,
+            particle_type=request.args.get('type'),
+            min_particles=request.args.get('min_particles', type=int),
+            max_particles=request.args.get('max_particles', type=int),
+            since=request.args.get('since'),
+            until=request.args.get('until')
+        )
+        for row in rows:
+            for field in JSON_HISTORY_FIELDS.keys() & row.keys():
+                row[field] = json.loads(row[field]) if row[field] else JSON_HISTORY_FIELDS[field]()
+        
+        response = jsonify(rows)
+        if next_key is not None:
+            cursor = encode_cursor(*next_key)
+            next_args = [(key, value) for key, value in request.args.items(multi=True) if key != 'cursor']
+            next_args.append(('cursor', cursor))
+            response.headers['X-Next-Cursor'] = cursor
+            response.headers['Link'] = f'<{request.base_url}?{urlencode(next_args)}>; rel="next"'
+    
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.no_cache = True
+    return response
+
+@app.route('/particles')
+def find_particles():
+    """Stored particles filtered by type, size in micrometers and analysis date"""
+    # Values that do not parse are ignored rather than rejected
+    rows = store.find_particles(
+        particle_type=request.args.get('type'),
+        min_size=request.args.get('min_size', type=float),
+        max_size=request.args.get('max_size', type=float),
+        since=request.args.get('since'),
+        until=request.args.get('until'),
+        limit=max(1, min(request.args.get('limit', 1000, type=int), 10000))
+    )
+    return jsonify([dict(row) for row in rows])
 
+@app.route('/trends')
+def get_trends():
+    """Particle totals, type counts and diversity per day, per site or for the whole window
+    
+    Query parameters: since and until ('YYYY-MM-DD', until exclusive), site
+    and group_by ('day', 'site' or 'none').
+    """
+    group_by = request.args.get('group_by', 'day')
+    try:
+        buckets = store.trends(
+            since=request.args.get('since'),
+            until=request.args.get('until'),
+            site=request.args.get('site'),
+            group_by=None if group_by == 'none' else group_by
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(buckets)
+
+@metrics.instrument('persistence')
+def save_analysis_to_db(filename, analysis_result, recommendations, site=None):
+    # NumPy values are handled by the encoder; recommendations may already be JSON bytes
+    store.save_analysis(filename, analysis_result, recommendations, site)
+
+@metrics.instrument('visualization')
 def create_visualization(analysis_result):
     # Create pie chart for microplastic types
     types = analysis_result.get('types', [])
@@ -190,12 +356,25 @@ def create_visualization(analysis_result):
     if not types:
         return None
     
+    import plotly
+    import plotly.graph_objects as go
+    
     fig = go.Figure(data=[go.Pie(labels=types, values=counts)])
     fig.update_layout(title="Microplastic Types Distribution")
     
     return json.dumps(fig, cls=plotly.utils.PlotlyJSONEncoder)
 
+# Background analyses; job state lives in the same SQLite database
+job_manager = JobManager(DATABASE, os.path.join(UPLOAD_FOLDER, 'jobs'), run_analysis_pipeline)
+
+startup_profile.mark('app_full imported')
+
 if __name__ == '__main__':
-    init_db()
+    from model_registry import preload_if_configured
+    
+    start_background_jobs()
+    preload_if_configured()
+    startup_profile.mark('startup complete')
+    startup_profile.report()
     port = int(os.environ.get('PORT', 5000))
     app.run(debug=False, host='0.0.0.0', port=port)
@@ -0,0 +1,198 @@
+"""
+Bulk analysis of image directories for the Microplastic Analysis System
+Spreads images over a process pool, streams results to JSON Lines and resumes after a crash
+"""
+
+import json
+import multiprocessing
+import os
+import time
+
+import serialization
+from config import Config
+
+# Per-worker components, created once by the pool initializer
+_worker_state = {}
+
+def find_images(directory, recursive=False):
+    """List image files in a directory with an allowed extension, in a stable order"""
+    images = []
+    if recursive:
+        for root, dirs, files in os.walk(directory):
+            dirs.sort()
+            for name in sorted(files):
+                images.append(os.path.join(root, name))
+    else:
+        images = [os.path.join(directory, name) for name in sorted(os.listdir(directory))]
+    
+    return [path for path in images
+            if os.path.isfile(path)
+            and os.path.splitext(path)[1].lower().lstrip('.') in Config.ALLOWED_EXTENSIONS]
+
+def load_checkpoint(output_path, retry_failed=False):
+    """Return the images already recorded in the output file
+    
+    Each result is one JSON line, so a crash can at most leave a partial
+    last line behind; such lines are ignored and the image is redone.
+    """
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    
+    with open(output_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get('status') == 'ok' or not retry_failed:
+                done.add(record['image'])
+    return done
+
+def _init_worker(with_recommendations, tiled):
+    """Load the model once per worker process"""
+    from microplastic_analyzer import MicroplasticAnalyzer
+    
+    _worker_state['analyzer'] = MicroplasticAnalyzer()
+    _worker_state['tiled'] = tiled
+    if with_recommendations:
+        from data_comparator import DataComparator
+        from solution_recommender import SolutionRecommender
+        _worker_state['comparator'] = DataComparator()
+        _worker_state['recommender'] = SolutionRecommender()
+
+def _analyze_path(image_path):
+    """Analyze one image inside a worker and return a JSON-ready record"""
+    start = time.perf_counter()
+    record = {'image': image_path, 'worker': os.getpid()}
+    try:
+        analyzer = _worker_state['analyzer']
+        if _worker_state['tiled']:
+            analysis = analyzer.analyze_image_tiled(image_path)
+        else:
+            analysis = analyzer.analyze_image(image_path)
+        record['analysis'] = analysis
+        
+        if 'comparator' in _worker_state:
+            comparison = _worker_state['comparator'].compare_with_online_data(analysis)
+            # The comparison embeds the analysis again; keep only the comparison itself
+            comparison.pop('sample_analysis', None)
+            record['comparison'] = comparison
+            record['recommendations'] = _worker_state['recommender'].get_recommendations(analysis, comparison)
+        
+        record['status'] = 'ok'
+    except Exception as e:
+        record['status'] = 'error'
+        record['error'] = str(e)
+    
+    record['seconds'] = round(time.perf_counter() - start, 4)
+    return record
+
+def run_batch(directory, output_path=None, workers=None, recursive=False, retry_failed=False,
+              with_recommendations=False, tiled=False, threads_per_worker=None):
+    """Analyze every image in a directory with a process pool and return a throughput summary"""
+    directory = os.path.abspath(directory)
+    if output_path is None:
+        os.makedirs('results', exist_ok=True)
+        output_path = os.path.join('results', f"batch_{os.path.basename(directory.rstrip(os.sep))}.jsonl")
+    
+    workers = workers or os.cpu_count() or 1
+    images = find_images(directory, recursive)
+    done = load_checkpoint(output_path, retry_failed)
+    pending = [path for path in images if path not in done]
+    
+    print(f"Found {len(images)} images, {len(images) - len(pending)} already done, "
+          f"{len(pending)} to analyze with {workers} workers")
+    
+    # Split the cores between workers so their math libraries do not oversubscribe the machine
+    threads = threads_per_worker or max(1, (os.cpu_count() or 1) // workers)
+    for variable in ('OMP_NUM_THREADS', 'TF_NUM_INTRAOP_THREADS', 'TFLITE_NUM_THREADS'):
+        os.environ[variable] = str(threads)
+    os.environ.setdefault('TF_NUM_INTEROP_THREADS', '1')
+    
+    summary = {
+        'directory': directory,
+        'output': output_path,
+        'workers': workers,
+        'images_total': len(images),
+        'images_skipped': len(images) - len(pending),
+        'images_ok': 0,
+        'images_failed': 0,
+        'particles': 0
+    }
+    
+    start = time.perf_counter()
+    busy_seconds = 0.0
+    
+    if pending:
+        # Spawned workers do not inherit TensorFlow state from the parent
+        context = multiprocessing.get_context('spawn')
+        with open(output_path, 'a') as output, context.Pool(
+                workers, initializer=_init_worker, initargs=(with_recommendations, tiled)) as pool:
+            for record in pool.imap_unordered(_analyze_path, pending, chunksize=1):
+                # One flushed line per image doubles as the resume checkpoint
+                output.write(serialization.dumps_text(record) + '\n')
+                output.flush()
+                os.fsync(output.fileno())
+                
+                busy_seconds += record['seconds']
+                if record['status'] == 'ok':
+                    summary['images_ok'] += 1
+                    summary['particles'] += record['analysis'].get('particle_count', 0)
+                else:
+                    summary['images_failed'] += 1
+                    print(f"✗ {record['image']}: {record['error']}")
+                
+                processed = summary['images_ok'] + summary['images_failed']
+                if processed % 50 == 0 or processed == len(pending):
+                    elapsed = time.perf_counter() - start
+                    print(f"  {processed}/{len(pending)} images, {processed / elapsed:.2f} images/s")
+    
+    elapsed = time.perf_counter() - start
+    processed = summary['images_ok'] + summary['images_failed']
+    summary.update({
+        'elapsed_seconds': round(elapsed, 2),
+        'images_per_second': round(processed / elapsed, 3) if elapsed > 0 else 0.0,
+        'particles_per_second': round(summary['particles'] / elapsed, 2) if elapsed > 0 else 0.0,
+        'mean_seconds_per_image': round(busy_seconds / processed, 4) if processed else 0.0,
+        'worker_utilization': round(busy_seconds / (elapsed * workers), 3) if elapsed > 0 else 0.0
+    })
+    
+    with open(output_path + '.summary.json', 'w') as f:
+        json.dump(summary, f, indent=2)
+    
+    return summary
+
+def main(argv=None):
+    """Command line entry point: batch <dir>"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Microplastic analysis tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    batch_parser = subparsers.add_parser('batch', help='Analyze every image in a directory')
+    batch_parser.add_argument('directory')
+    batch_parser.add_argument('-o', '--output', help='JSON Lines results file (also the resume checkpoint)')
+    batch_parser.add_argument('-w', '--workers', type=int, default=None, help='Worker processes (default: all cores)')
+    batch_parser.add_argument('--threads-per-worker', type=int, default=None)
+    batch_parser.add_argument('-r', '--recursive', action='store_true')
+    batch_parser.add_argument('--retry-failed', action='store_true', help='Re-run images that failed before')
+    batch_parser.add_argument('--with-recommendations', action='store_true',
+                              help='Also run the baseline comparison and recommendations')
+    batch_parser.add_argument('--tiled', action='store_true', help='Use tiled detection for large scans')
+    
+    args = parser.parse_args(argv)
+    summary = run_batch(
+        args.directory, args.output, args.workers, args.recursive, args.retry_failed,
+        args.with_recommendations, args.tiled, args.threads_per_worker
+    )
+    
+    print("\n" + "=" * 50)
+    print(f"Analyzed {summary['images_ok']} images ({summary['images_failed']} failed, "
+          f"{summary['images_skipped']} skipped) in {summary['elapsed_seconds']}s")
+    print(f"Throughput: {summary['images_per_second']} images/s, "
+          f"{summary['particles_per_second']} particles/s")
+    print(f"Worker utilization: {summary['worker_utilization'] * 100:.0f}%")
+    print(f"Results: {summary['output']}")
+    print("=" * 50)
+    return 0 if summary['images_failed'] == 0 else 1
@@ -0,0 +1,645 @@
+"""
+Performance benchmark suite for the Microplastic Analysis System
+Times every pipeline stage on seeded synthetic images and compares runs against a JSON baseline
+"""
+
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+from config import Config
+
+# Pipeline stages in execution order, as recorded in the metrics stage histogram;
+# pyramid_mask replaces bilateral_filter and threshold in pyramid detection mode
+STAGES = [
+    'decode',
+    'bilateral_filter',
+    'threshold',
+    'pyramid_mask',
+    'contours',
+    'feature_extraction',
+    'classification',
+    'summarize',
+    'comparison',
+    'recommendation',
+    'persistence'
+]
+
+# Default scenarios: the demo image size, a full HD frame and a dense 12 MP frame
+DEFAULT_SCENARIOS = [
+    {'name': 'demo_800x600', 'width': 800, 'height': 600, 'particles': 9,
+     'size_min': 22, 'size_max': 40, 'noise': 50, 'noise_sigma': 0.0, 'seed': 1},
+    {'name': 'hd_1920x1080', 'width': 1920, 'height': 1080, 'particles': 80,
+     'size_min': 15, 'size_max': 60, 'noise': 50, 'noise_sigma': 4.0, 'seed': 2},
+    {'name': 'dense_4000x3000', 'width': 4000, 'height': 3000, 'particles': 600,
+     'size_min': 10, 'size_max': 80, 'noise': 50, 'noise_sigma': 4.0, 'seed': 3}
+]
+
+# Pyramid detection targets large, mostly empty frames such as the 20 MP microscope camera's
+PYRAMID_SCENARIOS = DEFAULT_SCENARIOS + [
+    {'name': 'sparse_5472x3648', 'width': 5472, 'height': 3648, 'particles': 150,
+     'size_min': 10, 'size_max': 80, 'noise': 50, 'noise_sigma': 2.0, 'seed': 4}
+]
+
+DEFAULT_BASELINE = os.path.join('results', 'benchmark_baseline.json')
+DEFAULT_PYRAMID_REPORT = os.path.join('results', 'pyramid_report.json')
+DEFAULT_SERIALIZATION_REPORT = os.path.join('results', 'serialization_report.json')
+
+def _environment():
+    """Describe the machine and library versions a result was measured with"""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'inference_backend': Config.INFERENCE_BACKEND,
+        'inference_batch_size': Config.INFERENCE_BATCH_SIZE
+    }
+
+def make_scenario_image(scenario):
+    """Render a scenario's synthetic image and return it encoded as PNG bytes"""
+    from demo import create_synthetic_microplastic_image
+    
+    image = create_synthetic_microplastic_image(
+        width=scenario['width'], height=scenario['height'],
+        particle_count=scenario['particles'],
+        size_range=(scenario['size_min'], scenario['size_max']),
+        noise=scenario['noise'], noise_sigma=scenario['noise_sigma'],
+        seed=scenario['seed']
+    )
+    rgb = np.asarray(image)
+    ok, encoded = cv2.imencode('.png', cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+    if not ok:
+        raise ValueError("Could not encode benchmark image")
+    return encoded.tobytes()
+
+class _PersistenceTarget:
+    """Throwaway database with the production analyses schema"""
+    
+    def __init__(self):
+        from persistence import AnalysisStore
+        
+        self._directory = tempfile.TemporaryDirectory(prefix='microplastic-bench-')
+        self.path = os.path.join(self._directory.name, 'bench.db')
+        # Synchronous writes, so the persistence stage measures the insert itself
+        self.store = AnalysisStore(self.path, write_behind=False)
+        self.store.init_db()
+    
+    def save(self, analysis_result, recommendations):
+        self.store.save_analysis('benchmark.png', analysis_result, recommendations)
+    
+    def close(self):
+        self._directory.cleanup()
+
+def run_pipeline_once(image_bytes, analyzer, comparator, recommender, persistence):
+    """Run the full pipeline on one image and return per-stage seconds, total seconds and the particle count
+    
+    The analyzer, comparator and recommender run exactly as in production;
+    stage times are the growth of the metrics stage histogram over the run,
+    so metrics must be enabled.
+    """
+    import metrics
+    
+    before = metrics.stage_totals()
+    start = time.perf_counter()
+    with metrics.trace():
+        analysis_result = analyzer.analyze_image(image_bytes)
+        comparison = comparator.compare_with_online_data(analysis_result)
+        recommendations = recommender.get_recommendations(analysis_result, comparison)
+        with metrics.timed('persistence'):
+            persistence.save(analysis_result, recommendations)
+    total = time.perf_counter() - start
+    
+    after = metrics.stage_totals()
+    timings = {stage: after[stage] - before.get(stage, 0.0) for stage in STAGES if stage in after}
+    return timings, total, analysis_result.get('particle_count', 0)
+
+def _summarize_samples(samples):
+    """Millisecond statistics for one stage"""
+    ordered = sorted(samples)
+    p95_index = min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))
+    return {
+        'median_ms': round(statistics.median(ordered) * 1000.0, 3),
+        'mean_ms': round(statistics.fmean(ordered) * 1000.0, 3),
+        'min_ms': round(ordered[0] * 1000.0, 3),
+        'p95_ms': round(ordered[p95_index] * 1000.0, 3),
+        'stdev_ms': round(statistics.stdev(ordered) * 1000.0, 3) if len(ordered) > 1 else 0.0
+    }
+
+def run_suite(scenarios=None, repeats=5, warmup=1):
+    """Benchmark every scenario and return a JSON-ready report"""
+    from model_registry import get_registry
+    
+    scenarios = scenarios or DEFAULT_SCENARIOS
+    # Stage times are read from the metrics histogram
+    Config.METRICS_ENABLED = True
+    registry = get_registry()
+    analyzer = registry.get_analyzer()
+    comparator = registry.get_comparator()
+    recommender = registry.get_recommender()
+    persistence = _PersistenceTarget()
+    
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': _environment(),
+        'repeats': repeats,
+        'warmup': warmup,
+        'scenarios': {}
+    }
+    
+    try:
+        for scenario in scenarios:
+            image_bytes = make_scenario_image(scenario)
+            samples = {stage: [] for stage in STAGES}
+            totals = []
+            particle_count = 0
+            
+            for iteration in range(warmup + repeats):
+                timings, total, particle_count = run_pipeline_once(
+                    image_bytes, analyzer, comparator, recommender, persistence
+                )
+                if iteration >= warmup:
+                    for stage, seconds in timings.items():
+                        samples[stage].append(seconds)
+                    totals.append(total)
+            
+            # Stages the detection mode skips are left out
+            stages = {stage: _summarize_samples(values) for stage, values in samples.items() if values}
+            report['scenarios'][scenario['name']] = {
+                'parameters': scenario,
+                'image_bytes': len(image_bytes),
+                'particles_detected': particle_count,
+                'stages': stages,
+                'total': _summarize_samples(totals)
+            }
+            print(f"{scenario['name']}: {particle_count} particles, "
+                  f"median total {report['scenarios'][scenario['name']]['total']['median_ms']:.1f} ms")
+    finally:
+        persistence.close()
+    
+    return report
+
+def pyramid_report(scenarios=None, repeats=3):
+    """Accuracy and speed of pyramid detection against the full-frame path
+    
+    Both paths are timed from the grayscale image to the particle table.
+    Accuracy is measured on the binary masks (pixels that differ) and on
+    the detected particles (identical bounding boxes).
+    """
+    from model_registry import get_registry
+    from pyramid_detection import build_pyramid_mask
+    
+    scenarios = scenarios or PYRAMID_SCENARIOS
+    analyzer = get_registry().get_analyzer()
+    
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': _environment(),
+        'settings': {
+            'scale': Config.PYRAMID_SCALE,
+            'contrast': Config.PYRAMID_CONTRAST,
+            'max_coverage': Config.PYRAMID_MAX_COVERAGE
+        },
+        'repeats': repeats,
+        'scenarios': {}
+    }
+    
+    for scenario in scenarios:
+        image = analyzer.load_image(make_scenario_image(scenario))
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        
+        timings = {'full': [], 'pyramid': []}
+        tables = {}
+        for _ in range(repeats):
+            for mode in ('full', 'pyramid'):
+                start = time.perf_counter()
+                tables[mode] = analyzer._find_particles(gray, mode=mode)
+                timings[mode].append(time.perf_counter() - start)
+        
+        full_mask = analyzer._particle_mask(gray)
+        pyramid_mask, pyramid_stats = build_pyramid_mask(
+            gray, analyzer._particle_mask, Config.PYRAMID_SCALE,
+            Config.PYRAMID_CONTRAST, Config.PYRAMID_MAX_COVERAGE
+        )
+        differing = int(np.count_nonzero(full_mask != pyramid_mask))
+        
+        full_boxes = set(map(tuple, tables['full'].bbox.tolist()))
+        pyramid_boxes = set(map(tuple, tables['pyramid'].bbox.tolist()))
+        matched = len(full_boxes & pyramid_boxes)
+        
+        full_ms = statistics.median(timings['full']) * 1000.0
+        pyramid_ms = statistics.median(timings['pyramid']) * 1000.0
+        report['scenarios'][scenario['name']] = {
+            'parameters': scenario,
+            'full_ms': round(full_ms, 3),
+            'pyramid_ms': round(pyramid_ms, 3),
+            'speedup': round(full_ms / pyramid_ms, 2) if pyramid_ms > 0 else None,
+            'candidates': pyramid_stats['candidates'],
+            'coverage': pyramid_stats['coverage'],
+            'fallback': pyramid_stats['fallback'],
+            'mask_pixels_differing': differing,
+            'mask_agreement': round(1.0 - differing / float(gray.size), 6),
+            'particles_full': len(full_boxes),
+            'particles_pyramid': len(pyramid_boxes),
+            'particles_matched': matched,
+            'recall': round(matched / len(full_boxes), 4) if full_boxes else 1.0,
+            'precision': round(matched / len(pyramid_boxes), 4) if pyramid_boxes else 1.0
+        }
+    
+    return report
+
+def _print_pyramid_report(report):
+    print(f"{'scenario':<18} {'full':>9} {'pyramid':>9} {'speedup':>8} {'coverage':>9} "
+          f"{'mask agree':>11} {'recall':>7} {'precision':>9}")
+    for name, row in report['scenarios'].items():
+        speedup = f"{row['speedup']:.2f}x" if row['speedup'] else '-'
+        coverage = 'fallback' if row['fallback'] else f"{row['coverage'] * 100:.1f}%"
+        print(f"{name:<18} {row['full_ms']:>7.1f}ms {row['pyramid_ms']:>7.1f}ms {speedup:>8} {coverage:>9} "
+              f"{row['mask_agreement'] * 100:>10.4f}% {row['recall']:>7.3f} {row['precision']:>9.3f}")
+
+def memory_report(scenarios=None, repeats=5):
+    """Per-request Python/NumPy heap peak and buffer reuse for analyze_image
+    
+    tracemalloc sees every NumPy array, including OpenCV outputs, so the
+    peak per request measures the working images and crop batches. Model
+    internals allocated by TensorFlow are not included.
+    """
+    import tracemalloc
+    from model_registry import _current_rss_mb, get_registry
+    
+    scenarios = scenarios or DEFAULT_SCENARIOS
+    analyzer = get_registry().get_analyzer()
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': _environment(),
+        'repeats': repeats,
+        'scenarios': {}
+    }
+    
+    for scenario in scenarios:
+        image_bytes = make_scenario_image(scenario)
+        rss_before = _current_rss_mb()
+        # Warm up so one-time buffer growth is not counted per request
+        analyzer.analyze_image(image_bytes)
+        arena_before = analyzer.get_arena_stats()
+        
+        peaks = []
+        tracemalloc.start()
+        try:
+            for _ in range(repeats):
+                baseline, _ = tracemalloc.get_traced_memory()
+                tracemalloc.reset_peak()
+                analyzer.analyze_image(image_bytes)
+                _, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - baseline)
+        finally:
+            tracemalloc.stop()
+        
+        arena_after = analyzer.get_arena_stats()
+        report['scenarios'][scenario['name']] = {
+            'parameters': scenario,
+            'peak_heap_mb_per_request': round(statistics.median(peaks) / (1024.0 * 1024.0), 2),
+            'arena_allocations_per_request': round(
+                (arena_after['allocations'] + arena_after['oversize']
+                 - arena_before['allocations'] - arena_before['oversize']) / repeats, 2),
+            'arena_reuses_per_request': round((arena_after['reuses'] - arena_before['reuses']) / repeats, 2),
+            'arena_held_mb': arena_after['held_mb'],
+            'rss_growth_mb': round(_current_rss_mb() - rss_before, 1) if rss_before is not None else None
+        }
+        print(f"{scenario['name']}: peak heap "
+              f"{report['scenarios'][scenario['name']]['peak_heap_mb_per_request']:.2f} MB per request")
+    
+    report['process_rss_mb'] = _current_rss_mb()
+    return report
+
+# MicroplasticAnalyzer.microplastic_types in class id order
+MODEL_CLASSES = [
+    'Polyethylene (PE)', 'Polypropylene (PP)', 'Polystyrene (PS)', 'Polyvinyl Chloride (PVC)',
+    'Polyethylene Terephthalate (PET)', 'Polyamide (Nylon)', 'Acrylic', 'Unknown/Other'
+]
+
+def _legacy_convert_numpy_types(obj):
+    """The recursive conversion app_full used before serialization.dumps (benchmark reference only)"""
+    if isinstance(obj, np.integer):
+        return int(obj)
+    elif isinstance(obj, np.floating):
+        return float(obj)
+    elif isinstance(obj, np.ndarray):
+        return obj.tolist()
+    elif isinstance(obj, dict):
+        return {key: _legacy_convert_numpy_types(value) for key, value in obj.items()}
+    elif isinstance(obj, list):
+        return [_legacy_convert_numpy_types(item) for item in obj]
+    return obj
+
+def make_analysis_result(particles, seed=0):
+    """A seeded analysis result shaped like MicroplasticAnalyzer output, without running detection"""
+    rng = np.random.default_rng(seed)
+    types = MODEL_CLASSES
+    scores = rng.dirichlet(np.ones(len(types)), size=particles)
+    sizes = rng.integers(10, 900, size=particles)
+    shape = rng.random((particles, 4))
+    
+    type_counts = {}
+    records = []
+    for index in range(particles):
+        class_id = np.argmax(scores[index])
+        particle_type = types[class_id]
+        type_counts[particle_type] = type_counts.get(particle_type, 0) + 1
+        records.append({
+            'size_micrometers': int(sizes[index]),
+            'area': float(shape[index, 0] * 5000.0),
+            'classification': {
+                'type': particle_type,
+                'confidence': float(scores[index, class_id]),
+                'class_id': class_id,  # np.int64, as in _interpret_prediction
+                'all_scores': [float(score) for score in scores[index]],
+                'particle_features': {
+                    'circularity': float(shape[index, 1]),
+                    'solidity': float(shape[index, 2]),
+                    'aspect_ratio': float(shape[index, 3])
+                }
+            },
+            'circularity': float(shape[index, 1]),
+            'solidity': float(shape[index, 2]),
+            'aspect_ratio': float(shape[index, 3])
+        })
+    
+    confidence_scores = [record['classification']['confidence'] for record in records]
+    return {
+        'types': list(type_counts.keys()),
+        'counts': list(type_counts.values()),
+        'confidence_scores': confidence_scores,
+        'particle_count': particles,
+        'size_distribution': {
+            'small': int(np.count_nonzero(sizes < 100)),
+            'medium': int(np.count_nonzero((sizes >= 100) & (sizes < 500))),
+            'large': int(np.count_nonzero(sizes >= 500))
+        },
+        'particles': records,
+        'average_confidence': float(np.mean(confidence_scores)) if confidence_scores else 0.0
+    }
+
+def serialization_report(particle_counts=(500, 5000, 50000), repeats=5):
+    """Encoding cost of one /upload result: the former convert-then-dumps path against serialization
+    
+    Both paths produce the response body and the JSON columns of the
+    analyses row from the same analysis, comparison and recommendations.
+    The legacy path converts NumPy values in the pipeline, converts the
+    analysis and recommendations again before saving and encodes every part
+    separately; the current path encodes each part once and reuses the
+    recommendations bytes for the row. Visualization is left out of both.
+    """
+    import serialization
+    from model_registry import get_registry
+    
+    registry = get_registry()
+    comparator = registry.get_comparator()
+    recommender = registry.get_recommender()
+    
+    def legacy(analysis, comparison, recommendations):
+        analysis_clean = _legacy_convert_numpy_types(analysis)
+        comparison_clean = _legacy_convert_numpy_types(comparison)
+        recommendations_clean = _legacy_convert_numpy_types(recommendations)
+        # save_analysis_to_db converted again, then each column was dumped
+        stored_analysis = _legacy_convert_numpy_types(analysis_clean)
+        stored_recommendations = _legacy_convert_numpy_types(recommendations_clean)
+        row = (json.dumps(stored_analysis.get('types', [])), json.dumps(stored_analysis.get('confidence_scores', [])),
+               json.dumps(stored_analysis.get('size_distribution', {})), json.dumps(stored_recommendations))
+        body = json.dumps({
+            'success': True,
+            'analysis': analysis_clean,
+            'comparison': comparison_clean,
+            'recommendations': recommendations_clean
+        }).encode('utf-8')
+        return body, row
+    
+    def current(analysis, comparison, recommendations):
+        analysis_json = serialization.dumps(analysis)
+        recommendations_json = serialization.dumps(recommendations)
+        comparison_json = serialization.join_object(
+            (key, analysis_json if value is analysis else serialization.dumps(value))
+            for key, value in comparison.items()
+        )
+        body = serialization.join_object([
+            ('success', b'true'),
+            ('analysis', analysis_json),
+            ('comparison', comparison_json),
+            ('recommendations', recommendations_json)
+        ])
+        row = (serialization.dumps_text(analysis.get('types', [])),
+               serialization.dumps_text(analysis.get('confidence_scores', [])),
+               serialization.dumps_text(analysis.get('size_distribution', {})),
+               recommendations_json.decode('utf-8'))
+        return body, row
+    
+    report = {
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': _environment(),
+        'encoder': 'orjson' if serialization._orjson is not None else 'json',
+        'repeats': repeats,
+        'particle_counts': {}
+    }
+    
+    for particles in particle_counts:
+        analysis = make_analysis_result(particles, seed=particles)
+        comparison = comparator.compare_with_online_data(analysis)
+        recommendations = recommender.get_recommendations(analysis, comparison)
+        
+        timings = {'legacy': [], 'current': []}
+        outputs = {}
+        for _ in range(repeats):
+            for name, encode in (('legacy', legacy), ('current', current)):
+                start = time.perf_counter()
+                outputs[name] = encode(analysis, comparison, recommendations)
+                timings[name].append(time.perf_counter() - start)
+        
+        legacy_ms = statistics.median(timings['legacy']) * 1000.0
+        current_ms = statistics.median(timings['current']) * 1000.0
+        report['particle_counts'][str(particles)] = {
+            'legacy_ms': round(legacy_ms, 3),
+            'current_ms': round(current_ms, 3),
+            'speedup': round(legacy_ms / current_ms, 2) if current_ms > 0 else None,
+            'legacy_bytes': len(outputs['legacy'][0]),
+            'current_bytes': len(outputs['current'][0]),
+            # Same documents and same stored values, whitespace and key order aside
+            'equivalent': (json.loads(outputs['legacy'][0]) == json.loads(outputs['current'][0])
+                           and [json.loads(text) for text in outputs['legacy'][1]]
+                           == [json.loads(text) for text in outputs['current'][1]])
+        }
+        row = report['particle_counts'][str(particles)]
+        print(f"{particles:>7} particles: legacy {legacy_ms:8.1f}ms  {report['encoder']} {current_ms:8.1f}ms  "
+              f"{row['speedup']}x  equivalent={row['equivalent']}")
+    
+    return report
+
+def compare_reports(baseline, current, tolerance=0.15, min_delta_ms=1.0):
+    """Compare median stage times and return a list of rows, flagging regressions
+    
+    A stage regresses when its median grows by more than `tolerance` (relative)
+    and by more than `min_delta_ms`, so sub-millisecond jitter is not reported.
+    """
+    rows = []
+    for name, base_scenario in baseline['scenarios'].items():
+        current_scenario = current['scenarios'].get(name)
+        if current_scenario is None:
+            continue
+        
+        stages = list(STAGES) + ['total']
+        for stage in stages:
+            if stage == 'total':
+                base_stats, current_stats = base_scenario['total'], current_scenario['total']
+            else:
+                base_stats = base_scenario['stages'].get(stage)
+                current_stats = current_scenario['stages'].get(stage)
+            if base_stats is None or current_stats is None:
+                continue
+            
+            base_ms = base_stats['median_ms']
+            current_ms = current_stats['median_ms']
+            ratio = current_ms / base_ms if base_ms > 0 else float('inf')
+            delta = current_ms - base_ms
+            rows.append({
+                'scenario': name,
+                'stage': stage,
+                'baseline_ms': base_ms,
+                'current_ms': current_ms,
+                'change': round(ratio - 1.0, 4),
+                'regression': ratio > 1.0 + tolerance and delta > min_delta_ms,
+                'improvement': ratio < 1.0 - tolerance and -delta > min_delta_ms
+            })
+    return rows
+
+def _print_comparison(rows, tolerance):
+    print(f"{'scenario':<18} {'stage':<20} {'baseline':>10} {'current':>10} {'change':>8}")
+    for row in rows:
+        flag = '  REGRESSION' if row['regression'] else ('  faster' if row['improvement'] else '')
+        print(f"{row['scenario']:<18} {row['stage']:<20} {row['baseline_ms']:>8.2f}ms "
+              f"{row['current_ms']:>8.2f}ms {row['change'] * 100:>+7.1f}%{flag}")
+    
+    regressions = [row for row in rows if row['regression']]
+    print(f"\n{len(regressions)} regression(s) beyond {tolerance * 100:.0f}% tolerance")
+    return regressions
+
+def _write_report(report, path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results written to {path}")
+
+def main(argv=None):
+    """Command line entry point: run | compare | pyramid | memory | serialization"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(description='Microplastic analysis performance benchmarks')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    run_parser = subparsers.add_parser('run', help='Run the benchmark suite and write a baseline')
+    run_parser.add_argument('-o', '--output', default=DEFAULT_BASELINE)
+    run_parser.add_argument('--repeats', type=int, default=5)
+    run_parser.add_argument('--warmup', type=int, default=1)
+    run_parser.add_argument('--scenario', action='append', dest='scenarios',
+                            help='Only run the named default scenario (repeatable)')
+    run_parser.add_argument('--width', type=int, help='Custom scenario: image width')
+    run_parser.add_argument('--height', type=int, help='Custom scenario: image height')
+    run_parser.add_argument('--particles', type=int, default=50, help='Custom scenario: particle count')
+    run_parser.add_argument('--size-min', type=int, default=15, help='Custom scenario: smallest particle (px)')
+    run_parser.add_argument('--size-max', type=int, default=60, help='Custom scenario: largest particle (px)')
+    run_parser.add_argument('--noise', type=float, default=50, help='Custom scenario: specks per 800x600 pixels')
+    run_parser.add_argument('--noise-sigma', type=float, default=0.0, help='Custom scenario: Gaussian noise')
+    run_parser.add_argument('--seed', type=int, default=0)
+    
+    compare_parser = subparsers.add_parser('compare', help='Compare against a baseline and flag regressions')
+    compare_parser.add_argument('baseline', nargs='?', default=DEFAULT_BASELINE)
+    compare_parser.add_argument('--current', help='Existing results file (default: run the baseline scenarios now)')
+    compare_parser.add_argument('-o', '--output', help='Also write the new results here')
+    compare_parser.add_argument('--tolerance', type=float, default=0.15,
+                                help='Allowed relative slowdown per stage (default 0.15 = 15%%)')
+    compare_parser.add_argument('--min-delta-ms', type=float, default=1.0,
+                                help='Ignore slowdowns smaller than this many milliseconds')
+    compare_parser.add_argument('--repeats', type=int, help='Override the baseline repeat count')
+    
+    pyramid_parser = subparsers.add_parser('pyramid', help='Accuracy-vs-speed report for pyramid detection')
+    pyramid_parser.add_argument('-o', '--output', default=DEFAULT_PYRAMID_REPORT)
+    pyramid_parser.add_argument('--repeats', type=int, default=3)
+    
+    memory_parser = subparsers.add_parser('memory', help='Per-request heap peak and buffer reuse')
+    memory_parser.add_argument('-o', '--output', default=os.path.join('results', 'memory_report.json'))
+    memory_parser.add_argument('--repeats', type=int, default=5)
+    
+    serialization_parser = subparsers.add_parser('serialization',
+                                                 help='Result encoding cost on large particle lists')
+    serialization_parser.add_argument('-o', '--output', default=DEFAULT_SERIALIZATION_REPORT)
+    serialization_parser.add_argument('--particles', type=int, action='append',
+                                      help='Particle count to measure (repeatable; default 500, 5000, 50000)')
+    serialization_parser.add_argument('--repeats', type=int, default=5)
+    
+    args = parser.parse_args(argv)
+    
+    if args.command == 'serialization':
+        report = serialization_report(args.particles or (500, 5000, 50000), args.repeats)
+        _write_report(report, args.output)
+        return 0
+    
+    if args.command == 'memory':
+        _write_report(memory_report(repeats=args.repeats), args.output)
+        return 0
+    
+    if args.command == 'pyramid':
+        report = pyramid_report(repeats=args.repeats)
+        _print_pyramid_report(report)
+        _write_report(report, args.output)
+        return 0
+    
+    if args.command == 'run':
+        if args.width and args.height:
+            scenarios = [{
+                'name': f"custom_{args.width}x{args.height}", 'width': args.width, 'height': args.height,
+                'particles': args.particles, 'size_min': args.size_min, 'size_max': args.size_max,
+                'noise': args.noise, 'noise_sigma': args.noise_sigma, 'seed': args.seed
+            }]
+        elif args.scenarios:
+            scenarios = [s for s in DEFAULT_SCENARIOS if s['name'] in args.scenarios]
+            if not scenarios:
+                parser.error(f"unknown scenario; choose from {[s['name'] for s in DEFAULT_SCENARIOS]}")
+        else:
+            scenarios = DEFAULT_SCENARIOS
+        
+        report = run_suite(scenarios, args.repeats, args.warmup)
+        _write_report(report, args.output)
+        return 0
+    
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    
+    if args.current:
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        # Re-run exactly the scenarios the baseline measured
+        scenarios = [entry['parameters'] for entry in baseline['scenarios'].values()]
+        current = run_suite(scenarios, args.repeats or baseline['repeats'], baseline.get('warmup', 1))
+    
+    if args.output:
+        _write_report(current, args.output)
+    
+    if baseline.get('environment') != current.get('environment'):
+        print("Note: baseline was recorded in a different environment; timings may not be comparable")
+    
+    rows = compare_reports(baseline, current, args.tolerance, args.min_delta_ms)
+    regressions = _print_comparison(rows, args.tolerance)
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
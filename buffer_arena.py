@@ -0,0 +1,57 @@
+"""
+Reusable scratch buffers for image preprocessing and crop batches
+Keeps one growing array per name so repeated analyses do not reallocate their working images
+"""
+
+import numpy as np
+
+from config import Config
+
+class BufferArena:
+    """Named scratch arrays reused across calls by a single thread
+    
+    get() hands out a view of the named buffer with the requested shape and
+    dtype, reallocating only when the buffer is too small. A returned view
+    stays valid until the same name is requested again, so callers must be
+    done with it (or have copied it) before the next call.
+    """
+    
+    def __init__(self, max_bytes=None):
+        self.max_bytes = int(Config.BUFFER_ARENA_MAX_MB * 1024 * 1024) if max_bytes is None else max_bytes
+        self._buffers = {}
+        self._held = 0
+        self.stats = {'allocations': 0, 'reuses': 0, 'oversize': 0}
+    
+    def get(self, name, shape, dtype=np.uint8):
+        """Return an uninitialized, C-contiguous array of the given shape from the named buffer"""
+        dtype = np.dtype(dtype)
+        shape = tuple(int(n) for n in shape)
+        size = int(np.prod(shape)) * dtype.itemsize
+        
+        buffer = self._buffers.get(name)
+        if buffer is not None and buffer.nbytes >= size:
+            self.stats['reuses'] += 1
+            return buffer[:size].view(dtype).reshape(shape)
+        
+        held = self._held - (buffer.nbytes if buffer is not None else 0)
+        if held + size > self.max_bytes:
+            # Too big to keep around; hand out a one-off array instead
+            self.stats['oversize'] += 1
+            return np.empty(shape, dtype=dtype)
+        
+        buffer = np.empty(size, dtype=np.uint8)
+        self._buffers[name] = buffer
+        self._held = held + size
+        self.stats['allocations'] += 1
+        return buffer.view(dtype).reshape(shape)
+    
+    def clear(self):
+        """Release every buffer"""
+        self._buffers.clear()
+        self._held = 0
+    
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['buffers'] = len(self._buffers)
+        stats['held_mb'] = round(self._held / (1024.0 * 1024.0), 2)
+        return stats
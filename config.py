@@ -14,7 +14,11 @@ class Config:
     # File upload settings
     UPLOAD_FOLDER = os.environ.get('UPLOAD_FOLDER', 'uploads')
     MAX_CONTENT_LENGTH = int(os.environ.get('MAX_FILE_SIZE', 10 * 1024 * 1024))  # 10MB
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tiff'}
+    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'tif', 'tiff'}
+    # Uploads larger than this are spooled to an anonymous temporary file instead of memory
+    UPLOAD_SPOOL_BYTES = int(os.environ.get('UPLOAD_SPOOL_BYTES', 4 * 1024 * 1024))
+    # Keep every upload in UPLOAD_FOLDER by content hash (per request: form field persist=true)
+    UPLOAD_PERSIST = os.environ.get('UPLOAD_PERSIST', 'False').lower() == 'true'
     
     # Database settings
     DATABASE_PATH = os.environ.get('DATABASE_PATH', 'microplastic_analysis.db')
@@ -22,11 +26,75 @@ class Config:
     # Model settings
     MODEL_PATH = os.environ.get('MODEL_PATH', 'models/microplastic_model.h5')
     INPUT_SIZE = (224, 224)
+    INFERENCE_BATCH_SIZE = int(os.environ.get('INFERENCE_BATCH_SIZE', 32))
+    PRELOAD_MODEL = os.environ.get('PRELOAD_MODEL', 'True').lower() == 'true'
+    # Load the model on a background thread so the worker serves /health immediately.
+    # With the default (False), gunicorn's post_worker_init blocks on the full
+    # model load, so a worker answers nothing, /health included, until it is done.
+    PRELOAD_IN_BACKGROUND = os.environ.get('PRELOAD_IN_BACKGROUND', 'False').lower() == 'true'
+    # Per-thread scratch buffers reused across analyses (0 disables reuse)
+    BUFFER_ARENA_MAX_MB = float(os.environ.get('BUFFER_ARENA_MAX_MB', 256))
+    
+    # Cross-request micro-batching: crops from concurrent analyses share forward passes
+    INFERENCE_SCHEDULER_ENABLED = os.environ.get('INFERENCE_SCHEDULER_ENABLED', 'False').lower() == 'true'
+    INFERENCE_MAX_BATCH_SIZE = int(os.environ.get('INFERENCE_MAX_BATCH_SIZE', 64))
+    INFERENCE_MAX_DELAY_MS = float(os.environ.get('INFERENCE_MAX_DELAY_MS', 5))
+    
+    # Inference backend: 'keras', 'tflite' (uses TFLITE_QUANTIZATION), 'tflite-float16' or 'tflite-int8'
+    INFERENCE_BACKEND = os.environ.get('INFERENCE_BACKEND', 'keras')
+    TFLITE_MODEL_PATH = os.environ.get('TFLITE_MODEL_PATH', 'models/microplastic_model_{quantization}.tflite')
+    TFLITE_QUANTIZATION = os.environ.get('TFLITE_QUANTIZATION', 'float16')
+    TFLITE_NUM_THREADS = int(os.environ.get('TFLITE_NUM_THREADS', os.cpu_count() or 1))
+    TFLITE_CALIBRATION_DIR = os.environ.get('TFLITE_CALIBRATION_DIR', '')
     
     # Analysis settings
     MIN_PARTICLE_AREA = int(os.environ.get('MIN_PARTICLE_AREA', 50))
     CONFIDENCE_THRESHOLD = float(os.environ.get('CONFIDENCE_THRESHOLD', 0.5))
     
+    # Detection mode: 'full' filters the whole frame, 'pyramid' only candidate regions
+    # found on a PYRAMID_SCALE-times downscaled copy (for large, mostly empty images)
+    DETECTION_MODE = os.environ.get('DETECTION_MODE', 'full').lower()
+    PYRAMID_SCALE = int(os.environ.get('PYRAMID_SCALE', 4))
+    PYRAMID_CONTRAST = int(os.environ.get('PYRAMID_CONTRAST', 8))  # grey levels
+    PYRAMID_MAX_COVERAGE = float(os.environ.get('PYRAMID_MAX_COVERAGE', 0.6))
+    
+    # Tiled detection settings for whole-slide scans
+    # Particles up to about TILE_OVERLAP / 2 pixels are detected exactly
+    TILE_SIZE = int(os.environ.get('TILE_SIZE', 4096))
+    TILE_OVERLAP = int(os.environ.get('TILE_OVERLAP', 1024))
+    
+    # Video / time-lapse analysis (video_analysis.py)
+    VIDEO_SEQUENCE_FPS = float(os.environ.get('VIDEO_SEQUENCE_FPS', 1.0))  # for numbered image sequences
+    VIDEO_WINDOW_SECONDS = float(os.environ.get('VIDEO_WINDOW_SECONDS', 10))
+    # Grey levels a PYRAMID_SCALE-downscaled block must change by to be re-analyzed
+    VIDEO_MOTION_THRESHOLD = int(os.environ.get('VIDEO_MOTION_THRESHOLD', 12))
+    VIDEO_TRACK_MAX_DISTANCE = float(os.environ.get('VIDEO_TRACK_MAX_DISTANCE', 40))  # pixels per frame
+    VIDEO_TRACK_MAX_GAP = int(os.environ.get('VIDEO_TRACK_MAX_GAP', 5))  # frames a track survives unseen
+    
+    # Result cache settings
+    RESULT_CACHE_ENABLED = os.environ.get('RESULT_CACHE_ENABLED', 'True').lower() == 'true'
+    RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 256))  # in-memory entries
+    RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', os.path.join('results', 'cache'))
+    
+    # Background job settings (POST /jobs)
+    JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+    JOB_QUEUE_SIZE = int(os.environ.get('JOB_QUEUE_SIZE', 32))  # jobs waiting per process
+    
+    # Write-behind persistence: analyses are queued and inserted in batches off the request path
+    DB_WRITE_BEHIND = os.environ.get('DB_WRITE_BEHIND', 'False').lower() == 'true'
+    DB_WRITE_BATCH_SIZE = int(os.environ.get('DB_WRITE_BATCH_SIZE', 100))
+    DB_WRITE_QUEUE_SIZE = int(os.environ.get('DB_WRITE_QUEUE_SIZE', 1000))
+    # How long the writer keeps retrying a failing batch before holding it for the next flush
+    DB_WRITE_RETRY_SECONDS = float(os.environ.get('DB_WRITE_RETRY_SECONDS', 60))
+    
+    # Per-stage latency histograms served at /metrics
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'True').lower() == 'true'
+    
+    # /upload responses of at least this many bytes are gzipped for clients that accept it
+    RESPONSE_GZIP_MIN_BYTES = int(os.environ.get('RESPONSE_GZIP_MIN_BYTES', 1024))
+    # Level 1 is about 4x faster than 6 on analysis JSON for under 10% larger output; 0 disables
+    RESPONSE_GZIP_LEVEL = int(os.environ.get('RESPONSE_GZIP_LEVEL', 1))
+    
     # API settings
     CORS_ORIGINS = os.environ.get('CORS_ORIGINS', '*').split(',')
     
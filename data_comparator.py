@@ -1,10 +1,13 @@
-import requests
-from bs4 import BeautifulSoup
 import json
 import time
 import numpy as np
 from datetime import datetime
 
+import metrics
+
+# Indexed by the status codes computed in DataComparator._score
+CONCENTRATION_STATUSES = ('Unknown', 'Below Average', 'Normal', 'Elevated')
+
 class DataComparator:
     def __init__(self):
         self.base_urls = {
@@ -59,74 +62,169 @@ class DataComparator:
                 'health_effects': 'Potential respiratory irritation'
             }
         }
+        
+        # Particle types by risk class
+        self.risk_factors = {
+            'high_risk_types': ['Polyvinyl Chloride (PVC)', 'Polystyrene (PS)'],
+            'moderate_risk_types': ['Polyethylene (PE)', 'Polypropylene (PP)'],
+            'low_risk_types': ['Polyethylene Terephthalate (PET)']
+        }
+        
+        self.data_sources = [
+            'EPA Microplastics Research',
+            'NOAA Marine Debris Program',
+            'WHO Environmental Health Guidelines',
+            'Scientific Literature Database'
+        ]
+        
+        self._compile_baselines()
+    
+    def update_baselines(self, baseline_data):
+        """Replace the baseline table; later comparisons use the new ranges"""
+        self.baseline_data = baseline_data
+        self._compile_baselines()
     
+    def _compile_baselines(self):
+        """Parse the baseline table once into per-type range arrays and risk-class lookups"""
+        self._baseline_types = list(self.baseline_data)
+        self._baseline_index = {name: column for column, name in enumerate(self._baseline_types)}
+        
+        ranges = [self._parse_range(baseline['typical_concentration']) for baseline in self.baseline_data.values()]
+        self._range_low = np.array([low for low, _ in ranges], dtype=np.float64)
+        self._range_high = np.array([high for _, high in ranges], dtype=np.float64)
+        self._range_known = ~np.isnan(self._range_low)
+        
+        self._high_risk = set(self.risk_factors['high_risk_types'])
+        self._moderate_risk = set(self.risk_factors['moderate_risk_types'])
+    
+    def _parse_range(self, typical_range):
+        """(min, max) percentages of a range such as "15-25%", or NaNs if it cannot be parsed"""
+        try:
+            if '-' in typical_range:
+                min_val, max_val = map(float, typical_range.replace('%', '').split('-'))
+                return min_val, max_val
+        except (AttributeError, ValueError):
+            pass
+        return np.nan, np.nan
+    
+    @metrics.instrument('comparison')
     def compare_with_online_data(self, analysis_result):
         """Compare analysis results with online data sources"""
         try:
-            comparison_data = {
-                'timestamp': datetime.now().isoformat(),
-                'sample_analysis': analysis_result,
-                'baseline_comparison': {},
-                'trend_analysis': {},
-                'risk_assessment': {},
-                'data_sources': []
-            }
-            
-            # Compare each detected microplastic type
-            for i, microplastic_type in enumerate(analysis_result.get('types', [])):
-                if microplastic_type in self.baseline_data:
-                    baseline = self.baseline_data[microplastic_type]
-                    sample_count = analysis_result.get('counts', [0])[i]
-                    total_particles = analysis_result.get('particle_count', 1)
-                    sample_percentage = (sample_count / total_particles) * 100
-                    
-                    comparison_data['baseline_comparison'][microplastic_type] = {
-                        'sample_percentage': round(sample_percentage, 2),
-                        'typical_range': baseline['typical_concentration'],
-                        'common_sources': baseline['common_sources'],
-                        'environmental_impact': baseline['environmental_impact'],
-                        'health_effects': baseline['health_effects'],
-                        'concentration_status': self._assess_concentration(sample_percentage, baseline['typical_concentration'])
-                    }
-            
-            # Perform trend analysis
-            comparison_data['trend_analysis'] = self._analyze_trends(analysis_result)
-            
-            # Risk assessment
-            comparison_data['risk_assessment'] = self._assess_risks(analysis_result)
-            
-            # Add data sources
-            comparison_data['data_sources'] = [
-                'EPA Microplastics Research',
-                'NOAA Marine Debris Program',
-                'WHO Environmental Health Guidelines',
-                'Scientific Literature Database'
-            ]
-            
-            return comparison_data
-            
+            return self._compare([analysis_result])[0]
         except Exception as e:
             print(f"Data comparison failed: {e}")
             return {'error': f'Comparison failed: {str(e)}'}
     
-    def _assess_concentration(self, sample_percentage, typical_range):
-        """Assess if sample concentration is within typical range"""
-        try:
-            # Parse typical range (e.g., "15-25%")
-            if '-' in typical_range:
-                min_val, max_val = map(float, typical_range.replace('%', '').split('-'))
-                if min_val <= sample_percentage <= max_val:
-                    return 'Normal'
-                elif sample_percentage > max_val:
-                    return 'Elevated'
-                else:
-                    return 'Below Average'
-            else:
-                return 'Unknown'
-        except:
-            return 'Unknown'
+    @metrics.instrument('comparison')
+    def compare_many(self, analysis_results):
+        """Compare a batch of analysis results at once
+        
+        Returns one comparison per result, as compare_with_online_data would,
+        with every sample scored in a single pass over a samples-by-types
+        count matrix.
+        """
+        return self._compare(list(analysis_results))
+    
+    def _compare(self, analysis_results):
+        # Plain lists are much faster than NumPy scalars for the per-sample lookups below
+        scores = {key: value.tolist() if isinstance(value, np.ndarray) else value
+                  for key, value in self._score(analysis_results).items()}
+        timestamp = datetime.now().isoformat()
+        return [self._build_comparison(row, analysis_result, scores, timestamp)
+                for row, analysis_result in enumerate(analysis_results)]
     
-    def _analyze_trends(self, analysis_result):
+    def _score(self, analysis_results):
+        """Concentration status, diversity and risk shares for every sample as arrays"""
+        columns = list(self._baseline_types)
+        column_index = dict(self._baseline_index)
+        sample_rows, sample_columns, sample_counts, sample_positions = [], [], [], []
+        
+        for row, analysis_result in enumerate(analysis_results):
+            counts = analysis_result.get('counts', [])
+            for position, microplastic_type in enumerate(analysis_result.get('types', [])):
+                column = column_index.get(microplastic_type)
+                if column is None:
+                    # Types without a baseline still count towards diversity and totals
+                    column = column_index[microplastic_type] = len(columns)
+                    columns.append(microplastic_type)
+                sample_rows.append(row)
+                sample_columns.append(column)
+                sample_counts.append(counts[position] if position < len(counts) else 0)
+                sample_positions.append(position)
+        
+        shape = (len(analysis_results), len(columns))
+        counts = np.zeros(shape, dtype=np.float64)
+        counts[sample_rows, sample_columns] = sample_counts
+        # Position of each type within its sample; ties for the dominant type go to the first listed
+        positions = np.full(shape, -1, dtype=np.int64)
+        positions[sample_rows, sample_columns] = sample_positions
+        present = positions >= 0
+        
+        totals = np.array([analysis_result.get('particle_count', 1) for analysis_result in analysis_results],
+                          dtype=np.float64)
+        percentages = np.divide(counts, totals[:, None], out=np.zeros(shape), where=totals[:, None] > 0) * 100
+        
+        # 0 Unknown, 1 Below Average, 2 Normal, 3 Elevated
+        baseline_percentages = percentages[:, :len(self._baseline_types)]
+        status = np.where(baseline_percentages > self._range_high, 3,
+                          np.where(baseline_percentages >= self._range_low, 2, 1))
+        status[:, ~self._range_known] = 0
+        
+        # Shannon diversity over the sample's own type counts
+        type_totals = counts.sum(axis=1)
+        shares = np.divide(counts, type_totals[:, None], out=np.zeros(shape), where=counts > 0)
+        logs = np.log(shares, out=np.zeros(shape), where=shares > 0)
+        diversity = -(shares * logs).sum(axis=1)
+        
+        # Highest count, earliest listed among equals
+        rank = np.where(present, counts * (shape[1] + 1) + (shape[1] - positions), -1)
+        dominant = rank.argmax(axis=1) if shape[1] else np.zeros(shape[0], dtype=np.int64)
+        
+        high_risk = np.array([name in self._high_risk for name in columns], dtype=bool)
+        moderate_risk = np.array([name in self._moderate_risk for name in columns], dtype=bool)
+        
+        return {
+            'columns': columns,
+            'present': present,
+            'percentages': percentages,
+            'status': status,
+            'diversity': diversity,
+            'dominant': dominant,
+            'high_risk_percentage': np.divide(counts[:, high_risk].sum(axis=1), totals,
+                                              out=np.zeros(shape[0]), where=totals > 0) * 100,
+            'moderate_risk_percentage': np.divide(counts[:, moderate_risk].sum(axis=1), totals,
+                                                  out=np.zeros(shape[0]), where=totals > 0) * 100
+        }
+    
+    def _build_comparison(self, row, analysis_result, scores, timestamp):
+        """The comparison dict of one scored sample"""
+        types = analysis_result.get('types', [])
+        baseline_comparison = {}
+        for microplastic_type in types:
+            column = self._baseline_index.get(microplastic_type)
+            if column is None:
+                continue
+            baseline = self.baseline_data[microplastic_type]
+            baseline_comparison[microplastic_type] = {
+                'sample_percentage': round(scores['percentages'][row][column], 2),
+                'typical_range': baseline['typical_concentration'],
+                'common_sources': baseline['common_sources'],
+                'environmental_impact': baseline['environmental_impact'],
+                'health_effects': baseline['health_effects'],
+                'concentration_status': CONCENTRATION_STATUSES[scores['status'][row][column]]
+            }
+        
+        return {
+            'timestamp': timestamp,
+            'sample_analysis': analysis_result,
+            'baseline_comparison': baseline_comparison,
+            'trend_analysis': self._trends_from_scores(row, analysis_result, scores),
+            'risk_assessment': self._risks_from_scores(row, types, scores),
+            'data_sources': list(self.data_sources)
+        }
+    
+    def _trends_from_scores(self, row, analysis_result, scores):
         """Analyze trends in the sample"""
         trends = {
             'dominant_type': None,
@@ -135,19 +233,9 @@ class DataComparator:
             'overall_assessment': 'Unknown'
         }
         
-        types = analysis_result.get('types', [])
-        counts = analysis_result.get('counts', [])
-        
-        if types and counts:
-            # Find dominant type
-            max_count_idx = counts.index(max(counts))
-            trends['dominant_type'] = types[max_count_idx]
-            
-            # Calculate diversity (simplified Shannon index)
-            total = sum(counts)
-            if total > 0:
-                diversity = -sum((count/total) * np.log(count/total) for count in counts if count > 0)
-                trends['diversity_index'] = round(diversity, 3)
+        if analysis_result.get('types') and analysis_result.get('counts'):
+            trends['dominant_type'] = scores['columns'][scores['dominant'][row]]
+            trends['diversity_index'] = round(scores['diversity'][row], 3)
             
             # Overall assessment
             if trends['diversity_index'] > 1.5:
@@ -159,40 +247,18 @@ class DataComparator:
         
         return trends
     
-    def _assess_risks(self, analysis_result):
+    def _risks_from_scores(self, row, types, scores):
         """Assess environmental and health risks"""
-        risk_factors = {
-            'high_risk_types': ['Polyvinyl Chloride (PVC)', 'Polystyrene (PS)'],
-            'moderate_risk_types': ['Polyethylene (PE)', 'Polypropylene (PP)'],
-            'low_risk_types': ['Polyethylene Terephthalate (PET)']
-        }
-        
         risks = {
             'environmental_risk': 'Low',
             'health_risk': 'Low',
-            'risk_factors': [],
+            'risk_factors': [f"High-risk type detected: {microplastic_type}"
+                             for microplastic_type in types if microplastic_type in self._high_risk],
             'recommendations': []
         }
         
-        types = analysis_result.get('types', [])
-        counts = analysis_result.get('counts', [])
-        
-        high_risk_count = 0
-        moderate_risk_count = 0
-        
-        for i, microplastic_type in enumerate(types):
-            count = counts[i] if i < len(counts) else 0
-            
-            if microplastic_type in risk_factors['high_risk_types']:
-                high_risk_count += count
-                risks['risk_factors'].append(f"High-risk type detected: {microplastic_type}")
-            elif microplastic_type in risk_factors['moderate_risk_types']:
-                moderate_risk_count += count
-        
-        # Assess overall risk
-        total_particles = analysis_result.get('particle_count', 1)
-        high_risk_percentage = (high_risk_count / total_particles) * 100
-        moderate_risk_percentage = (moderate_risk_count / total_particles) * 100
+        high_risk_percentage = scores['high_risk_percentage'][row]
+        moderate_risk_percentage = scores['moderate_risk_percentage'][row]
         
         if high_risk_percentage > 20:
             risks['environmental_risk'] = 'High'
@@ -73,6 +73,56 @@ def create_sample_microplastic_image():
     print(f"✓ Created sample image: {image_path}")
     return image_path
 
+def create_synthetic_microplastic_image(width=800, height=600, particle_count=9, size_range=(22, 40),
+                                        noise=50, noise_sigma=0.0, seed=None):
+    """Create a reproducible synthetic microplastic image and return it as a PIL image
+    
+    Particles are drawn like the sample image's, at random positions and
+    sizes from a seeded generator, so the same arguments always produce the
+    same pixels. `noise` is the number of background specks per 800x600
+    pixels and `noise_sigma` adds Gaussian sensor noise on top.
+    """
+    rng = np.random.default_rng(seed)
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    
+    # Same color families as the sample image (PE, PP, PS, PVC, PET)
+    palette = [(100, 150, 200), (200, 100, 100), (100, 200, 100), (150, 100, 200), (200, 200, 100)]
+    
+    for _ in range(particle_count):
+        size = int(rng.integers(size_range[0], size_range[1] + 1))
+        x = int(rng.integers(size // 2, max(size // 2 + 1, width - size // 2)))
+        y = int(rng.integers(size // 2, max(size // 2 + 1, height - size // 2)))
+        base = palette[int(rng.integers(len(palette)))]
+        color = tuple(int(c) for c in np.clip(np.array(base) + rng.integers(-20, 21, 3), 0, 255))
+        
+        draw.ellipse([x-size//2, y-size//2, x+size//2, y+size//2],
+                    fill=color, outline='black', width=2)
+        
+        # Add some texture/noise
+        for i in range(5):
+            noise_x = x + int(rng.integers(-(size//4), size//4 + 1))
+            noise_y = y + int(rng.integers(-(size//4), size//4 + 1))
+            noise_size = int(rng.integers(2, 6))
+            draw.ellipse([noise_x-noise_size//2, noise_y-noise_size//2,
+                         noise_x+noise_size//2, noise_y+noise_size//2],
+                        fill='black')
+    
+    # Background specks, scaled with the image area
+    for i in range(int(round(noise * width * height / (800 * 600)))):
+        x = int(rng.integers(0, width))
+        y = int(rng.integers(0, height))
+        size = int(rng.integers(1, 3))
+        color = tuple(int(c) for c in rng.integers(200, 255, 3))
+        draw.ellipse([x-size//2, y-size//2, x+size//2, y+size//2], fill=color)
+    
+    if noise_sigma > 0:
+        pixels = np.asarray(image, dtype=np.float32)
+        pixels += rng.normal(0.0, noise_sigma, pixels.shape).astype(np.float32)
+        image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+    
+    return image
+
 def test_analysis_pipeline():
     """Test the analysis pipeline with the sample image"""
     try:
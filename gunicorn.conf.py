@@ -0,0 +1,30 @@
+"""
+Gunicorn settings for the Microplastic Analysis System
+Picked up automatically when gunicorn is started from the project root
+"""
+
+import sys
+
+import startup_profile
+startup_profile.enable_from_environment()
+
+def post_worker_init(worker):
+    """Load the classification model once per worker before it takes requests"""
+    from config import Config
+    from model_registry import preload_if_configured
+
+    stats = preload_if_configured()
+    if stats:
+        worker.log.info(
+            "Model preloaded in %ss (rss %s MB)",
+            stats['load_time_seconds'], stats['current_rss_mb']
+        )
+    elif Config.PRELOAD_MODEL and Config.PRELOAD_IN_BACKGROUND:
+        worker.log.info("Model preloading in the background")
+    
+    # Pick up analysis jobs left behind by a previous run
+    if 'app_full' in sys.modules:
+        sys.modules['app_full'].start_background_jobs()
+    
+    startup_profile.mark('worker ready')
+    startup_profile.report()
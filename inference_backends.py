@@ -0,0 +1,374 @@
+"""
+Inference backends for the microplastic classification model
+Runs the same model through full Keras or a quantized TFLite interpreter
+"""
+
+import os
+import time
+
+import numpy as np
+
+from config import Config
+
+class InferenceBackend:
+    """Common interface for running the particle classifier on a batch of crops"""
+    
+    name = 'base'
+    
+    def __init__(self, model_path):
+        self.model_path = model_path
+        self.num_classes = None
+    
+    def load(self, num_classes):
+        """Load the model, creating or converting it when it does not exist yet"""
+        raise NotImplementedError
+    
+    def predict(self, batch):
+        """Return class scores of shape (N, num_classes) for a uint8 RGB batch of shape (N, 224, 224, 3)
+        
+        Pixel normalization (division by 255) is part of the backend, so
+        callers pass raw crops; float32 batches already in [0, 1] are still accepted.
+        """
+        raise NotImplementedError
+    
+    def describe(self):
+        """Basic information about the loaded model"""
+        size = os.path.getsize(self.model_path) if os.path.exists(self.model_path) else None
+        return {
+            'backend': self.name,
+            'model_path': self.model_path,
+            'model_size_mb': round(size / (1024.0 * 1024.0), 2) if size is not None else None
+        }
+
+class KerasBackend(InferenceBackend):
+    """Runs the full TensorFlow/Keras model"""
+    
+    name = 'keras'
+    
+    def __init__(self, model_path=None):
+        super().__init__(model_path or Config.MODEL_PATH)
+        self.model = None
+        # The model with uint8 input and built-in normalization, used for predict()
+        self.serving_model = None
+    
+    def load(self, num_classes):
+        """Load or create a pre-trained model for microplastic classification"""
+        import tensorflow as tf
+        
+        self.num_classes = num_classes
+        try:
+            # Try to load existing model
+            if os.path.exists(self.model_path):
+                self.model = tf.keras.models.load_model(self.model_path)
+                print("Loaded existing microplastic classification model")
+            else:
+                # Create a simple CNN model for demonstration
+                self.create_demo_model()
+                print("Created demo model for microplastic classification")
+        except Exception as e:
+            print(f"Error loading model: {e}")
+            self.create_demo_model()
+        
+        self.serving_model = _with_input_normalization(self.model)
+        return self
+    
+    def create_demo_model(self):
+        """Create a demo CNN model for microplastic classification"""
+        import tensorflow as tf
+        
+        model = tf.keras.Sequential([
+            tf.keras.layers.Conv2D(32, (3, 3), activation='relu', input_shape=(224, 224, 3)),
+            tf.keras.layers.MaxPooling2D(2, 2),
+            tf.keras.layers.Conv2D(64, (3, 3), activation='relu'),
+            tf.keras.layers.MaxPooling2D(2, 2),
+            tf.keras.layers.Conv2D(128, (3, 3), activation='relu'),
+            tf.keras.layers.MaxPooling2D(2, 2),
+            tf.keras.layers.Flatten(),
+            tf.keras.layers.Dense(512, activation='relu'),
+            tf.keras.layers.Dropout(0.5),
+            tf.keras.layers.Dense(self.num_classes, activation='softmax')
+        ])
+        
+        model.compile(
+            optimizer='adam',
+            loss='categorical_crossentropy',
+            metrics=['accuracy']
+        )
+        
+        self.model = model
+        
+        # Create models directory if it doesn't exist
+        os.makedirs(os.path.dirname(self.model_path) or '.', exist_ok=True)
+        
+        # Save the demo model
+        self.model.save(self.model_path)
+        self.serving_model = _with_input_normalization(model)
+        return model
+    
+    def predict(self, batch):
+        model = self.serving_model if batch.dtype == np.uint8 else self.model
+        return model.predict(batch, batch_size=len(batch), verbose=0)
+
+def _with_input_normalization(model):
+    """Wrap a model trained on [0, 1] inputs so it takes uint8 pixels directly
+    
+    The Rescaling layer runs inside the graph, so crops never need a float32
+    copy on the host side, which is 4x the memory of the uint8 batch.
+    """
+    import tensorflow as tf
+    
+    if model.inputs[0].dtype == tf.uint8:
+        return model
+    
+    inputs = tf.keras.Input(shape=model.inputs[0].shape[1:], dtype='uint8')
+    outputs = model(tf.keras.layers.Rescaling(1.0 / 255)(inputs))
+    return tf.keras.Model(inputs, outputs)
+
+class TFLiteBackend(InferenceBackend):
+    """Runs a float16 or int8 quantized TFLite conversion of the Keras model on CPU"""
+    
+    QUANTIZATIONS = ('float16', 'int8')
+    
+    def __init__(self, model_path=None, quantization=None, source_model_path=None, num_threads=None):
+        quantization = quantization or Config.TFLITE_QUANTIZATION
+        if quantization not in self.QUANTIZATIONS:
+            raise ValueError(f"Unsupported TFLite quantization: {quantization}")
+        
+        super().__init__(model_path or Config.TFLITE_MODEL_PATH.format(quantization=quantization))
+        self.name = f'tflite-{quantization}'
+        self.quantization = quantization
+        self.source_model_path = source_model_path or Config.MODEL_PATH
+        self.num_threads = num_threads or Config.TFLITE_NUM_THREADS
+        self.interpreter = None
+        self._batch_size = None
+        # Reused model input tensor and the uint8 pixel lookup table for it
+        self._input_buffer = None
+        self._input_lut = None
+    
+    def load(self, num_classes):
+        """Load the TFLite model, converting it from the Keras model on first use"""
+        self.num_classes = num_classes
+        if not os.path.exists(self.model_path):
+            convert_to_tflite(self.source_model_path, self.model_path, self.quantization, num_classes)
+        
+        # Prefer the standalone interpreters so serving does not need TensorFlow
+        try:
+            from ai_edge_litert.interpreter import Interpreter
+        except ImportError:
+            try:
+                from tflite_runtime.interpreter import Interpreter
+            except ImportError:
+                import tensorflow as tf
+                Interpreter = tf.lite.Interpreter
+        
+        self.interpreter = Interpreter(model_path=self.model_path, num_threads=self.num_threads)
+        self.interpreter.allocate_tensors()
+        self._input = self.interpreter.get_input_details()[0]
+        self._output = self.interpreter.get_output_details()[0]
+        self._batch_size = int(self._input['shape'][0])
+        self._input_lut = self._pixel_lookup_table()
+        print(f"Loaded {self.name} microplastic classification model")
+        return self
+    
+    def _pixel_lookup_table(self):
+        """Quantized model input for each uint8 pixel, including the /255 normalization"""
+        input_details = self._input
+        if input_details['dtype'] == np.float32:
+            return None
+        values = np.arange(256, dtype=np.float32) / 255.0
+        scale, zero_point = input_details['quantization']
+        info = np.iinfo(input_details['dtype'])
+        return np.clip(np.round(values / scale + zero_point), info.min, info.max).astype(input_details['dtype'])
+    
+    def predict(self, batch):
+        if len(batch) != self._batch_size:
+            # Resize the input tensor once per distinct batch size
+            self.interpreter.resize_tensor_input(self._input['index'], list(batch.shape))
+            self.interpreter.allocate_tensors()
+            self._input = self.interpreter.get_input_details()[0]
+            self._output = self.interpreter.get_output_details()[0]
+            self._batch_size = len(batch)
+        
+        input_details = self._input
+        if batch.dtype == np.uint8:
+            # Normalize (and quantize) uint8 pixels into a reused input buffer
+            if self._input_buffer is None or self._input_buffer.shape != batch.shape:
+                self._input_buffer = np.empty(batch.shape, dtype=input_details['dtype'])
+            if input_details['dtype'] == np.float32:
+                np.divide(batch, np.float32(255.0), out=self._input_buffer, dtype=np.float32)
+            else:
+                np.take(self._input_lut, batch, out=self._input_buffer)
+            batch = self._input_buffer
+        elif input_details['dtype'] != np.float32:
+            # Integer model inputs: quantize with the tensor's scale and zero point
+            scale, zero_point = input_details['quantization']
+            info = np.iinfo(input_details['dtype'])
+            batch = np.clip(np.round(batch / scale + zero_point), info.min, info.max)
+        self.interpreter.set_tensor(input_details['index'], batch.astype(input_details['dtype'], copy=False))
+        self.interpreter.invoke()
+        
+        scores = self.interpreter.get_tensor(self._output['index'])
+        if self._output['dtype'] != np.float32:
+            scale, zero_point = self._output['quantization']
+            scores = (scores.astype(np.float32) - zero_point) * scale
+        return scores
+
+def _representative_crops(count=64):
+    """Calibration crops for int8 quantization from the configured directory or the demo generator"""
+    import cv2
+    
+    crops = []
+    calibration_dir = Config.TFLITE_CALIBRATION_DIR
+    if calibration_dir and os.path.isdir(calibration_dir):
+        for name in sorted(os.listdir(calibration_dir)):
+            image = cv2.imread(os.path.join(calibration_dir, name))
+            if image is not None:
+                crops.append(image)
+            if len(crops) >= count:
+                break
+    
+    if not crops:
+        # Fall back to random 224x224 windows of a synthetic sample image
+        from demo import create_sample_microplastic_image
+        image = cv2.imread(create_sample_microplastic_image())
+        rng = np.random.default_rng(0)
+        for _ in range(count):
+            y = rng.integers(0, image.shape[0] - 224)
+            x = rng.integers(0, image.shape[1] - 224)
+            crops.append(image[y:y + 224, x:x + 224])
+    
+    for crop in crops:
+        crop = cv2.resize(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB), (224, 224))
+        yield [np.expand_dims(crop.astype(np.float32) / 255.0, axis=0)]
+
+def convert_to_tflite(source_model_path, output_path, quantization, num_classes=8):
+    """Convert the Keras model to a quantized TFLite flatbuffer"""
+    import tensorflow as tf
+    
+    if not os.path.exists(source_model_path):
+        # Make sure there is a Keras model to convert
+        KerasBackend(source_model_path).load(num_classes)
+    
+    model = tf.keras.models.load_model(source_model_path)
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    
+    if quantization == 'float16':
+        converter.target_spec.supported_types = [tf.float16]
+    else:
+        # Full integer quantization; inputs and outputs stay float32
+        converter.representative_dataset = _representative_crops
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    
+    tflite_model = converter.convert()
+    
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'wb') as f:
+        f.write(tflite_model)
+    print(f"Converted {source_model_path} to {output_path} ({quantization})")
+    return output_path
+
+def create_backend(name=None):
+    """Create the inference backend selected by name or Config.INFERENCE_BACKEND"""
+    name = (name or Config.INFERENCE_BACKEND).lower()
+    if name == 'keras':
+        return KerasBackend()
+    if name == 'tflite':
+        return TFLiteBackend()
+    if name.startswith('tflite-'):
+        return TFLiteBackend(quantization=name.split('-', 1)[1])
+    raise ValueError(f"Unknown inference backend: {name}")
+
+def compare_backends(image_paths=None, backends=('keras', 'tflite-float16', 'tflite-int8'),
+                     batch_size=None, repeats=5):
+    """Compare latency, memory and agreement with Keras predictions for each backend"""
+    from microplastic_analyzer import MicroplasticAnalyzer
+    from model_registry import _current_rss_mb
+    
+    batch_size = batch_size or Config.INFERENCE_BATCH_SIZE
+    
+    # Keras is the reference every other backend is compared against
+    rss_before = _current_rss_mb()
+    reference = MicroplasticAnalyzer(backend=KerasBackend())
+    reference_rss = _current_rss_mb()
+    
+    if not image_paths:
+        from demo import create_sample_microplastic_image
+        image_paths = [create_sample_microplastic_image()]
+    
+    crops = []
+    for path in image_paths:
+        image = reference.load_image(path)
+        particles = reference.detect_particles(image)
+        crops.extend(reference._extract_particle_crop(image, bbox) for bbox in particles.bbox.tolist())
+    if not crops:
+        raise ValueError("No particles detected in the comparison images")
+    crops = np.stack(crops)
+    
+    report = {'particles': len(crops), 'batch_size': batch_size, 'backends': {}}
+    reference_scores = np.concatenate([reference.backend.predict(crops[i:i + batch_size])
+                                       for i in range(0, len(crops), batch_size)])
+    
+    for name in backends:
+        if name == 'keras':
+            backend = reference.backend
+            load_seconds = None
+            memory_mb = (reference_rss - rss_before) if rss_before is not None and reference_rss is not None else None
+        else:
+            rss_start = _current_rss_mb()
+            start = time.perf_counter()
+            try:
+                backend = create_backend(name).load(len(reference.microplastic_types))
+            except Exception as e:
+                report['backends'][name] = {'error': str(e)}
+                continue
+            load_seconds = round(time.perf_counter() - start, 3)
+            rss_end = _current_rss_mb()
+            memory_mb = (rss_end - rss_start) if rss_start is not None and rss_end is not None else None
+        
+        # Warm up once, then time full passes over all crops
+        backend.predict(crops[:batch_size])
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            scores = np.concatenate([backend.predict(crops[i:i + batch_size])
+                                     for i in range(0, len(crops), batch_size)])
+            timings.append(time.perf_counter() - start)
+        
+        entry = backend.describe()
+        entry.update({
+            'load_seconds': load_seconds,
+            'memory_mb': round(memory_mb, 1) if memory_mb is not None else None,
+            'latency_ms_per_particle': round(1000.0 * np.median(timings) / len(crops), 3),
+            'latency_ms_per_batch': round(1000.0 * np.median(timings) / -(-len(crops) // batch_size), 3),
+            'top1_agreement': round(float(np.mean(np.argmax(scores, axis=1) == np.argmax(reference_scores, axis=1))), 4),
+            'max_score_difference': round(float(np.max(np.abs(scores - reference_scores))), 6)
+        })
+        report['backends'][name] = entry
+    
+    return report
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    
+    parser = argparse.ArgumentParser(description='Inference backend tools')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    
+    convert_parser = subparsers.add_parser('convert', help='Convert the Keras model to TFLite')
+    convert_parser.add_argument('--quantization', choices=TFLiteBackend.QUANTIZATIONS, default=Config.TFLITE_QUANTIZATION)
+    convert_parser.add_argument('--output', default=None)
+    
+    compare_parser = subparsers.add_parser('compare', help='Compare backends on sample images')
+    compare_parser.add_argument('images', nargs='*', help='Images to take particle crops from')
+    compare_parser.add_argument('--backends', default='keras,tflite-float16,tflite-int8')
+    compare_parser.add_argument('--batch-size', type=int, default=None)
+    compare_parser.add_argument('--repeats', type=int, default=5)
+    
+    args = parser.parse_args()
+    if args.command == 'convert':
+        output = args.output or Config.TFLITE_MODEL_PATH.format(quantization=args.quantization)
+        convert_to_tflite(Config.MODEL_PATH, output, args.quantization)
+    else:
+        result = compare_backends(args.images, args.backends.split(','), args.batch_size, args.repeats)
+        print(json.dumps(result, indent=2))
@@ -0,0 +1,153 @@
+"""
+Cross-request micro-batching for particle classification
+Crops from concurrent analyses are merged into shared forward passes by one scheduler thread
+"""
+
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from config import Config
+
+class InferenceScheduler:
+    """Collects crop batches from many callers and runs them through the backend together
+    
+    A batch is dispatched as soon as it holds max_batch_size crops or the
+    oldest waiting request has waited max_delay_ms, whichever comes first.
+    Each caller gets a Future that resolves to the scores for its own crops.
+    """
+    
+    def __init__(self, backend, max_batch_size=None, max_delay_ms=None):
+        self.backend = backend
+        self.max_batch_size = max_batch_size or Config.INFERENCE_MAX_BATCH_SIZE
+        self.max_delay = (max_delay_ms if max_delay_ms is not None else Config.INFERENCE_MAX_DELAY_MS) / 1000.0
+        self._queue = queue.Queue()
+        # A request that did not fit into the previous batch opens the next one
+        self._carry = None
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'batches': 0,
+            'requests': 0,
+            'crops': 0,
+            'failed_batches': 0,
+            'total_queue_delay': 0.0,
+            'max_queue_delay': 0.0,
+            'total_inference_seconds': 0.0
+        }
+        # Recent queueing delays for percentiles
+        self._recent_delays = deque(maxlen=1000)
+    
+    def _ensure_started(self):
+        if self._thread is None or not self._thread.is_alive():
+            with self._thread_lock:
+                if self._thread is None or not self._thread.is_alive():
+                    self._thread = threading.Thread(
+                        target=self._loop, name='inference-scheduler', daemon=True
+                    )
+                    self._thread.start()
+    
+    def submit(self, crops):
+        """Queue a stack of model input crops; returns a Future of their scores"""
+        future = Future()
+        if len(crops) == 0:
+            future.set_result(np.empty((0, 0), dtype=np.float32))
+            return future
+        
+        self._ensure_started()
+        self._queue.put((np.asarray(crops), future, time.perf_counter()))
+        return future
+    
+    def predict(self, crops):
+        """Blocking helper: score crops through the shared batches"""
+        return self.submit(crops).result()
+    
+    def _next_request(self, timeout=None):
+        if self._carry is not None:
+            request, self._carry = self._carry, None
+            return request
+        return self._queue.get(timeout=timeout)
+    
+    def _collect(self):
+        """Block for the first request, then gather more until the batch is full or the delay expires"""
+        first = self._next_request()
+        requests = [first]
+        size = len(first[0])
+        deadline = first[2] + self.max_delay
+        
+        while size < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                request = self._next_request(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if size + len(request[0]) > self.max_batch_size:
+                # Keep callers' chunks whole; this one starts the next batch
+                self._carry = request
+                break
+            requests.append(request)
+            size += len(request[0])
+        
+        return requests, size
+    
+    def _loop(self):
+        while True:
+            requests, size = self._collect()
+            dispatched = time.perf_counter()
+            delays = [dispatched - enqueued for _, _, enqueued in requests]
+            
+            try:
+                batch = requests[0][0] if len(requests) == 1 else np.concatenate([crops for crops, _, _ in requests])
+                predictions = self.backend.predict(batch)
+            except Exception as e:
+                for _, future, _ in requests:
+                    future.set_exception(e)
+                self._record(requests, size, delays, dispatched, failed=True)
+                continue
+            
+            offset = 0
+            for crops, future, _ in requests:
+                future.set_result(predictions[offset:offset + len(crops)])
+                offset += len(crops)
+            self._record(requests, size, delays, dispatched)
+    
+    def _record(self, requests, size, delays, dispatched, failed=False):
+        with self._stats_lock:
+            self._stats['batches'] += 1
+            self._stats['requests'] += len(requests)
+            self._stats['crops'] += size
+            self._stats['failed_batches'] += int(failed)
+            self._stats['total_queue_delay'] += sum(delays)
+            self._stats['max_queue_delay'] = max(self._stats['max_queue_delay'], max(delays))
+            self._stats['total_inference_seconds'] += time.perf_counter() - dispatched
+            self._recent_delays.extend(delays)
+    
+    def get_stats(self):
+        """Batch fill rate and queueing delay metrics"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+            recent = np.array(self._recent_delays, dtype=np.float64)
+        
+        batches = stats['batches']
+        requests = stats['requests']
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_delay_ms': round(self.max_delay * 1000.0, 3),
+            'batches': batches,
+            'requests': requests,
+            'crops': stats['crops'],
+            'failed_batches': stats['failed_batches'],
+            'pending_requests': self._queue.qsize() + (1 if self._carry is not None else 0),
+            'mean_batch_size': round(stats['crops'] / batches, 2) if batches else 0.0,
+            'batch_fill_rate': round(stats['crops'] / (batches * self.max_batch_size), 4) if batches else 0.0,
+            'requests_per_batch': round(requests / batches, 2) if batches else 0.0,
+            'mean_queue_delay_ms': round(stats['total_queue_delay'] / requests * 1000.0, 3) if requests else 0.0,
+            'p95_queue_delay_ms': round(float(np.percentile(recent, 95)) * 1000.0, 3) if len(recent) else 0.0,
+            'max_queue_delay_ms': round(stats['max_queue_delay'] * 1000.0, 3),
+            'mean_inference_ms': round(stats['total_inference_seconds'] / batches * 1000.0, 3) if batches else 0.0
+        }
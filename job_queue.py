@@ -0,0 +1,261 @@
+"""
+Background analysis jobs for the Microplastic Analysis System
+Uploads are queued to a bounded worker pool; job state lives in SQLite so it survives restarts
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from persistence import ensure_columns, get_pool
+
+class JobQueueFull(Exception):
+    """Raised when no more jobs can be accepted right now"""
+    pass
+
+def _process_start_time(pid):
+    """Start time of a process in clock ticks since boot, or None where /proc is not available"""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            # The command name may contain spaces; the fields after it are fixed
+            return f.read().rsplit(')', 1)[1].split()[19]
+    except (OSError, IndexError):
+        return None
+
+_instance = {'pid': None, 'token': None}
+
+def _instance_token():
+    """Token telling this process apart from an earlier one that had the same pid"""
+    if _instance['pid'] != os.getpid():
+        _instance['pid'] = os.getpid()
+        _instance['token'] = _process_start_time(os.getpid()) or uuid.uuid4().hex
+    return _instance['token']
+
+def _worker_alive(pid, instance):
+    """Return True if the process that claimed a job is still running
+    
+    pids are reused (a restarted container often gives the new worker the
+    same one), so a pid only counts as alive when the process behind it
+    has the instance token recorded with the claim.
+    """
+    if not pid:
+        return False
+    if pid == os.getpid():
+        return instance == _instance_token()
+    
+    started = _process_start_time(pid)
+    if started is not None:
+        return started == instance
+    if os.path.isdir('/proc'):
+        return False
+    
+    # No /proc to compare start times against; all that can be checked is the pid
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class JobManager:
+    """Runs analyses on a bounded thread pool and records their progress in SQLite"""
+    
+    def __init__(self, database, upload_folder, pipeline, max_workers=None, max_pending=None):
+        self.database = database
+        self.upload_folder = upload_folder
+        # pipeline(image_bytes, filename, progress_callback, site=None) -> (JSON bytes, cache status)
+        self.pipeline = pipeline
+        self.max_workers = max_workers or Config.JOB_WORKERS
+        self.max_pending = max_pending if max_pending is not None else Config.JOB_QUEUE_SIZE
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        # Running plus waiting jobs in this process; bounds memory held by the executor queue
+        self._slots = threading.BoundedSemaphore(self.max_workers + self.max_pending)
+    
+    def _connect(self):
+        # This thread's pooled connection; each write below commits its own transaction
+        return get_pool(self.database).connection()
+    
+    def init_db(self):
+        """Create the jobs table"""
+        conn = self._connect()
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                filename TEXT,
+                upload_path TEXT,
+                status TEXT,
+                progress REAL,
+                stage TEXT,
+                worker_pid INTEGER,
+                worker_instance TEXT,
+                created_at REAL,
+                updated_at REAL,
+                result TEXT,
+                error TEXT,
+                site TEXT
+            )
+        ''')
+        ensure_columns(conn, 'jobs', {'site': 'TEXT', 'worker_instance': 'TEXT'})
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status)')
+        
+        conn.commit()
+    
+    def _get_executor(self):
+        """Return this process's executor, creating a fresh one after fork()"""
+        with self._lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix='analysis-job'
+                )
+                self._executor_pid = os.getpid()
+                self._slots = threading.BoundedSemaphore(self.max_workers + self.max_pending)
+            return self._executor
+    
+    def _update(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f"{column} = ?" for column in fields)
+        conn = self._connect()
+        conn.execute(f'UPDATE jobs SET {assignments} WHERE id = ?', (*fields.values(), job_id))
+        conn.commit()
+    
+    def submit(self, image_bytes, filename, site=None):
+        """Store the upload, record a queued job and schedule it; returns the job id"""
+        executor = self._get_executor()
+        if not self._slots.acquire(blocking=False):
+            raise JobQueueFull()
+        
+        try:
+            job_id = uuid.uuid4().hex
+            os.makedirs(self.upload_folder, exist_ok=True)
+            upload_path = os.path.join(self.upload_folder, job_id)
+            with open(upload_path, 'wb') as f:
+                f.write(image_bytes)
+            
+            now = time.time()
+            conn = self._connect()
+            conn.execute('''
+                INSERT INTO jobs (id, filename, upload_path, status, progress, stage, created_at, updated_at, site)
+                VALUES (?, ?, ?, 'queued', 0.0, 'queued', ?, ?, ?)
+            ''', (job_id, filename, upload_path, now, now, site))
+            conn.commit()
+            
+            executor.submit(self._run, job_id)
+        except Exception:
+            self._slots.release()
+            raise
+        
+        return job_id
+    
+    def _claim(self, job_id):
+        """Atomically move a queued job to running; False if someone else took it"""
+        conn = self._connect()
+        cursor = conn.execute('''
+            UPDATE jobs SET status = 'running', stage = 'starting', worker_pid = ?, worker_instance = ?,
+                updated_at = ?
+            WHERE id = ? AND status = 'queued'
+        ''', (os.getpid(), _instance_token(), time.time(), job_id))
+        conn.commit()
+        claimed = cursor.rowcount == 1
+        return claimed
+    
+    def _run(self, job_id, holds_slot=True):
+        """Executor task: run the analysis pipeline for one job"""
+        try:
+            if not self._claim(job_id):
+                return
+            
+            conn = self._connect()
+            job = conn.execute('SELECT filename, upload_path, site FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            
+            try:
+                with open(job['upload_path'], 'rb') as f:
+                    image_bytes = f.read()
+                
+                last_report = [0.0]
+                
+                def report(progress, stage):
+                    # Throttle database writes from the per-batch callback
+                    now = time.monotonic()
+                    if now - last_report[0] >= 0.5 or stage != 'classifying':
+                        last_report[0] = now
+                        self._update(job_id, progress=round(progress, 3), stage=stage)
+                
+                response_body, cache_status = self.pipeline(image_bytes, job['filename'], report, site=job['site'])
+                self._update(job_id, status='done', progress=1.0, stage='done',
+                             result=response_body.decode('utf-8'))
+            except Exception as e:
+                self._update(job_id, status='failed', stage='failed', error=f'Analysis failed: {e}')
+            
+            try:
+                os.remove(job['upload_path'])
+            except OSError:
+                pass
+        finally:
+            if holds_slot:
+                self._slots.release()
+    
+    def get(self, job_id):
+        """Return the status of a job as a dict, or None if it does not exist"""
+        conn = self._connect()
+        job = conn.execute('SELECT * FROM jobs WHERE id = ?', (job_id,)).fetchone()
+        
+        if job is None:
+            return None
+        
+        status = {
+            'job_id': job['id'],
+            'filename': job['filename'],
+            'status': job['status'],
+            'progress': job['progress'],
+            'stage': job['stage'],
+            'created_at': job['created_at'],
+            'updated_at': job['updated_at']
+        }
+        if job['status'] == 'done':
+            status['result'] = json.loads(job['result'])
+        elif job['status'] == 'failed':
+            status['error'] = job['error']
+        return status
+    
+    def resume_pending(self):
+        """Requeue jobs interrupted by a restart and schedule every queued job
+        
+        A job left 'running' by a process that no longer exists, including an
+        earlier process with the same pid, is put back in the queue. Several workers may resume at once; the atomic claim in
+        _run makes sure each job is still analyzed only once.
+        """
+        conn = self._connect()
+        running = conn.execute(
+            "SELECT id, worker_pid, worker_instance FROM jobs WHERE status = 'running'"
+        ).fetchall()
+        for job in running:
+            if not _worker_alive(job['worker_pid'], job['worker_instance']):
+                conn.execute('''
+                    UPDATE jobs SET status = 'queued', stage = 'queued', progress = 0.0, updated_at = ?
+                    WHERE id = ? AND status = 'running'
+                ''', (time.time(), job['id']))
+        conn.commit()
+        
+        queued = [row['id'] for row in conn.execute(
+            "SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at"
+        )]
+        
+        executor = self._get_executor()
+        resumed = 0
+        for job_id in queued:
+            # Resumed jobs were accepted before the restart, so they bypass the admission limit
+            executor.submit(self._run, job_id, False)
+            resumed += 1
+        
+        if resumed:
+            print(f"Resumed {resumed} queued analysis jobs")
+        return resumed
@@ -0,0 +1,213 @@
+"""
+Per-stage latency metrics for the Microplastic Analysis System
+Stage timings feed histograms labelled by particle count and image size, served in Prometheus text format
+"""
+
+import bisect
+import contextvars
+import functools
+import threading
+import time
+
+from config import Config
+
+# Upper bounds in seconds; +Inf is implicit
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Label values are bucketed so the number of series stays small
+PARTICLE_BUCKETS = ((0, '0'), (10, '1-10'), (100, '11-100'), (1000, '101-1000'))
+IMAGE_SIZE_BUCKETS = ((1_000_000, '<1MP'), (4_000_000, '1-4MP'), (12_000_000, '4-12MP'), (24_000_000, '12-24MP'))
+
+UNKNOWN = 'unknown'
+
+def particle_label(count):
+    """Bucket a particle count into a label value"""
+    for limit, label in PARTICLE_BUCKETS:
+        if count <= limit:
+            return label
+    return '>1000'
+
+def image_size_label(pixels):
+    """Bucket an image pixel count into a label value"""
+    for limit, label in IMAGE_SIZE_BUCKETS:
+        if pixels < limit:
+            return label
+    return '>24MP'
+
+class Histogram:
+    """Thread-safe cumulative histogram with a fixed label set"""
+    
+    def __init__(self, name, documentation, label_names, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+    
+    def observe(self, value, labels):
+        """Record one value for a tuple of label values"""
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), sum, count
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+    
+    def snapshot(self):
+        """Copy of every series as {label values: (bucket counts, sum, count)}"""
+        with self._lock:
+            return {labels: (list(series[0]), series[1], series[2]) for labels, series in self._series.items()}
+    
+    def render(self):
+        """Prometheus text exposition lines for this histogram"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        snapshot = self.snapshot()
+        
+        for labels in sorted(snapshot):
+            counts, total, count = snapshot[labels]
+            label_text = ','.join(f'{name}="{value}"' for name, value in zip(self.label_names, labels))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label_text},le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total!r}')
+            lines.append(f'{self.name}_count{{{label_text}}} {count}')
+        return lines
+    
+    def reset(self):
+        with self._lock:
+            self._series.clear()
+
+STAGE_SECONDS = Histogram(
+    'microplastic_stage_duration_seconds',
+    'Time spent in each analysis stage',
+    ('stage', 'particles', 'image_size')
+)
+
+class _Trace:
+    """Stage timings of one analysis, held back until its labels are known"""
+    
+    __slots__ = ('durations', 'particles', 'image_size')
+    
+    def __init__(self):
+        self.durations = []
+        self.particles = UNKNOWN
+        self.image_size = UNKNOWN
+    
+    def set_labels(self, particles=None, pixels=None):
+        if particles is not None:
+            self.particles = particle_label(particles)
+        if pixels is not None:
+            self.image_size = image_size_label(pixels)
+    
+    def flush(self):
+        for stage, seconds in self.durations:
+            STAGE_SECONDS.observe(seconds, (stage, self.particles, self.image_size))
+        self.durations = []
+
+class _NullContext:
+    """Shared do-nothing timer and trace used while metrics are disabled"""
+    
+    __slots__ = ()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        return False
+    
+    def set_labels(self, particles=None, pixels=None):
+        pass
+
+_NULL = _NullContext()
+
+_current_trace = contextvars.ContextVar('microplastic_metrics_trace', default=None)
+
+class _StageTimer:
+    __slots__ = ('stage', 'start')
+    
+    def __init__(self, stage):
+        self.stage = stage
+    
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        record(self.stage, time.perf_counter() - self.start)
+        return False
+
+class _TraceScope:
+    __slots__ = ('trace', 'token')
+    
+    def __enter__(self):
+        self.trace = _current_trace.get()
+        if self.trace is not None:
+            # Nested scopes share the outermost analysis's labels
+            self.token = None
+            return self.trace
+        self.trace = _Trace()
+        self.token = _current_trace.set(self.trace)
+        return self.trace
+    
+    def __exit__(self, exc_type, exc, tb):
+        if self.token is not None:
+            _current_trace.reset(self.token)
+            self.trace.flush()
+        return False
+
+def timed(stage):
+    """Context manager timing one stage; a shared no-op when metrics are disabled"""
+    if not Config.METRICS_ENABLED:
+        return _NULL
+    return _StageTimer(stage)
+
+def trace():
+    """Group the stages of one analysis so they are labelled by its particle count and image size"""
+    if not Config.METRICS_ENABLED:
+        return _NULL
+    return _TraceScope()
+
+def set_labels(particles=None, pixels=None):
+    """Set labels on the analysis currently being traced, if any"""
+    current = _current_trace.get()
+    if current is not None:
+        current.set_labels(particles, pixels)
+
+def record(stage, seconds):
+    """Record a stage duration measured by the caller"""
+    if not Config.METRICS_ENABLED:
+        return
+    current = _current_trace.get()
+    if current is None:
+        STAGE_SECONDS.observe(seconds, (stage, UNKNOWN, UNKNOWN))
+    else:
+        current.durations.append((stage, seconds))
+
+def instrument(stage):
+    """Decorator timing a whole function as one stage of the current analysis"""
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not Config.METRICS_ENABLED:
+                return function(*args, **kwargs)
+            with _TraceScope(), _StageTimer(stage):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def stage_totals():
+    """Total seconds recorded so far per stage, summed over the other labels"""
+    totals = {}
+    for labels, (_, total, _) in STAGE_SECONDS.snapshot().items():
+        totals[labels[0]] = totals.get(labels[0], 0.0) + total
+    return totals
+
+def render():
+    """All metrics in Prometheus text exposition format"""
+    return '\n'.join(STAGE_SECONDS.render()) + '\n'
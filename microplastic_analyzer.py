@@ -1,12 +1,18 @@
 import cv2
 import numpy as np
-import tensorflow as tf
-from PIL import Image
-import json
 import os
+import threading
+import metrics
+from buffer_arena import BufferArena
+from config import Config
+from inference_backends import KerasBackend, create_backend
+from particle_table import ParticleTable
+
+# 3x3 structuring element for the mask clean-up
+_MORPH_KERNEL = np.ones((3,3), np.uint8)
 
 class MicroplasticAnalyzer:
-    def __init__(self):
+    def __init__(self, batch_size=None, backend=None):
         # Microplastic type definitions
         self.microplastic_types = {
             0: "Polyethylene (PE)",
@@ -20,8 +26,21 @@ class MicroplasticAnalyzer:
         }
         
         self.model = None
+        # Inference backend; defaults to Config.INFERENCE_BACKEND
+        self.backend = backend
+        # Serializes inference so one analyzer can be shared across threads
+        self._predict_lock = threading.Lock()
+        # Optional InferenceScheduler that merges batches across concurrent requests
+        self.scheduler = None
+        # One scratch buffer arena per thread sharing this analyzer
+        self._local = threading.local()
+        self._arenas = []
+        self._arenas_lock = threading.Lock()
         self.load_model()
         
+        # Number of particle crops sent to the model per forward pass
+        self.batch_size = batch_size or Config.INFERENCE_BATCH_SIZE
+        
         # Size categories
         self.size_categories = {
             'small': (0, 100),      # 0-100 micrometers
@@ -30,56 +49,73 @@ class MicroplasticAnalyzer:
         }
     
     def load_model(self):
-        """Load or create a pre-trained model for microplastic classification"""
+        """Load or create a pre-trained model through the configured inference backend"""
+        if self.backend is None:
+            self.backend = create_backend()
+        
         try:
-            # Try to load existing model
-            if os.path.exists('models/microplastic_model.h5'):
-                self.model = tf.keras.models.load_model('models/microplastic_model.h5')
-                print("Loaded existing microplastic classification model")
-            else:
-                # Create a simple CNN model for demonstration
-                self.create_demo_model()
-                print("Created demo model for microplastic classification")
+            self.backend.load(len(self.microplastic_types))
         except Exception as e:
-            print(f"Error loading model: {e}")
-            self.create_demo_model()
+            if self.backend.name == 'keras':
+                raise
+            print(f"Error loading {self.backend.name} backend: {e}; falling back to Keras")
+            self.backend = KerasBackend().load(len(self.microplastic_types))
+        
+        # Keep the raw Keras model reachable for callers that use it directly
+        self.model = getattr(self.backend, 'model', None)
     
     def create_demo_model(self):
         """Create a demo CNN model for microplastic classification"""
-        model = tf.keras.Sequential([
-            tf.keras.layers.Conv2D(32, (3, 3), activation='relu', input_shape=(224, 224, 3)),
-            tf.keras.layers.MaxPooling2D(2, 2),
-            tf.keras.layers.Conv2D(64, (3, 3), activation='relu'),
-            tf.keras.layers.MaxPooling2D(2, 2),
-            tf.keras.layers.Conv2D(128, (3, 3), activation='relu'),
-            tf.keras.layers.MaxPooling2D(2, 2),
-            tf.keras.layers.Flatten(),
-            tf.keras.layers.Dense(512, activation='relu'),
-            tf.keras.layers.Dropout(0.5),
-            tf.keras.layers.Dense(len(self.microplastic_types), activation='softmax')
-        ])
-        
-        model.compile(
-            optimizer='adam',
-            loss='categorical_crossentropy',
-            metrics=['accuracy']
-        )
+        backend = KerasBackend()
+        backend.num_classes = len(self.microplastic_types)
+        self.model = backend.create_demo_model()
+        self.backend = backend
+    
+    def _arena(self):
+        """Return the calling thread's buffer arena"""
+        arena = getattr(self._local, 'arena', None)
+        if arena is None:
+            arena = self._local.arena = BufferArena()
+            with self._arenas_lock:
+                self._arenas.append(arena)
+        return arena
+    
+    def get_arena_stats(self):
+        """Buffer reuse statistics summed over all threads"""
+        with self._arenas_lock:
+            arenas = list(self._arenas)
+        totals = {'threads': len(arenas), 'allocations': 0, 'reuses': 0, 'oversize': 0, 'buffers': 0, 'held_mb': 0.0}
+        for arena in arenas:
+            for key, value in arena.get_stats().items():
+                totals[key] += value
+        totals['held_mb'] = round(totals['held_mb'], 2)
+        return totals
+    
+    def load_image(self, source):
+        """Decode an image from raw bytes, a file-like object, a path or an existing array"""
+        if isinstance(source, np.ndarray):
+            # Already decoded; shared as-is across detection and classification
+            return source
         
-        self.model = model
+        if hasattr(source, 'read'):
+            source = source.read()
         
-        # Create models directory if it doesn't exist
-        os.makedirs('models', exist_ok=True)
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            buffer = np.frombuffer(source, dtype=np.uint8)
+            image = cv2.imdecode(buffer, cv2.IMREAD_COLOR) if buffer.size else None
+        else:
+            # File paths stay supported as a convenience
+            image = cv2.imread(os.fspath(source))
         
-        # Save the demo model
-        self.model.save('models/microplastic_model.h5')
+        if image is None:
+            raise ValueError("Could not load image")
+        return image
     
-    def preprocess_image(self, image_path):
+    def preprocess_image(self, image_source):
         """Preprocess image for analysis"""
         try:
             # Load image
-            image = cv2.imread(image_path)
-            if image is None:
-                raise ValueError("Could not load image")
+            image = self.load_image(image_source)
             
             # Convert BGR to RGB
             image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
@@ -97,222 +133,385 @@ class MicroplasticAnalyzer:
         except Exception as e:
             raise ValueError(f"Image preprocessing failed: {e}")
     
-    def detect_particles(self, image_path):
-        """Detect microplastic particles in the image with improved accuracy"""
+    def detect_particles(self, image_source, keep_contours=False, mode=None):
+        """Detect microplastic particles in the image and return them as a ParticleTable
+        
+        mode is 'full' (filter the whole frame) or 'pyramid' (filter only
+        candidate regions found on a downscaled copy); defaults to
+        Config.DETECTION_MODE.
+        """
         try:
-            # Load image
-            image = cv2.imread(image_path)
-            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-            
-            # Enhanced preprocessing
-            # Apply bilateral filter to reduce noise while preserving edges
-            filtered = cv2.bilateralFilter(gray, 9, 75, 75)
+            # Load image (no-op when an already decoded array is passed in)
+            image = self.load_image(image_source)
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=self._arena().get('gray', image.shape[:2]))
             
-            # Apply adaptive threshold for better particle detection
-            thresh = cv2.adaptiveThreshold(filtered, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
-                                         cv2.THRESH_BINARY, 11, 2)
+            return self._find_particles(gray, keep_contours, mode)
+        except Exception as e:
+            print(f"Particle detection failed: {e}")
+            return ParticleTable.empty()
+    
+    def detect_particles_tiled(self, image_source, tile_size=None, overlap=None):
+        """Detect particles in overlapping tiles so peak memory is bounded by the tile size"""
+        from tiled_detection import TiledImageReader, detect_particles_tiled
+        
+        try:
+            reader = image_source
+            if not isinstance(reader, TiledImageReader):
+                reader = TiledImageReader(image_source)
+            return detect_particles_tiled(
+                reader, self._particle_mask,
+                tile_size or Config.TILE_SIZE,
+                Config.TILE_OVERLAP if overlap is None else overlap
+            )
+        except Exception as e:
+            print(f"Tiled particle detection failed: {e}")
+            return ParticleTable.empty()
+    
+    def _find_particles(self, gray, keep_contours=False, mode=None, rois=None):
+        """Run filtering, thresholding and contour analysis on a grayscale array
+        
+        rois, if given, limits filtering to those full-resolution
+        (x0, y0, x1, y1) boxes (e.g. the regions that changed between video frames).
+        """
+        arena = self._arena()
+        if rois is not None:
+            from pyramid_detection import build_roi_mask
             
-            # Morphological operations to clean up the image
-            kernel = np.ones((3,3), np.uint8)
-            thresh = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, kernel)
-            thresh = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel)
+            with metrics.timed('roi_mask'):
+                thresh, _ = build_roi_mask(
+                    gray, rois, lambda window: self._particle_mask(window, arena, 'window_'),
+                    Config.PYRAMID_MAX_COVERAGE, out=arena.get('pyramid_mask', gray.shape)
+                )
+        elif (mode or Config.DETECTION_MODE) == 'pyramid':
+            from pyramid_detection import build_pyramid_mask
             
-            # Find contours with hierarchy
+            # Window masks are copied into the assembled mask right away, so they can share buffers
+            with metrics.timed('pyramid_mask'):
+                thresh, _ = build_pyramid_mask(
+                    gray, lambda window: self._particle_mask(window, arena, 'window_'),
+                    Config.PYRAMID_SCALE, Config.PYRAMID_CONTRAST, Config.PYRAMID_MAX_COVERAGE,
+                    out=arena.get('pyramid_mask', gray.shape)
+                )
+        else:
+            with metrics.timed('bilateral_filter'):
+                filtered = self._denoise(gray, out=arena.get('filtered', gray.shape))
+            with metrics.timed('threshold'):
+                thresh = self._threshold_mask(
+                    filtered, out=arena.get('thresh', gray.shape), scratch=arena.get('morph', gray.shape)
+                )
+        
+        # Find contours with hierarchy
+        with metrics.timed('contours'):
             contours, hierarchy = cv2.findContours(thresh, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            particles = []
-            for contour in contours:
-                area = cv2.contourArea(contour)
-                
-                # More sophisticated filtering
-                if area > 30:  # Minimum area threshold
-                    # Get bounding rectangle
-                    x, y, w, h = cv2.boundingRect(contour)
-                    
-                    # Calculate aspect ratio to filter out very elongated objects
-                    aspect_ratio = float(w) / h
-                    if 0.1 < aspect_ratio < 10:  # Reasonable aspect ratio
-                        
-                        # Calculate more accurate size
-                        # Assuming 1 pixel = 1 micrometer (adjust based on your microscope)
-                        size_micrometers = max(w, h)
-                        
-                        # Calculate circularity to identify round particles
-                        perimeter = cv2.arcLength(contour, True)
-                        if perimeter > 0:
-                            circularity = 4 * np.pi * area / (perimeter * perimeter)
-                        else:
-                            circularity = 0
-                        
-                        # Calculate solidity (convex hull ratio)
-                        hull = cv2.convexHull(contour)
-                        hull_area = cv2.contourArea(hull)
-                        solidity = float(area) / hull_area if hull_area > 0 else 0
-                        
-                        particles.append({
-                            'contour': contour,
-                            'area': area,
-                            'size_micrometers': size_micrometers,
-                            'bbox': (x, y, w, h),
-                            'circularity': circularity,
-                            'solidity': solidity,
-                            'aspect_ratio': aspect_ratio
-                        })
-            
-            return particles
-        except Exception as e:
-            print(f"Particle detection failed: {e}")
-            return []
+        
+        # Compute features for all contours in bulk
+        with metrics.timed('feature_extraction'):
+            return ParticleTable.from_contours(contours, min_area=30, keep_contours=keep_contours)
+    
+    def _particle_mask(self, gray, arena=None, prefix=''):
+        """Binary particle mask from the filter, threshold and morphology pipeline
+        
+        Without an arena the mask is a new array. With one, it lives in the
+        arena's buffers and is only valid until the next call with the same prefix.
+        """
+        if arena is None:
+            return self._threshold_mask(self._denoise(gray))
+        return self._threshold_mask(
+            self._denoise(gray, out=arena.get(prefix + 'filtered', gray.shape)),
+            out=arena.get(prefix + 'thresh', gray.shape),
+            scratch=arena.get(prefix + 'morph', gray.shape)
+        )
+    
+    def _denoise(self, gray, out=None):
+        """Enhanced preprocessing before thresholding"""
+        # Apply bilateral filter to reduce noise while preserving edges
+        return cv2.bilateralFilter(gray, 9, 75, 75, dst=out)
+    
+    def _threshold_mask(self, filtered, out=None, scratch=None):
+        """Threshold a denoised grayscale image into a cleaned binary mask
+        
+        out and scratch are optional preallocated arrays of the image's shape;
+        the mask is written to out.
+        """
+        # Apply adaptive threshold for better particle detection
+        thresh = cv2.adaptiveThreshold(filtered, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                                     cv2.THRESH_BINARY, 11, 2, dst=out)
+        
+        # Morphological operations to clean up the image
+        closed = cv2.morphologyEx(thresh, cv2.MORPH_CLOSE, _MORPH_KERNEL, dst=scratch)
+        thresh = cv2.morphologyEx(closed, cv2.MORPH_OPEN, _MORPH_KERNEL, dst=out)
+        
+        return thresh
     
     def classify_particle(self, image, particle_data):
         """Classify a single particle with enhanced features"""
-        try:
-            x, y, w, h = particle_data['bbox']
+        return self.classify_particles(image, [particle_data], batch_size=1)[0]
+    
+    def classify_particles(self, image, particles, batch_size=None, progress_callback=None):
+        """Classify all particles of one image with batched model inference
+        
+        progress_callback, if given, is called as (classified, total) after each batch.
+        """
+        if not isinstance(particles, ParticleTable):
+            particles = ParticleTable.from_records(particles)
+        
+        batch_size = batch_size or self.batch_size
+        results = [None] * len(particles)
+        bboxes = particles.bbox.tolist()
+        arena = self._arena()
+        
+        for start in range(0, len(particles), batch_size):
+            # Build the model input for this chunk only, so memory stays
+            # bounded by the batch size rather than the particle count.
+            # Crops are uint8 and written straight into a reused batch buffer;
+            # the model normalizes them itself.
+            end = min(start + batch_size, len(particles))
+            batch = arena.get('crop_batch', (end - start, 224, 224, 3))
+            indices = []
+            for idx in range(start, end):
+                try:
+                    self._extract_particle_crop(image, bboxes[idx], out=batch[len(indices)], arena=arena)
+                    indices.append(idx)
+                except Exception as e:
+                    print(f"Particle classification failed: {e}")
+                    results[idx] = self._unclassified_result()
             
-            # Extract particle region with padding
-            padding = 10
-            x1 = max(0, x - padding)
-            y1 = max(0, y - padding)
-            x2 = min(image.shape[1], x + w + padding)
-            y2 = min(image.shape[0], y + h + padding)
+            if not indices:
+                continue
             
-            particle_img = image[y1:y2, x1:x2]
+            try:
+                batch = batch[:len(indices)]
+                with metrics.timed('inference'):
+                    if self.scheduler is not None:
+                        predictions = self.scheduler.predict(batch)
+                    else:
+                        with self._predict_lock:
+                            predictions = self.backend.predict(batch)
+            except Exception as e:
+                print(f"Particle classification failed: {e}")
+                for idx in indices:
+                    results[idx] = self._unclassified_result()
+                continue
             
-            # Enhanced preprocessing
-            # Convert to RGB if needed
-            if len(particle_img.shape) == 3:
-                particle_img = cv2.cvtColor(particle_img, cv2.COLOR_BGR2RGB)
+            for idx, scores in zip(indices, predictions):
+                results[idx] = self._interpret_prediction(scores, particles, idx)
             
-            # Apply histogram equalization for better contrast
-            if len(particle_img.shape) == 3:
-                # For color images, equalize each channel
+            if progress_callback is not None:
+                progress_callback(min(start + batch_size, len(particles)), len(particles))
+        
+        return results
+    
+    def _extract_particle_crop(self, image, bbox, out=None, arena=None):
+        """Extract the uint8 RGB model input crop for a single particle
+        
+        The crop is written to out (a 224x224x3 uint8 array) when given;
+        arena supplies reusable scratch buffers for the intermediate images.
+        """
+        x, y, w, h = bbox
+        
+        # Extract particle region with padding
+        padding = 10
+        x1 = max(0, x - padding)
+        y1 = max(0, y - padding)
+        x2 = min(image.shape[1], x + w + padding)
+        y2 = min(image.shape[0], y + h + padding)
+        
+        particle_img = image[y1:y2, x1:x2]
+        
+        # Enhanced preprocessing
+        # Convert to RGB if needed
+        if len(particle_img.shape) == 3:
+            rgb = arena.get('crop_rgb', particle_img.shape) if arena is not None else None
+            particle_img = cv2.cvtColor(particle_img, cv2.COLOR_BGR2RGB, dst=rgb)
+        
+        # Apply histogram equalization for better contrast
+        if len(particle_img.shape) == 3:
+            # For color images, equalize each channel
+            if arena is not None:
+                # equalizeHist needs a contiguous single-channel image
+                channel = arena.get('crop_channel', particle_img.shape[:2])
                 for i in range(3):
-                    particle_img[:,:,i] = cv2.equalizeHist(particle_img[:,:,i])
+                    np.copyto(channel, particle_img[:,:,i])
+                    particle_img[:,:,i] = cv2.equalizeHist(channel, dst=channel)
             else:
-                particle_img = cv2.equalizeHist(particle_img)
-            
-            # Resize to model input size
-            particle_img = cv2.resize(particle_img, (224, 224))
-            
-            # Normalize
-            particle_img = particle_img.astype(np.float32) / 255.0
+                for i in range(3):
+                    particle_img[:,:,i] = cv2.equalizeHist(particle_img[:,:,i])
+        else:
+            # The model takes three channels
+            particle_img = cv2.cvtColor(cv2.equalizeHist(particle_img), cv2.COLOR_GRAY2RGB)
+        
+        # Resize to model input size; normalization happens inside the model
+        return cv2.resize(particle_img, (224, 224), dst=out)
+    
+    def _interpret_prediction(self, scores, particles, index):
+        """Turn the model scores for one particle into a classification result"""
+        class_id = np.argmax(scores)
+        confidence = float(scores[class_id])
+        
+        # Apply confidence threshold
+        if confidence < 0.3:  # Low confidence threshold
+            class_id = 7  # Unknown/Other
+            confidence = 0.3
+        
+        # Get all prediction scores for analysis
+        all_scores = [float(score) for score in scores]
+        
+        return {
+            'type': self.microplastic_types[class_id],
+            'confidence': confidence,
+            'class_id': class_id,
+            'all_scores': all_scores,
+            'particle_features': {
+                'circularity': float(particles.circularity[index]),
+                'solidity': float(particles.solidity[index]),
+                'aspect_ratio': float(particles.aspect_ratio[index])
+            }
+        }
+    
+    def _unclassified_result(self):
+        """Fallback classification for particles that could not be scored"""
+        return {
+            'type': 'Unknown/Other',
+            'confidence': 0.0,
+            'class_id': 7,
+            'all_scores': [0.0] * len(self.microplastic_types),
+            'particle_features': {}
+        }
+    
+    @metrics.instrument('analyze_image')
+    def analyze_image(self, image_source, progress_callback=None):
+        """Main analysis function; accepts raw bytes, a decoded array or a file path"""
+        try:
+            # Decode the image once and share it across every stage
+            with metrics.timed('decode'):
+                original_image = self.load_image(image_source)
+            metrics.set_labels(pixels=original_image.shape[0] * original_image.shape[1])
             
-            # Add batch dimension
-            particle_img = np.expand_dims(particle_img, axis=0)
+            # Detect particles
+            particles = self.detect_particles(original_image)
+            metrics.set_labels(particles=len(particles))
             
-            # Predict
-            predictions = self.model.predict(particle_img, verbose=0)
-            class_id = np.argmax(predictions[0])
-            confidence = float(predictions[0][class_id])
+            if not len(particles):
+                return self._empty_result()
             
-            # Apply confidence threshold
-            if confidence < 0.3:  # Low confidence threshold
-                class_id = 7  # Unknown/Other
-                confidence = 0.3
+            # Classify every particle in batched forward passes
+            with metrics.timed('classification'):
+                classifications = self.classify_particles(
+                    original_image, particles, progress_callback=progress_callback
+                )
             
-            # Get all prediction scores for analysis
-            all_scores = [float(score) for score in predictions[0]]
+            with metrics.timed('summarize'):
+                return self._summarize_particles(particles, classifications)
             
-            return {
-                'type': self.microplastic_types[class_id],
-                'confidence': confidence,
-                'class_id': class_id,
-                'all_scores': all_scores,
-                'particle_features': {
-                    'circularity': particle_data.get('circularity', 0),
-                    'solidity': particle_data.get('solidity', 0),
-                    'aspect_ratio': particle_data.get('aspect_ratio', 1)
-                }
-            }
         except Exception as e:
-            print(f"Particle classification failed: {e}")
-            return {
-                'type': 'Unknown/Other',
-                'confidence': 0.0,
-                'class_id': 7,
-                'all_scores': [0.0] * len(self.microplastic_types),
-                'particle_features': {}
-            }
+            raise ValueError(f"Image analysis failed: {e}")
     
-    def analyze_image(self, image_path):
-        """Main analysis function"""
+    @metrics.instrument('analyze_image_tiled')
+    def analyze_image_tiled(self, image_path, tile_size=None, overlap=None):
+        """Analyze a large image tile by tile without decoding the full frame"""
+        from tiled_detection import TiledImageReader
+        
         try:
-            # Load original image
-            original_image = cv2.imread(image_path)
-            if original_image is None:
-                raise ValueError("Could not load image")
+            reader = TiledImageReader(image_path)
+            metrics.set_labels(pixels=reader.height * reader.width)
+            with metrics.timed('tiled_detection'):
+                particles = self.detect_particles_tiled(reader, tile_size, overlap)
+            metrics.set_labels(particles=len(particles))
             
-            # Detect particles
-            particles = self.detect_particles(image_path)
-            
-            if not particles:
-                return {
-                    'types': [],
-                    'counts': [],
-                    'confidence_scores': [],
-                    'particle_count': 0,
-                    'size_distribution': {},
-                    'particles': []
-                }
-            
-            # Classify each particle
-            classified_particles = []
-            type_counts = {}
-            confidence_scores = []
+            if not len(particles):
+                return self._empty_result()
             
-            for particle in particles:
-                classification = self.classify_particle(original_image, particle)
-                
-                particle_info = {
-                    'size_micrometers': particle['size_micrometers'],
-                    'area': particle['area'],
-                    'classification': classification,
-                    'circularity': particle.get('circularity', 0),
-                    'solidity': particle.get('solidity', 0),
-                    'aspect_ratio': particle.get('aspect_ratio', 1)
-                }
-                classified_particles.append(particle_info)
-                
-                # Count types
-                particle_type = classification['type']
-                if particle_type in type_counts:
-                    type_counts[particle_type] += 1
-                else:
-                    type_counts[particle_type] = 1
-                
-                confidence_scores.append(classification['confidence'])
+            # The reader serves padded crop windows, so classification
+            # never needs the whole frame in memory either
+            with metrics.timed('classification'):
+                classifications = self.classify_particles(reader, particles)
             
-            # Calculate size distribution
-            size_distribution = self.calculate_size_distribution(classified_particles)
+            return self._summarize_particles(particles, classifications)
             
-            # Prepare results
-            types = list(type_counts.keys())
-            counts = list(type_counts.values())
+        except Exception as e:
+            raise ValueError(f"Tiled image analysis failed: {e}")
+    
+    def analyze_video(self, source, fps=None, window_seconds=None):
+        """Analyze a video file or numbered image sequence; yields particle counts per time window"""
+        from video_analysis import VideoAnalyzer
+        
+        return VideoAnalyzer(self, fps=fps, window_seconds=window_seconds).analyze(source)
+    
+    def _empty_result(self):
+        """Result returned when no particles are detected"""
+        return {
+            'types': [],
+            'counts': [],
+            'confidence_scores': [],
+            'particle_count': 0,
+            'size_distribution': {},
+            'particles': []
+        }
+    
+    def _summarize_particles(self, particles, classifications):
+        """Combine the particle table and its classifications into the analysis result"""
+        type_counts = {}
+        confidence_scores = []
+        
+        for classification in classifications:
+            # Count types
+            particle_type = classification['type']
+            if particle_type in type_counts:
+                type_counts[particle_type] += 1
+            else:
+                type_counts[particle_type] = 1
             
-            return {
-                'types': types,
-                'counts': counts,
-                'confidence_scores': [float(score) for score in confidence_scores],
-                'particle_count': int(len(particles)),
-                'size_distribution': size_distribution,
-                'particles': classified_particles,
-                'average_confidence': float(np.mean(confidence_scores)) if confidence_scores else 0.0
+            confidence_scores.append(classification['confidence'])
+        
+        # Per-particle records are only materialized for the response
+        classified_particles = [
+            {
+                'size_micrometers': size,
+                'area': area,
+                'classification': classification,
+                'circularity': circularity,
+                'solidity': solidity,
+                'aspect_ratio': aspect_ratio
             }
-            
-        except Exception as e:
-            raise ValueError(f"Image analysis failed: {e}")
+            for size, area, circularity, solidity, aspect_ratio, classification in zip(
+                particles.size_micrometers.tolist(), particles.area.tolist(),
+                particles.circularity.tolist(), particles.solidity.tolist(),
+                particles.aspect_ratio.tolist(), classifications
+            )
+        ]
+        
+        # Calculate size distribution
+        size_distribution = self.calculate_size_distribution(particles)
+        
+        # Prepare results
+        types = list(type_counts.keys())
+        counts = list(type_counts.values())
+        
+        return {
+            'types': types,
+            'counts': counts,
+            'confidence_scores': [float(score) for score in confidence_scores],
+            'particle_count': int(len(particles)),
+            'size_distribution': size_distribution,
+            'particles': classified_particles,
+            'average_confidence': float(np.mean(confidence_scores)) if confidence_scores else 0.0
+        }
     
     def calculate_size_distribution(self, particles):
         """Calculate size distribution of particles"""
-        distribution = {'small': 0, 'medium': 0, 'large': 0}
-        
-        for particle in particles:
-            size = particle['size_micrometers']
-            if size < 100:
-                distribution['small'] += 1
-            elif size < 500:
-                distribution['medium'] += 1
-            else:
-                distribution['large'] += 1
+        if isinstance(particles, ParticleTable):
+            sizes = particles.size_micrometers
+        else:
+            sizes = np.array([particle['size_micrometers'] for particle in particles])
         
-        return distribution
+        return {
+            'small': int(np.count_nonzero(sizes < 100)),
+            'medium': int(np.count_nonzero((sizes >= 100) & (sizes < 500))),
+            'large': int(np.count_nonzero(sizes >= 500))
+        }
+
+if __name__ == '__main__':
+    # python -m microplastic_analyzer batch <dir>
+    import sys
+    from batch_analysis import main
+    sys.exit(main())
@@ -0,0 +1,171 @@
+"""
+Process-wide model registry for the Microplastic Analysis System
+Loads the classification model once per worker and hands out shared components
+"""
+
+import logging
+import os
+import threading
+import time
+
+import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+def _current_rss_mb():
+    """Return the resident memory of this process in MB, or None if unknown"""
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return round(int(line.split()[1]) / 1024.0, 1)
+    except OSError:
+        pass
+    
+    try:
+        import resource
+        import sys
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is reported in bytes on macOS and kilobytes elsewhere
+        divisor = 1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0
+        return round(peak / divisor, 1)
+    except Exception:
+        return None
+
+class ModelRegistry:
+    """Owns the shared analyzer, comparator and recommender of one process"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        self._analyzer = None
+        self._comparator = None
+        self._recommender = None
+        self.stats = {
+            'loaded': False,
+            'load_count': 0,
+            'load_time_seconds': None,
+            'rss_before_load_mb': None,
+            'rss_after_load_mb': None,
+            'model_memory_mb': None,
+            'loaded_at': None,
+            'backend': None,
+            'preload_error': None
+        }
+    
+    def _check_process(self):
+        """Drop components inherited from a parent process across fork()"""
+        if os.getpid() != self._pid:
+            self._pid = os.getpid()
+            self._analyzer = None
+            self._comparator = None
+            self._recommender = None
+            self.stats['loaded'] = False
+    
+    def preload(self):
+        """Load every shared component now instead of on the first request"""
+        self.get_analyzer()
+        self.get_comparator()
+        self.get_recommender()
+        return self.get_stats()
+    
+    def preload_in_background(self):
+        """Start preload() on a daemon thread and return the thread"""
+        def warm_up():
+            try:
+                self.preload()
+            except Exception as e:
+                self.stats['preload_error'] = str(e)
+                logger.exception("Background model preload failed")
+        
+        self.stats['preload_error'] = None
+        thread = threading.Thread(target=warm_up, name='model-preload', daemon=True)
+        thread.start()
+        return thread
+    
+    def get_analyzer(self):
+        """Return the shared MicroplasticAnalyzer, loading the model on first use"""
+        self._check_process()
+        if self._analyzer is None:
+            with self._lock:
+                if self._analyzer is None:
+                    from microplastic_analyzer import MicroplasticAnalyzer
+                    
+                    rss_before = _current_rss_mb()
+                    start = time.perf_counter()
+                    analyzer = MicroplasticAnalyzer()
+                    if Config.INFERENCE_SCHEDULER_ENABLED:
+                        from inference_scheduler import InferenceScheduler
+                        analyzer.scheduler = InferenceScheduler(analyzer.backend)
+                    elapsed = time.perf_counter() - start
+                    metrics.record('model_load', elapsed)
+                    rss_after = _current_rss_mb()
+                    
+                    self.stats.update({
+                        'loaded': True,
+                        'load_count': self.stats['load_count'] + 1,
+                        'load_time_seconds': round(elapsed, 3),
+                        'rss_before_load_mb': rss_before,
+                        'rss_after_load_mb': rss_after,
+                        'model_memory_mb': (round(rss_after - rss_before, 1)
+                                            if rss_before is not None and rss_after is not None
+                                            else None),
+                        'loaded_at': time.time(),
+                        'backend': analyzer.backend.describe()
+                    })
+                    print(f"Model loaded in {elapsed:.2f}s "
+                          f"(pid {self._pid}, rss {rss_after} MB)")
+                    self._analyzer = analyzer
+        return self._analyzer
+    
+    def get_comparator(self):
+        """Return the shared DataComparator"""
+        self._check_process()
+        if self._comparator is None:
+            with self._lock:
+                if self._comparator is None:
+                    from data_comparator import DataComparator
+                    self._comparator = DataComparator()
+        return self._comparator
+    
+    def get_recommender(self):
+        """Return the shared SolutionRecommender"""
+        self._check_process()
+        if self._recommender is None:
+            with self._lock:
+                if self._recommender is None:
+                    from solution_recommender import SolutionRecommender
+                    self._recommender = SolutionRecommender()
+        return self._recommender
+    
+    def get_stats(self):
+        """Report model load time and memory use for this worker"""
+        stats = dict(self.stats)
+        stats['pid'] = os.getpid()
+        stats['current_rss_mb'] = _current_rss_mb()
+        if self._analyzer is not None:
+            stats['buffer_arena'] = self._analyzer.get_arena_stats()
+        if self._analyzer is not None and self._analyzer.scheduler is not None:
+            stats['scheduler'] = self._analyzer.scheduler.get_stats()
+        return stats
+
+# One registry per process; gunicorn workers each get their own after fork
+registry = ModelRegistry()
+
+def get_registry():
+    """Return the process-wide model registry"""
+    return registry
+
+def preload_if_configured():
+    """Preload the model when PRELOAD_MODEL is enabled
+    
+    With PRELOAD_IN_BACKGROUND the load runs on a daemon thread and this
+    returns None straight away.
+    """
+    if not Config.PRELOAD_MODEL:
+        return None
+    if Config.PRELOAD_IN_BACKGROUND:
+        registry.preload_in_background()
+        return None
+    return registry.preload()
@@ -0,0 +1,192 @@
+"""
+Columnar storage for detected microplastic particles
+Particle geometry is held in NumPy arrays and computed in bulk for all contours
+"""
+
+import cv2
+import numpy as np
+
+class ParticleTable:
+    """Detected particles as parallel NumPy columns instead of one dict per particle"""
+    
+    def __init__(self, bbox, area, perimeter, circularity, solidity, contours=None):
+        self.bbox = np.asarray(bbox, dtype=np.int32).reshape(-1, 4)
+        self.area = np.asarray(area, dtype=np.float64)
+        self.perimeter = np.asarray(perimeter, dtype=np.float64)
+        self.circularity = np.asarray(circularity, dtype=np.float64)
+        self.solidity = np.asarray(solidity, dtype=np.float64)
+        # Raw contours are only kept when explicitly requested
+        self.contours = contours
+        
+        widths = self.bbox[:, 2]
+        heights = self.bbox[:, 3]
+        self.aspect_ratio = widths / np.maximum(heights, 1).astype(np.float64)
+        # Assuming 1 pixel = 1 micrometer (adjust based on your microscope)
+        self.size_micrometers = np.maximum(widths, heights)
+    
+    @classmethod
+    def empty(cls):
+        """Table with no particles"""
+        return cls(np.empty((0, 4)), [], [], [], [])
+    
+    @classmethod
+    def from_contours(cls, contours, min_area=30, keep_contours=False):
+        """Compute particle features for all contours at once
+        
+        Bounding boxes, areas (shoelace formula) and perimeters are reduced
+        per contour over one concatenated point array, matching
+        cv2.boundingRect, cv2.contourArea and cv2.arcLength. Only the convex
+        hull is still taken per contour, and only for particles that pass
+        the area and aspect-ratio filters.
+        """
+        if len(contours) == 0:
+            return cls.empty()
+        
+        lengths = np.fromiter((len(c) for c in contours), dtype=np.int64, count=len(contours))
+        points = np.concatenate(contours).reshape(-1, 2).astype(np.int64)
+        starts = np.zeros(len(contours), dtype=np.int64)
+        np.cumsum(lengths[:-1], out=starts[1:])
+        
+        xs = points[:, 0]
+        ys = points[:, 1]
+        
+        # Bounding boxes
+        x_min = np.minimum.reduceat(xs, starts)
+        y_min = np.minimum.reduceat(ys, starts)
+        widths = np.maximum.reduceat(xs, starts) - x_min + 1
+        heights = np.maximum.reduceat(ys, starts) - y_min + 1
+        
+        # Index of the next vertex of each closed polygon
+        following = np.arange(1, len(points) + 1)
+        following[starts + lengths - 1] = starts
+        
+        # Areas via the shoelace formula and closed perimeters
+        cross = (xs * ys[following] - xs[following] * ys).astype(np.float64)
+        areas = np.abs(np.add.reduceat(cross, starts)) / 2.0
+        dx = xs[following] - xs
+        dy = ys[following] - ys
+        # cv2.arcLength takes each segment length in single precision
+        steps = np.sqrt((dx * dx + dy * dy).astype(np.float32)).astype(np.float64)
+        perimeters = np.add.reduceat(steps, starts)
+        
+        # Minimum area and reasonable aspect ratio filters
+        aspect_ratios = widths / heights.astype(np.float64)
+        keep = np.flatnonzero((areas > min_area) & (aspect_ratios > 0.1) & (aspect_ratios < 10))
+        
+        areas = areas[keep]
+        perimeters = perimeters[keep]
+        bbox = np.stack([x_min[keep], y_min[keep], widths[keep], heights[keep]], axis=1)
+        
+        # Circularity identifies round particles
+        circularity = np.zeros(len(keep), dtype=np.float64)
+        positive = perimeters > 0
+        circularity[positive] = 4 * np.pi * areas[positive] / (perimeters[positive] * perimeters[positive])
+        
+        # Solidity (convex hull ratio)
+        kept_contours = [contours[i] for i in keep]
+        hull_areas = np.fromiter(
+            (cv2.contourArea(cv2.convexHull(c)) for c in kept_contours),
+            dtype=np.float64, count=len(kept_contours)
+        )
+        solidity = np.zeros(len(keep), dtype=np.float64)
+        nonzero = hull_areas > 0
+        solidity[nonzero] = areas[nonzero] / hull_areas[nonzero]
+        
+        return cls(bbox, areas, perimeters, circularity, solidity,
+                   contours=kept_contours if keep_contours else None)
+    
+    @classmethod
+    def from_records(cls, records):
+        """Build a table from per-particle dicts such as the legacy detection output"""
+        records = list(records)
+        if not records:
+            return cls.empty()
+        
+        contours = None
+        if all('contour' in record for record in records):
+            contours = [record['contour'] for record in records]
+        
+        return cls(
+            [record['bbox'] for record in records],
+            [record.get('area', 0) for record in records],
+            [record.get('perimeter', 0) for record in records],
+            [record.get('circularity', 0) for record in records],
+            [record.get('solidity', 0) for record in records],
+            contours=contours
+        )
+    
+    @classmethod
+    def concatenate(cls, tables):
+        """Stack several tables into one"""
+        tables = [table for table in tables if len(table)]
+        if not tables:
+            return cls.empty()
+        
+        contours = None
+        if all(table.contours is not None for table in tables):
+            contours = [contour for table in tables for contour in table.contours]
+        
+        return cls(
+            np.concatenate([table.bbox for table in tables]),
+            np.concatenate([table.area for table in tables]),
+            np.concatenate([table.perimeter for table in tables]),
+            np.concatenate([table.circularity for table in tables]),
+            np.concatenate([table.solidity for table in tables]),
+            contours=contours
+        )
+    
+    def __len__(self):
+        return len(self.area)
+    
+    def __getitem__(self, index):
+        """Return one particle as a dict (for callers that need row access)"""
+        return self.row(index)
+    
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.row(index)
+    
+    def row(self, index):
+        """Materialize a single particle as a dict"""
+        x, y, w, h = self.bbox[index].tolist()
+        row = {
+            'area': float(self.area[index]),
+            'size_micrometers': int(self.size_micrometers[index]),
+            'bbox': (x, y, w, h),
+            'perimeter': float(self.perimeter[index]),
+            'circularity': float(self.circularity[index]),
+            'solidity': float(self.solidity[index]),
+            'aspect_ratio': float(self.aspect_ratio[index])
+        }
+        if self.contours is not None:
+            row['contour'] = self.contours[index]
+        return row
+    
+    def select(self, indices):
+        """Return a new table holding only the given rows (indices or boolean mask)"""
+        indices = np.asarray(indices)
+        if indices.dtype == bool:
+            indices = np.flatnonzero(indices)
+        
+        contours = None
+        if self.contours is not None:
+            contours = [self.contours[i] for i in indices]
+        
+        return ParticleTable(
+            self.bbox[indices], self.area[indices], self.perimeter[indices],
+            self.circularity[indices], self.solidity[indices], contours=contours
+        )
+    
+    def offset(self, dx, dy):
+        """Return a copy with bounding boxes and contours shifted by (dx, dy)"""
+        bbox = self.bbox.copy()
+        bbox[:, 0] += dx
+        bbox[:, 1] += dy
+        
+        contours = None
+        if self.contours is not None:
+            shift = np.array([dx, dy], dtype=np.int32)
+            contours = [contour + shift for contour in self.contours]
+        
+        return ParticleTable(bbox, self.area, self.perimeter, self.circularity,
+                             self.solidity, contours=contours)
@@ -0,0 +1,436 @@
+"""
+SQLite persistence for the Microplastic Analysis System
+Per-thread pooled connections in WAL mode and an optional write-behind queue for analysis records
+Each analysis also stores one row per detected particle for analytical queries
+"""
+
+import atexit
+import base64
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+import serialization
+import trend_rollups
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Seconds a statement waits on another writer before raising "database is locked"
+BUSY_TIMEOUT = 30
+
+PRAGMAS = (
+    # Readers no longer block the writer and vice versa
+    'PRAGMA journal_mode=WAL',
+    # Durable across application crashes; only a power loss can drop the last commits
+    'PRAGMA synchronous=NORMAL',
+    'PRAGMA temp_store=MEMORY',
+    'PRAGMA cache_size=-16000',  # KiB
+    'PRAGMA foreign_keys=ON'
+)
+
+def connect(database):
+    """Open a connection with the tuned pragmas and name-addressable rows"""
+    conn = sqlite3.connect(database, timeout=BUSY_TIMEOUT)
+    conn.row_factory = sqlite3.Row
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+class ConnectionPool:
+    """One long-lived connection per thread, reopened after fork()"""
+    
+    def __init__(self, database):
+        self.database = database
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self.stats = {'opened': 0}
+    
+    def connection(self):
+        """Return this thread's connection to the database"""
+        if os.getpid() != self._pid:
+            # Connections must not be shared with the parent process
+            self._pid = os.getpid()
+            self._local = threading.local()
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect(self.database)
+            self.stats['opened'] += 1
+        return conn
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(database):
+    """Return the process-wide connection pool for a database path"""
+    with _pools_lock:
+        pool = _pools.get(database)
+        if pool is None:
+            pool = _pools[database] = ConnectionPool(database)
+        return pool
+
+# /history field name -> analyses column
+HISTORY_FIELDS = {
+    'id': 'id',
+    'filename': 'filename',
+    'date': 'analysis_date',
+    'microplastic_types': 'microplastic_types',
+    'confidence_scores': 'confidence_scores',
+    'particle_count': 'particle_count',
+    'size_distribution': 'size_distribution',
+    'recommendations': 'recommendations'
+}
+
+def encode_cursor(analysis_date, analysis_id):
+    """Opaque keyset cursor for the page after the given analysis"""
+    return base64.urlsafe_b64encode(json.dumps([analysis_date, analysis_id]).encode('utf-8')).decode('ascii')
+
+def decode_cursor(cursor):
+    """Inverse of encode_cursor; raises ValueError for a malformed cursor"""
+    try:
+        analysis_date, analysis_id = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+    if not isinstance(analysis_date, str) or not isinstance(analysis_id, int):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return analysis_date, analysis_id
+
+def ensure_columns(conn, table, columns):
+    """Add columns (name -> SQL type) that an older database's table lacks"""
+    existing = {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}
+    for name, column_type in columns.items():
+        if name not in existing:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN {name} {column_type}')
+
+def _timestamp():
+    # Same format as SQLite's CURRENT_TIMESTAMP, taken when the analysis finished
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+class AnalysisStore:
+    """Reads and writes the analyses and particles tables
+    
+    Every insert also updates the per-day, per-site trend rollups in the
+    same transaction.
+    
+    With write_behind enabled, save_analysis() only queues the record and a
+    single writer thread inserts queued records in batches of up to
+    batch_size per transaction. If the queue is full the record is written
+    synchronously instead, so records are never dropped. A batch that keeps
+    failing is retried with backoff for up to DB_WRITE_RETRY_SECONDS, then
+    kept in memory and written synchronously by the next flush().
+    """
+    
+    INSERT_ANALYSIS = '''
+        INSERT INTO analyses (filename, analysis_date, site, microplastic_types, confidence_scores,
+                              particle_count, size_distribution, recommendations)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    
+    INSERT_PARTICLE = '''
+        INSERT INTO particles (analysis_id, analysis_date, particle_type, confidence, size_micrometers,
+                               area, circularity, solidity, aspect_ratio)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    '''
+    
+    def __init__(self, database, write_behind=None, batch_size=None, queue_size=None):
+        self.database = database
+        self.write_behind = Config.DB_WRITE_BEHIND if write_behind is None else write_behind
+        self.batch_size = batch_size or Config.DB_WRITE_BATCH_SIZE
+        self.queue_size = queue_size or Config.DB_WRITE_QUEUE_SIZE
+        self._queue = None
+        self._writer = None
+        self._writer_pid = None
+        self._failed = []
+        self._lock = threading.Lock()
+        self.stats = {'queued': 0, 'written': 0, 'particles_written': 0, 'batches': 0,
+                      'queue_full': 0, 'write_retries': 0, 'write_errors': 0}
+    
+    def connection(self):
+        return get_pool(self.database).connection()
+    
+    def init_db(self):
+        """Create the analyses and particles tables and the indexes their queries use"""
+        conn = self.connection()
+        with conn:
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS analyses (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filename TEXT NOT NULL,
+                    analysis_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    microplastic_types TEXT,
+                    confidence_scores TEXT,
+                    particle_count INTEGER,
+                    size_distribution TEXT,
+                    recommendations TEXT,
+                    site TEXT
+                )
+            ''')
+            ensure_columns(conn, 'analyses', {'site': 'TEXT'})
+            # /history reads the newest analyses first
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_analyses_date ON analyses (analysis_date, id)')
+            
+            # analysis_date is copied from the parent row so date filters need no join
+            conn.execute('''
+                CREATE TABLE IF NOT EXISTS particles (
+                    id INTEGER PRIMARY KEY,
+                    analysis_id INTEGER NOT NULL REFERENCES analyses (id) ON DELETE CASCADE,
+                    analysis_date TIMESTAMP NOT NULL,
+                    particle_type TEXT NOT NULL,
+                    confidence REAL,
+                    size_micrometers REAL,
+                    area REAL,
+                    circularity REAL,
+                    solidity REAL,
+                    aspect_ratio REAL
+                )
+            ''')
+            # Type plus date range, with size checked from the index alone
+            conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_particles_type_date_size
+                ON particles (particle_type, analysis_date, size_micrometers)
+            ''')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_particles_date ON particles (analysis_date)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_particles_size ON particles (size_micrometers)')
+            conn.execute('CREATE INDEX IF NOT EXISTS idx_particles_analysis ON particles (analysis_id)')
+            
+            trend_rollups.create_tables(conn)
+    
+    def _analysis_record(self, filename, analysis_result, recommendations, site=None):
+        """The analyses row and its particle rows (without analysis_id) for one analysis"""
+        analysis_date = _timestamp()
+        if not isinstance(recommendations, bytes):
+            recommendations = serialization.dumps(recommendations)
+        analysis_row = (
+            filename,
+            analysis_date,
+            site,
+            serialization.dumps_text(analysis_result.get('types', [])),
+            serialization.dumps_text(analysis_result.get('confidence_scores', [])),
+            int(analysis_result.get('particle_count', 0)),
+            serialization.dumps_text(analysis_result.get('size_distribution', {})),
+            recommendations.decode('utf-8')
+        )
+        
+        particle_rows = []
+        for particle in analysis_result.get('particles', []):
+            classification = particle.get('classification', {})
+            particle_rows.append((
+                analysis_date,
+                classification.get('type', 'Unknown/Other'),
+                classification.get('confidence'),
+                particle.get('size_micrometers'),
+                particle.get('area'),
+                particle.get('circularity'),
+                particle.get('solidity'),
+                particle.get('aspect_ratio')
+            ))
+        return analysis_row, particle_rows
+    
+    def _write(self, records):
+        """Insert analyses, all of their particles and the rollup increments in one transaction"""
+        conn = self.connection()
+        particle_rows = []
+        rollups = trend_rollups.RollupBatch()
+        for (filename, analysis_date, site, _, _, particle_count, size_distribution, _), particles in records:
+            rollups.add(analysis_date, site, particle_count, json.loads(size_distribution),
+                        [row[1] for row in particles])
+        
+        with conn:
+            for analysis_row, particles in records:
+                analysis_id = conn.execute(self.INSERT_ANALYSIS, analysis_row).lastrowid
+                particle_rows.extend((analysis_id,) + row for row in particles)
+            conn.executemany(self.INSERT_PARTICLE, particle_rows)
+            rollups.apply(conn)
+        with self._lock:
+            self.stats['written'] += len(records)
+            self.stats['particles_written'] += len(particle_rows)
+            self.stats['batches'] += 1
+    
+    def save_analysis(self, filename, analysis_result, recommendations, site=None):
+        """Store one analysis; with write-behind enabled this returns before the insert
+        
+        recommendations may be passed as JSON bytes already encoded by
+        serialization.dumps (e.g. for the response) so they are not encoded twice.
+        """
+        record = self._analysis_record(filename, analysis_result, recommendations, site)
+        if self.write_behind:
+            try:
+                self._get_queue().put_nowait(record)
+                with self._lock:
+                    self.stats['queued'] += 1
+                return
+            except queue.Full:
+                with self._lock:
+                    self.stats['queue_full'] += 1
+        self._write([record])
+    
+    def _get_queue(self):
+        """Return this process's write queue, starting the writer thread on first use"""
+        with self._lock:
+            if self._writer is None or self._writer_pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.queue_size)
+                self._writer = threading.Thread(target=self._write_loop, args=(self._queue,),
+                                                name='analysis-writer', daemon=True)
+                self._writer_pid = os.getpid()
+                self._writer.start()
+                atexit.register(self.flush)
+            return self._queue
+    
+    def _write_loop(self, pending):
+        while True:
+            records = [pending.get()]
+            while len(records) < self.batch_size:
+                try:
+                    records.append(pending.get_nowait())
+                except queue.Empty:
+                    break
+            
+            try:
+                self._write_with_retry(records)
+            except Exception:
+                # Kept, not dropped: flush() writes them synchronously
+                with self._lock:
+                    self.stats['write_errors'] += len(records)
+                    self._failed.extend(records)
+                logger.exception("Could not write %d queued analyses; keeping them for the next flush",
+                                 len(records))
+            finally:
+                for _ in records:
+                    pending.task_done()
+    
+    def _write_with_retry(self, records):
+        """Write one batch, retrying lock and I/O errors with exponential backoff"""
+        deadline = time.monotonic() + Config.DB_WRITE_RETRY_SECONDS
+        delay = 0.1
+        while True:
+            try:
+                self._write(records)
+                return
+            except sqlite3.OperationalError as e:
+                if time.monotonic() + delay > deadline:
+                    raise
+                with self._lock:
+                    self.stats['write_retries'] += 1
+                logger.warning("Writing %d queued analyses failed (%s); retrying in %.1fs", len(records), e, delay)
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+    
+    def flush(self):
+        """Block until every queued analysis has been written
+        
+        Batches the writer thread gave up on are written here synchronously;
+        if that fails too they are kept and the error is raised.
+        """
+        if self._queue is not None and self._writer_pid == os.getpid():
+            self._queue.join()
+        
+        with self._lock:
+            failed, self._failed = self._failed, []
+        if failed:
+            try:
+                self._write(failed)
+            except Exception:
+                with self._lock:
+                    self._failed = failed + self._failed
+                raise
+            logger.info("Wrote %d analyses that had failed in the background", len(failed))
+    
+    def history(self, fields, limit=10, after=None, particle_type=None,
+                min_particles=None, max_particles=None, since=None, until=None):
+        """One page of analyses, newest first, reading only the requested fields
+        
+        fields are HISTORY_FIELDS keys. after is the (analysis_date, id) of
+        the last row of the previous page; the page is found by seeking the
+        (analysis_date, id) index, so its cost does not grow with depth.
+        Returns the rows (keyed by field name) and the next page's key, or
+        None on the last page.
+        """
+        columns = [HISTORY_FIELDS[field] for field in fields]
+        # The paging key is always read, even when it is not returned
+        selected = ', '.join(f'{column} AS {field}' for field, column in zip(fields, columns))
+        selected += ', analysis_date AS _page_date, id AS _page_id'
+        
+        conditions = []
+        params = []
+        if after is not None:
+            conditions.append('(analysis_date, id) < (?, ?)')
+            params.extend(after)
+        for clause, value in (('particle_count >= ?', min_particles),
+                              ('particle_count <= ?', max_particles),
+                              ('analysis_date >= ?', since),
+                              ('analysis_date < ?', until)):
+            if value is not None:
+                conditions.append(clause)
+                params.append(value)
+        if particle_type is not None:
+            conditions.append('EXISTS (SELECT 1 FROM particles p WHERE p.analysis_id = analyses.id '
+                              'AND p.particle_type = ?)')
+            params.append(particle_type)
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        # One extra row tells whether another page follows
+        params.append(limit + 1)
+        rows = self.connection().execute(f'''
+            SELECT {selected} FROM analyses {where}
+            ORDER BY analysis_date DESC, id DESC LIMIT ?
+        ''', params).fetchall()
+        
+        next_key = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_key = (rows[-1]['_page_date'], rows[-1]['_page_id'])
+        return [{field: row[field] for field in fields} for row in rows], next_key
+    
+    def history_version(self):
+        """(newest id, newest analysis_date) of the analyses table; both change on every insert"""
+        # Separate subqueries so each MAX is answered from an index, not a scan
+        row = self.connection().execute('''
+            SELECT (SELECT MAX(id) FROM analyses) AS last_id,
+                   (SELECT MAX(analysis_date) FROM analyses) AS last_date
+        ''').fetchone()
+        return row['last_id'], row['last_date']
+    
+    def find_particles(self, particle_type=None, min_size=None, max_size=None,
+                       since=None, until=None, limit=1000):
+        """Stored particles matching every given filter, newest first
+        
+        Sizes are in micrometers; since and until are 'YYYY-MM-DD[ HH:MM:SS]'
+        strings in UTC, compared as text like SQLite timestamps.
+        """
+        conditions = []
+        params = []
+        for clause, value in (('particle_type = ?', particle_type),
+                              ('size_micrometers >= ?', min_size),
+                              ('size_micrometers <= ?', max_size),
+                              ('analysis_date >= ?', since),
+                              ('analysis_date < ?', until)):
+            if value is not None:
+                conditions.append(clause)
+                params.append(value)
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        params.append(limit)
+        return self.connection().execute(f'''
+            SELECT analysis_id, analysis_date, particle_type, confidence, size_micrometers,
+                   area, circularity, solidity, aspect_ratio
+            FROM particles {where}
+            ORDER BY analysis_date DESC LIMIT ?
+        ''', params).fetchall()
+    
+    def trends(self, since=None, until=None, site=None, group_by='day'):
+        """Trend buckets from the rollups; see trend_rollups.query_trends"""
+        return trend_rollups.query_trends(self.connection(), since, until, site, group_by)
+    
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+        stats['write_behind'] = self.write_behind
+        stats['pending'] = self._queue.qsize() if self._queue is not None else 0
+        stats['failed_pending'] = len(self._failed)
+        stats['connections_opened'] = get_pool(self.database).stats['opened']
+        return stats
@@ -0,0 +1,105 @@
+"""
+Coarse-to-fine particle detection for large, mostly empty images
+Finds candidate regions on a downscaled image and runs the full-resolution filters only inside them
+"""
+
+import math
+
+import cv2
+import numpy as np
+
+from tiled_detection import DETECTION_HALO
+
+def find_candidate_rois(gray, scale, contrast):
+    """Return full-resolution (x0, y0, x1, y1) boxes that may contain non-background mask pixels
+    
+    The image is area-downsampled by `scale`, which averages sensor noise
+    away, and a block counts as active when its 3x3 morphological gradient
+    reaches `contrast` grey levels. Active blocks are grown by
+    DETECTION_HALO, the distance over which the filter, threshold and
+    morphology pipeline can spread a change, before being boxed.
+    """
+    small, fx, fy = downscale(gray, scale)
+    
+    kernel = np.ones((3, 3), np.uint8)
+    gradient = cv2.morphologyEx(small, cv2.MORPH_GRADIENT, kernel)
+    return rois_from_blocks(gradient >= contrast, fx, fy, gray.shape)
+
+def downscale(gray, scale):
+    """Area-downsampled copy of gray and the per-axis ratios back to full resolution"""
+    height, width = gray.shape[:2]
+    small_width = max(1, width // scale)
+    small_height = max(1, height // scale)
+    small = cv2.resize(gray, (small_width, small_height), interpolation=cv2.INTER_AREA)
+    
+    # Actual per-axis ratios once the edge remainder is folded into the blocks
+    return small, width / small_width, height / small_height
+
+def rois_from_blocks(active, fx, fy, shape):
+    """Grow a boolean map of active downscaled blocks by DETECTION_HALO and box it at full resolution"""
+    height, width = shape[:2]
+    active = active.astype(np.uint8)
+    if not active.any():
+        return []
+    
+    # One extra block absorbs the rounding between the two resolutions
+    grow = int(math.ceil(DETECTION_HALO / min(fx, fy))) + 1
+    active = cv2.dilate(active, np.ones((2 * grow + 1, 2 * grow + 1), np.uint8))
+    
+    count, _, stats, _ = cv2.connectedComponentsWithStats(active, connectivity=8)
+    rois = []
+    for x, y, w, h, _ in stats[1:count]:
+        rois.append((
+            max(0, int(math.floor(x * fx))),
+            max(0, int(math.floor(y * fy))),
+            min(width, int(math.ceil((x + w) * fx))),
+            min(height, int(math.ceil((y + h) * fy)))
+        ))
+    return rois
+
+def build_pyramid_mask(gray, compute_mask, scale=4, contrast=8, max_coverage=0.6, out=None):
+    """Assemble the full-resolution particle mask from candidate regions only
+    
+    Outside the candidates the image is flat, where the adaptive threshold
+    keeps every pixel white, so the mask starts white and each candidate is
+    filled from compute_mask run on the candidate plus a DETECTION_HALO
+    border. Inside a candidate this gives exactly the full-frame result.
+    When the padded candidates cover more than `max_coverage` of the image
+    the full frame is filtered instead, since it would not be faster.
+    
+    out is an optional preallocated uint8 array for the assembled mask.
+    Returns the mask and a dict describing the work done.
+    """
+    return build_roi_mask(gray, find_candidate_rois(gray, scale, contrast), compute_mask, max_coverage, out)
+
+def build_roi_mask(gray, rois, compute_mask, max_coverage=0.6, out=None):
+    """Assemble the particle mask from compute_mask run on the given regions only
+    
+    rois are full-resolution (x0, y0, x1, y1) boxes; everything outside
+    them is left white (no particles). See build_pyramid_mask.
+    """
+    height, width = gray.shape[:2]
+    windows = []
+    covered = 0
+    for x0, y0, x1, y1 in rois:
+        window = (max(0, x0 - DETECTION_HALO), max(0, y0 - DETECTION_HALO),
+                  min(width, x1 + DETECTION_HALO), min(height, y1 + DETECTION_HALO))
+        windows.append(window)
+        covered += (window[2] - window[0]) * (window[3] - window[1])
+    
+    coverage = covered / float(height * width) if height and width else 0.0
+    stats = {'candidates': len(rois), 'coverage': round(coverage, 4), 'fallback': False}
+    
+    if coverage > max_coverage:
+        stats['fallback'] = True
+        return compute_mask(gray), stats
+    
+    if out is None:
+        out = np.empty(gray.shape[:2], dtype=np.uint8)
+    mask = out
+    mask.fill(255)
+    for (x0, y0, x1, y1), (wx0, wy0, wx1, wy1) in zip(rois, windows):
+        window_mask = compute_mask(gray[wy0:wy1, wx0:wx1])
+        mask[y0:y1, x0:x1] = window_mask[y0 - wy0:y1 - wy0, x0 - wx0:x1 - wx0]
+    
+    return mask, stats
@@ -0,0 +1,167 @@
+"""
+Response shaping for the Microplastic Analysis System
+Compact analysis payloads, field projection and gzip / MessagePack content negotiation
+"""
+
+import gzip
+import json
+
+from flask import Response, request
+
+from config import Config
+
+JSON_MIMETYPE = 'application/json'
+MSGPACK_MIMETYPES = ('application/msgpack', 'application/x-msgpack')
+
+COMPACT_FORMAT = 'compact-v1'
+
+# Per-particle values stored as parallel columns in the compact schema
+PARTICLE_COLUMNS = ('size_micrometers', 'area', 'circularity', 'solidity', 'aspect_ratio')
+
+def _load_msgpack():
+    """The msgpack module, or None when it is not installed"""
+    try:
+        import msgpack
+    except ImportError:
+        return None
+    return msgpack
+
+def compact_payload(payload):
+    """Rewrite a full /upload payload into the compact schema
+    
+    - analysis.particles becomes parallel columns; each particle's type is
+      an index into analysis.types and particle_features (a copy of the
+      shape columns) is dropped.
+    - comparison.sample_analysis is replaced by {"$ref": "#/analysis"}.
+    - recommendations lists every distinct solution once under
+      'solutions'; the solution lists and plan actions hold indexes into it.
+    """
+    compact = dict(payload)
+    compact['format'] = COMPACT_FORMAT
+    
+    analysis = payload.get('analysis')
+    if isinstance(analysis, dict):
+        compact['analysis'] = _compact_analysis(analysis)
+    
+    comparison = payload.get('comparison')
+    if isinstance(comparison, dict) and 'sample_analysis' in comparison:
+        compact['comparison'] = dict(comparison, sample_analysis={'$ref': '#/analysis'})
+    
+    recommendations = payload.get('recommendations')
+    if isinstance(recommendations, dict) and 'error' not in recommendations:
+        compact['recommendations'] = _compact_recommendations(recommendations)
+    
+    return compact
+
+def _compact_analysis(analysis):
+    types = list(analysis.get('types', []))
+    type_index = {name: index for index, name in enumerate(types)}
+    columns = {name: [] for name in PARTICLE_COLUMNS}
+    columns.update({'type': [], 'confidence': [], 'class_id': [], 'all_scores': []})
+    
+    for particle in analysis.get('particles', []):
+        for name in PARTICLE_COLUMNS:
+            columns[name].append(particle.get(name))
+        classification = particle.get('classification', {})
+        particle_type = classification.get('type')
+        if particle_type not in type_index:
+            type_index[particle_type] = len(types)
+            types.append(particle_type)
+        columns['type'].append(type_index[particle_type])
+        columns['confidence'].append(classification.get('confidence'))
+        columns['class_id'].append(classification.get('class_id'))
+        columns['all_scores'].append(classification.get('all_scores'))
+    
+    compact = dict(analysis, particles=columns)
+    # Particle types missing from 'types' would only come from a hand-built result
+    if len(types) != len(analysis.get('types', [])):
+        compact['particle_types'] = types
+    return compact
+
+def _compact_recommendations(recommendations):
+    solutions = []
+    solution_index = {}
+    
+    def reference(solution):
+        # Keyed by content, since solutions parsed back from the cache are separate objects
+        key = tuple(sorted(solution.items()))
+        if key not in solution_index:
+            solution_index[key] = len(solutions)
+            solutions.append(solution)
+        return solution_index[key]
+    
+    compact = dict(recommendations)
+    for name in ('prevention_solutions', 'remediation_solutions', 'monitoring_solutions'):
+        if name in recommendations:
+            compact[name] = [reference(solution) for solution in recommendations[name]]
+    
+    plan = recommendations.get('implementation_plan')
+    if isinstance(plan, dict):
+        compact['implementation_plan'] = {
+            phase: dict(details, actions=[reference(solution) for solution in details.get('actions', [])])
+            for phase, details in plan.items()
+        }
+    
+    compact['solutions'] = solutions
+    return compact
+
+def project_fields(payload, fields):
+    """Keep only the given dotted paths (e.g. 'analysis.types'); paths that do not exist are skipped"""
+    projected = {'success': payload['success']} if 'success' in payload else {}
+    for path in fields:
+        parts = path.split('.')
+        value = payload
+        for part in parts:
+            if not isinstance(value, dict) or part not in value:
+                break
+            value = value[part]
+        else:
+            # Parents are only created once the whole path is known to exist
+            target = projected
+            for part in parts[:-1]:
+                target = target.setdefault(part, {})
+            target[parts[-1]] = value
+    return projected
+
+def requested_fields():
+    """The ?fields= paths of the current request, or None"""
+    fields = request.args.get('fields')
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(',') if field.strip()]
+
+def wants_compact():
+    return request.args.get('view') == 'compact'
+
+def shaped_response(body=None, payload=None):
+    """Build the response for an analysis payload, honouring ?view=compact, ?fields=, Accept and Accept-Encoding
+    
+    body is the payload already encoded as JSON bytes. It is sent as is
+    when no reshaping or other encoding is asked for, so the common case
+    does not parse and re-encode it.
+    """
+    fields = requested_fields()
+    msgpack = _load_msgpack()
+    offered = [JSON_MIMETYPE] + (list(MSGPACK_MIMETYPES) if msgpack is not None else [])
+    mimetype = request.accept_mimetypes.best_match(offered, default=JSON_MIMETYPE)
+    
+    if payload is None and (fields or wants_compact() or mimetype != JSON_MIMETYPE):
+        payload = json.loads(body)
+    if payload is not None:
+        if wants_compact():
+            payload = compact_payload(payload)
+        if fields:
+            payload = project_fields(payload, fields)
+        
+        if mimetype in MSGPACK_MIMETYPES:
+            body = msgpack.packb(payload, use_bin_type=True)
+        else:
+            body = json.dumps(payload, separators=(',', ':')).encode('utf-8')
+    
+    response = Response(body, mimetype=mimetype)
+    if ('gzip' in request.accept_encodings and Config.RESPONSE_GZIP_LEVEL > 0
+            and len(body) >= Config.RESPONSE_GZIP_MIN_BYTES):
+        response.set_data(gzip.compress(body, compresslevel=Config.RESPONSE_GZIP_LEVEL))
+        response.headers['Content-Encoding'] = 'gzip'
+    response.vary.update(('Accept', 'Accept-Encoding'))
+    return response
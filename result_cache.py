@@ -0,0 +1,182 @@
+"""
+Content-addressed cache of analysis results
+Keys combine a hash of the image bytes with the model version and analysis settings
+"""
+
+import functools
+import hashlib
+import importlib.util
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from config import Config
+
+# Bump whenever the response layout built in app_full changes. Code changes
+# in the pipeline modules below are picked up by pipeline_fingerprint()
+ANALYSIS_PIPELINE_VERSION = 2
+
+# Modules whose code determines the analysis output for given image bytes
+PIPELINE_MODULES = (
+    'microplastic_analyzer',
+    'particle_table',
+    'pyramid_detection',
+    'tiled_detection',
+    'inference_backends',
+    'data_comparator',
+    'solution_recommender',
+    'serialization'
+)
+
+@functools.lru_cache(maxsize=1)
+def pipeline_fingerprint():
+    """Hash of the pipeline modules' source, so results from older code are never served"""
+    digest = hashlib.sha256()
+    for name in PIPELINE_MODULES:
+        spec = importlib.util.find_spec(name)
+        digest.update(name.encode('utf-8'))
+        with open(spec.origin, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def hash_image_bytes(image_bytes):
+    """Content hash of an uploaded image"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+def model_version(backend_name=None):
+    """Identify the configured model file without loading it"""
+    from inference_backends import TFLiteBackend
+    
+    backend_name = (backend_name or Config.INFERENCE_BACKEND).lower()
+    if backend_name == 'keras':
+        model_path = Config.MODEL_PATH
+    else:
+        quantization = backend_name.split('-', 1)[1] if '-' in backend_name else Config.TFLITE_QUANTIZATION
+        model_path = TFLiteBackend(quantization=quantization).model_path
+    
+    try:
+        stat = os.stat(model_path)
+        return f"{backend_name}:{os.path.basename(model_path)}:{stat.st_size}:{int(stat.st_mtime)}"
+    except OSError:
+        # Not created yet; the first analysis creates the demo model, and
+        # run_analysis_pipeline stores its result under the new version
+        return f"{backend_name}:{os.path.basename(model_path)}:missing"
+
+def analysis_settings():
+    """Settings that change the analysis output for identical image bytes"""
+    settings = {
+        'pipeline_version': ANALYSIS_PIPELINE_VERSION,
+        'pipeline_code': pipeline_fingerprint(),
+        'backend': Config.INFERENCE_BACKEND,
+        'tflite_quantization': Config.TFLITE_QUANTIZATION
+    }
+    if Config.DETECTION_MODE == 'pyramid':
+        settings['detection'] = {
+            'mode': 'pyramid',
+            'scale': Config.PYRAMID_SCALE,
+            'contrast': Config.PYRAMID_CONTRAST,
+            'max_coverage': Config.PYRAMID_MAX_COVERAGE
+        }
+    return settings
+
+class ResultCache:
+    """Two-tier result cache: an in-memory LRU in front of JSON files under results/"""
+    
+    def __init__(self, directory=None, max_entries=None, enabled=None):
+        self.directory = directory or Config.RESULT_CACHE_DIR
+        self.max_entries = max_entries if max_entries is not None else Config.RESULT_CACHE_SIZE
+        self.enabled = Config.RESULT_CACHE_ENABLED if enabled is None else enabled
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'disk_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0
+        }
+    
+    def make_key(self, image_hash, model_version, settings):
+        """Cache key for one image under one model and settings combination"""
+        material = json.dumps({
+            'image': image_hash,
+            'model': model_version,
+            'settings': settings
+        }, sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+    
+    def _path(self, key):
+        # Two-level fan-out keeps directories small
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+    
+    def get(self, key):
+        """Return the stored JSON bytes for a key, or None on a miss"""
+        if not self.enabled:
+            return None
+        
+        with self._lock:
+            payload = self._memory.get(key)
+            if payload is not None:
+                self._memory.move_to_end(key)
+                self._stats['memory_hits'] += 1
+                return payload
+        
+        try:
+            with open(self._path(key), 'rb') as f:
+                payload = f.read()
+        except OSError:
+            with self._lock:
+                self._stats['misses'] += 1
+            return None
+        
+        with self._lock:
+            self._stats['disk_hits'] += 1
+            self._remember(key, payload)
+        return payload
+    
+    def put(self, key, payload):
+        """Store JSON bytes in both tiers"""
+        if not self.enabled:
+            return
+        
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so readers never see partial JSON
+            temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(temp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Result cache write failed: {e}")
+        
+        with self._lock:
+            self._stats['stores'] += 1
+            self._remember(key, payload)
+    
+    def _remember(self, key, payload):
+        """Insert into the LRU tier; caller holds the lock"""
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = payload
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self._stats['evictions'] += 1
+    
+    def clear_memory(self):
+        """Drop the in-memory tier"""
+        with self._lock:
+            self._memory.clear()
+    
+    def get_stats(self):
+        """Hit and miss statistics"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+            stats['memory_bytes'] = sum(len(payload) for payload in self._memory.values())
+        lookups = stats['memory_hits'] + stats['disk_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['disk_hits']) / lookups, 4) if lookups else 0.0
+        stats['enabled'] = self.enabled
+        return stats
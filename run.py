@@ -3,24 +3,23 @@
 Microplastic Analysis System - Startup Script
 """
 
+import importlib.util
 import os
 import sys
 import subprocess
 
 def check_dependencies():
     """Check if required dependencies are installed"""
-    try:
-        import flask
-        import tensorflow
-        import cv2
-        import numpy
-        import pandas
-        print("✓ All dependencies are installed")
-        return True
-    except ImportError as e:
-        print(f"✗ Missing dependency: {e}")
+    # find_spec locates a package without importing it, so this stays fast
+    # even for TensorFlow
+    missing = [name for name in ('flask', 'tensorflow', 'cv2', 'numpy', 'pandas')
+               if importlib.util.find_spec(name) is None]
+    if missing:
+        print(f"✗ Missing dependency: {', '.join(missing)}")
         print("Please run: pip install -r requirements.txt")
         return False
+    print("✓ All dependencies are installed")
+    return True
 
 def create_directories():
     """Create necessary directories"""
@@ -0,0 +1,53 @@
+"""
+JSON serialization for the Microplastic Analysis System
+NumPy-aware encoding of analysis results straight to bytes, and splicing of already encoded parts into larger documents
+"""
+
+import json
+
+def _load_orjson():
+    """The orjson module, or None when it is not installed"""
+    try:
+        import orjson
+    except ImportError:
+        return None
+    return orjson
+
+def json_default(obj):
+    """Serialize NumPy scalars and arrays found in analysis results"""
+    import numpy as np
+    
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.bool_):
+        return bool(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+# The encoder only calls json_default for values it cannot encode itself,
+# so results are walked once instead of being converted before encoding
+_encoder = json.JSONEncoder(default=json_default, separators=(',', ':'))
+_orjson = _load_orjson()
+
+def dumps(obj):
+    """Encode obj as compact UTF-8 JSON bytes in a single pass
+    
+    Uses orjson when it is installed (NumPy values are then encoded
+    natively). orjson writes NaN and infinities as null where the json
+    module writes the non-standard NaN / Infinity tokens.
+    """
+    if _orjson is not None:
+        return _orjson.dumps(obj, default=json_default,
+                             option=_orjson.OPT_SERIALIZE_NUMPY | _orjson.OPT_NON_STR_KEYS)
+    return _encoder.encode(obj).encode('utf-8')
+
+def dumps_text(obj):
+    """dumps() as a str, for TEXT columns and text files"""
+    return dumps(obj).decode('utf-8')
+
+def join_object(members):
+    """JSON object bytes from (key, encoded value) pairs, without decoding the values again"""
+    return b'{' + b','.join(json.dumps(key).encode('utf-8') + b':' + value for key, value in members) + b'}'
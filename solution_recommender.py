@@ -1,6 +1,38 @@
+import functools
 import json
 from datetime import datetime
 
+import metrics
+
+EFFECTIVENESS_ORDER = {'Very High': 4, 'High': 3, 'Medium': 2, 'Low': 1}
+
+# Implementation difficulty -> plan phase; anything harder than Medium is long-term
+IMPLEMENTATION_PHASES = {'Easy': 'phase_1', 'Medium': 'phase_2'}
+
+PLAN_PHASES = (
+    ('phase_1', 'Immediate Actions (0-3 months)'),
+    ('phase_2', 'Short-term Solutions (3-12 months)'),
+    ('phase_3', 'Long-term Solutions (1-3 years)')
+)
+
+# Simple cost estimation based on solution complexity, in dollars
+PREVENTION_COST_POINTS = {'Low': 1000, 'Medium': 5000, 'High': 20000}
+REMEDIATION_COST_POINTS = {'Low': 2000, 'Medium': 10000, 'High': 50000, 'Very High': 100000}
+
+FUNDING_SOURCES = (
+    'Government grants',
+    'Environmental organizations',
+    'Corporate sponsorships',
+    'Community fundraising'
+)
+
+# Milestones added for High and Very High priority samples
+PRIORITY_MILESTONES = (
+    {'timeframe': '1 month', 'milestone': 'Complete immediate prevention actions'},
+    {'timeframe': '6 months', 'milestone': 'Implement short-term solutions'},
+    {'timeframe': '2 years', 'milestone': 'Complete long-term infrastructure improvements'}
+)
+
 class SolutionRecommender:
     def __init__(self):
         self.solution_database = {
@@ -169,210 +201,179 @@ class SolutionRecommender:
                 }
             ]
         }
+        
+        self._compile_catalog()
+        # Recommendations depend only on the detected types, count bucket and risk level
+        self._build_recommendations = functools.lru_cache(maxsize=4096)(self._build_recommendations)
+    
+    def _compile_catalog(self):
+        """Pre-rank, pre-phase and pre-cost every solution once
+        
+        Each catalog entry is (solution, effectiveness rank, phase, cost), with
+        the phase taken from the implementation difficulty and the cost in
+        the dollar points of the prevention or remediation scale.
+        """
+        def compile_entries(solutions, cost_points):
+            return tuple(
+                (solution,
+                 EFFECTIVENESS_ORDER.get(solution['effectiveness'], 0),
+                 IMPLEMENTATION_PHASES.get(solution['implementation'], 'phase_3'),
+                 cost_points.get(solution['cost'], 0))
+                for solution in solutions
+            )
+        
+        self._prevention_by_type = {
+            microplastic_type: compile_entries(solutions, PREVENTION_COST_POINTS)
+            for microplastic_type, solutions in self.solution_database['prevention'].items()
+        }
+        
+        remediation = self.solution_database['remediation']
+        filtration = compile_entries(remediation['filtration'], REMEDIATION_COST_POINTS)
+        cleanup = compile_entries(remediation['cleanup'], REMEDIATION_COST_POINTS)
+        # Indexed by count bucket: filtration above 50 particles, cleanup as well above 100
+        self._remediation_by_bucket = ((), (), filtration, filtration + cleanup)
+    
+    @staticmethod
+    def _count_bucket(particle_count):
+        """0: up to 20 particles, 1: up to 50, 2: up to 100, 3: more"""
+        if particle_count > 100:
+            return 3
+        if particle_count > 50:
+            return 2
+        if particle_count > 20:
+            return 1
+        return 0
+    
+    def _recommendation_key(self, analysis_result, comparison_data):
+        """Memoization key: (catalogued types in detection order, count bucket, risk level)
+        
+        Detection order is kept because it decides the order of equally
+        effective solutions; types without catalog entries do not affect
+        the result and are left out.
+        """
+        types = tuple(microplastic_type for microplastic_type in analysis_result.get('types', [])
+                      if microplastic_type in self._prevention_by_type)
+        risk = comparison_data.get('risk_assessment', {}).get('environmental_risk')
+        return (types,
+                self._count_bucket(analysis_result.get('particle_count', 0)),
+                risk if risk in ('High', 'Moderate') else None)
     
+    @metrics.instrument('recommendation')
     def get_recommendations(self, analysis_result, comparison_data):
         """Generate personalized recommendations based on analysis results"""
         try:
-            recommendations = {
-                'timestamp': datetime.now().isoformat(),
-                'priority_level': 'Medium',
-                'prevention_solutions': [],
-                'remediation_solutions': [],
-                'monitoring_solutions': [],
-                'implementation_plan': {},
-                'cost_estimate': {},
-                'timeline': {}
-            }
-            
-            # Analyze detected microplastic types
-            detected_types = analysis_result.get('types', [])
-            particle_count = analysis_result.get('particle_count', 0)
-            size_distribution = analysis_result.get('size_distribution', {})
-            
-            # Determine priority level
-            recommendations['priority_level'] = self._determine_priority(analysis_result, comparison_data)
-            
-            # Get prevention solutions for detected types
-            for microplastic_type in detected_types:
-                if microplastic_type in self.solution_database['prevention']:
-                    solutions = self.solution_database['prevention'][microplastic_type]
-                    recommendations['prevention_solutions'].extend(solutions)
-            
-            # Get remediation solutions based on particle count and size
-            if particle_count > 50:
-                recommendations['remediation_solutions'].extend(self.solution_database['remediation']['filtration'])
-            if particle_count > 100:
-                recommendations['remediation_solutions'].extend(self.solution_database['remediation']['cleanup'])
-            
-            # Add monitoring solutions
-            recommendations['monitoring_solutions'] = self.solution_database['monitoring']
-            
-            # Create implementation plan
-            recommendations['implementation_plan'] = self._create_implementation_plan(recommendations)
-            
-            # Estimate costs
-            recommendations['cost_estimate'] = self._estimate_costs(recommendations)
-            
-            # Create timeline
-            recommendations['timeline'] = self._create_timeline(recommendations)
-            
-            # Remove duplicates and sort by effectiveness
-            recommendations = self._optimize_recommendations(recommendations)
-            
-            return recommendations
-            
+            template = self._build_recommendations(*self._recommendation_key(analysis_result, comparison_data))
+            return self._copy_recommendations(template, datetime.now().isoformat())
         except Exception as e:
             print(f"Recommendation generation failed: {e}")
             return {'error': f'Failed to generate recommendations: {str(e)}'}
     
-    def _determine_priority(self, analysis_result, comparison_data):
-        """Determine priority level based on analysis results"""
-        particle_count = analysis_result.get('particle_count', 0)
-        risk_assessment = comparison_data.get('risk_assessment', {})
-        
-        if particle_count > 100 or risk_assessment.get('environmental_risk') == 'High':
-            return 'Very High'
-        elif particle_count > 50 or risk_assessment.get('environmental_risk') == 'Moderate':
-            return 'High'
-        elif particle_count > 20:
-            return 'Medium'
-        else:
-            return 'Low'
+    @metrics.instrument('recommendation')
+    def get_recommendations_many(self, analysis_results, comparisons):
+        """Recommendations for a batch of samples, paired with their comparisons"""
+        timestamp = datetime.now().isoformat()
+        results = []
+        for analysis_result, comparison_data in zip(analysis_results, comparisons):
+            try:
+                template = self._build_recommendations(*self._recommendation_key(analysis_result, comparison_data))
+                results.append(self._copy_recommendations(template, timestamp))
+            except Exception as e:
+                results.append({'error': f'Failed to generate recommendations: {str(e)}'})
+        return results
     
-    def _create_implementation_plan(self, recommendations):
-        """Create a step-by-step implementation plan"""
-        plan = {
-            'phase_1': {
-                'name': 'Immediate Actions (0-3 months)',
-                'actions': []
-            },
-            'phase_2': {
-                'name': 'Short-term Solutions (3-12 months)',
-                'actions': []
-            },
-            'phase_3': {
-                'name': 'Long-term Solutions (1-3 years)',
-                'actions': []
-            }
-        }
-        
-        # Categorize solutions by implementation difficulty
-        for solution in recommendations['prevention_solutions']:
-            if solution['implementation'] == 'Easy':
-                plan['phase_1']['actions'].append(solution)
-            elif solution['implementation'] == 'Medium':
-                plan['phase_2']['actions'].append(solution)
-            else:
-                plan['phase_3']['actions'].append(solution)
-        
-        for solution in recommendations['remediation_solutions']:
-            if solution['implementation'] == 'Easy':
-                plan['phase_1']['actions'].append(solution)
-            elif solution['implementation'] == 'Medium':
-                plan['phase_2']['actions'].append(solution)
-            else:
-                plan['phase_3']['actions'].append(solution)
-        
-        return plan
+    def get_cache_stats(self):
+        info = self._build_recommendations.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize}
     
-    def _estimate_costs(self, recommendations):
-        """Estimate implementation costs"""
-        cost_estimate = {
-            'total_estimated_cost': 'Unknown',
-            'cost_breakdown': {},
-            'funding_sources': []
-        }
+    def _build_recommendations(self, types, count_bucket, risk):
+        """Assemble the recommendations for one memoization key (without a timestamp)"""
+        prevention = [entry for microplastic_type in types for entry in self._prevention_by_type[microplastic_type]]
+        remediation = self._remediation_by_bucket[count_bucket]
+        priority_level = self._priority_level(count_bucket, risk)
+        
+        # Plan and costs count every entry, including solutions shared by several types
+        plan = {phase: {'name': name, 'actions': []} for phase, name in PLAN_PHASES}
+        for solution, _, phase, _ in prevention + list(remediation):
+            plan[phase]['actions'].append(solution)
         
-        # Simple cost estimation based on solution complexity
-        total_cost = 0
         cost_breakdown = {
-            'prevention': 0,
-            'remediation': 0,
+            'prevention': sum(cost for _, _, _, cost in prevention),
+            'remediation': sum(cost for _, _, _, cost in remediation),
             'monitoring': 0
         }
-        
-        for solution in recommendations['prevention_solutions']:
-            if solution['cost'] == 'Low':
-                cost_breakdown['prevention'] += 1000
-            elif solution['cost'] == 'Medium':
-                cost_breakdown['prevention'] += 5000
-            elif solution['cost'] == 'High':
-                cost_breakdown['prevention'] += 20000
-        
-        for solution in recommendations['remediation_solutions']:
-            if solution['cost'] == 'Low':
-                cost_breakdown['remediation'] += 2000
-            elif solution['cost'] == 'Medium':
-                cost_breakdown['remediation'] += 10000
-            elif solution['cost'] == 'High':
-                cost_breakdown['remediation'] += 50000
-            elif solution['cost'] == 'Very High':
-                cost_breakdown['remediation'] += 100000
-        
         total_cost = sum(cost_breakdown.values())
-        
         if total_cost < 10000:
-            cost_estimate['total_estimated_cost'] = 'Low ($0-$10,000)'
+            total_estimated_cost = 'Low ($0-$10,000)'
         elif total_cost < 50000:
-            cost_estimate['total_estimated_cost'] = 'Medium ($10,000-$50,000)'
+            total_estimated_cost = 'Medium ($10,000-$50,000)'
         else:
-            cost_estimate['total_estimated_cost'] = 'High ($50,000+)'
+            total_estimated_cost = 'High ($50,000+)'
         
-        cost_estimate['cost_breakdown'] = cost_breakdown
-        cost_estimate['funding_sources'] = [
-            'Government grants',
-            'Environmental organizations',
-            'Corporate sponsorships',
-            'Community fundraising'
-        ]
+        # Unique solutions, most effective first; sorted() is stable so ties keep detection order
+        seen_solutions = set()
+        unique_prevention = []
+        for entry in prevention:
+            if entry[0]['solution'] not in seen_solutions:
+                seen_solutions.add(entry[0]['solution'])
+                unique_prevention.append(entry)
+        unique_prevention = sorted(unique_prevention, key=lambda entry: entry[1], reverse=True)
         
-        return cost_estimate
-    
-    def _create_timeline(self, recommendations):
-        """Create implementation timeline"""
-        timeline = {
-            'immediate': '0-3 months',
-            'short_term': '3-12 months',
-            'long_term': '1-3 years',
-            'milestones': []
+        return {
+            'priority_level': priority_level,
+            'prevention_solutions': [entry[0] for entry in unique_prevention],
+            'remediation_solutions': [entry[0] for entry in remediation],
+            'monitoring_solutions': self.solution_database['monitoring'],
+            'implementation_plan': plan,
+            'cost_estimate': {
+                'total_estimated_cost': total_estimated_cost,
+                'cost_breakdown': cost_breakdown,
+                'funding_sources': list(FUNDING_SOURCES)
+            },
+            'timeline': {
+                'immediate': '0-3 months',
+                'short_term': '3-12 months',
+                'long_term': '1-3 years',
+                'milestones': list(PRIORITY_MILESTONES) if priority_level in ('Very High', 'High') else []
+            }
         }
-        
-        # Add milestones based on priority
-        if recommendations['priority_level'] in ['Very High', 'High']:
-            timeline['milestones'].append({
-                'timeframe': '1 month',
-                'milestone': 'Complete immediate prevention actions'
-            })
-            timeline['milestones'].append({
-                'timeframe': '6 months',
-                'milestone': 'Implement short-term solutions'
-            })
-            timeline['milestones'].append({
-                'timeframe': '2 years',
-                'milestone': 'Complete long-term infrastructure improvements'
-            })
-        
-        return timeline
     
-    def _optimize_recommendations(self, recommendations):
-        """Remove duplicates and optimize recommendations"""
-        # Remove duplicate solutions
-        seen_solutions = set()
-        optimized_solutions = []
+    def _copy_recommendations(self, template, timestamp):
+        """A fresh result for the caller, so changing it leaves the cache and the solution database alone
         
-        for solution in recommendations['prevention_solutions']:
-            solution_key = solution['solution']
-            if solution_key not in seen_solutions:
-                seen_solutions.add(solution_key)
-                optimized_solutions.append(solution)
-        
-        recommendations['prevention_solutions'] = optimized_solutions
-        
-        # Sort by effectiveness
-        effectiveness_order = {'Very High': 4, 'High': 3, 'Medium': 2, 'Low': 1}
-        recommendations['prevention_solutions'].sort(
-            key=lambda x: effectiveness_order.get(x['effectiveness'], 0), 
-            reverse=True
-        )
-        
-        return recommendations
+        Solution entries hold only strings, so a shallow copy of each is enough.
+        """
+        plan = template['implementation_plan']
+        cost_estimate = template['cost_estimate']
+        timeline = template['timeline']
+        return {
+            'timestamp': timestamp,
+            'priority_level': template['priority_level'],
+            'prevention_solutions': [dict(solution) for solution in template['prevention_solutions']],
+            'remediation_solutions': [dict(solution) for solution in template['remediation_solutions']],
+            'monitoring_solutions': [dict(solution) for solution in template['monitoring_solutions']],
+            'implementation_plan': {phase: {'name': plan[phase]['name'],
+                                            'actions': [dict(solution) for solution in plan[phase]['actions']]}
+                                    for phase in plan},
+            'cost_estimate': {
+                'total_estimated_cost': cost_estimate['total_estimated_cost'],
+                'cost_breakdown': dict(cost_estimate['cost_breakdown']),
+                'funding_sources': list(cost_estimate['funding_sources'])
+            },
+            'timeline': dict(timeline, milestones=[dict(milestone) for milestone in timeline['milestones']])
+        }
+    
+    def _priority_level(self, count_bucket, risk):
+        """Determine priority level from the count bucket and environmental risk"""
+        if count_bucket == 3 or risk == 'High':
+            return 'Very High'
+        elif count_bucket == 2 or risk == 'Moderate':
+            return 'High'
+        elif count_bucket == 1:
+            return 'Medium'
+        else:
+            return 'Low'
+    
+    def _determine_priority(self, analysis_result, comparison_data):
+        """Determine priority level based on analysis results"""
+        _, count_bucket, risk = self._recommendation_key(analysis_result, comparison_data)
+        return self._priority_level(count_bucket, risk)
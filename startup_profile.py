@@ -0,0 +1,107 @@
+"""
+Startup timing for the Microplastic Analysis System
+With STARTUP_PROFILE=1, records how long each module import and startup phase takes and prints a report
+"""
+
+import os
+import sys
+import threading
+import time
+
+_PROCESS_START = time.perf_counter()
+
+_lock = threading.Lock()
+# module name -> [inclusive seconds, seconds excluding nested imports]
+_imports = {}
+# (phase name, seconds since this module was imported)
+_phases = []
+_state = threading.local()
+_enabled = False
+
+def enabled():
+    return _enabled
+
+class _TimedLoader:
+    """Wraps a module loader to time exec_module, the actual import work"""
+    
+    def __init__(self, loader):
+        self._loader = loader
+    
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+    
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+    
+    def exec_module(self, module):
+        stack = getattr(_state, 'stack', None)
+        if stack is None:
+            stack = _state.stack = []
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            nested = stack.pop()
+            if stack:
+                stack[-1] += elapsed
+            with _lock:
+                _imports[module.__name__] = [elapsed, elapsed - nested]
+
+class _TimingFinder:
+    """Meta path finder that defers to the real finders and wraps their loaders"""
+    
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = _TimedLoader(spec.loader)
+                return spec
+        return None
+
+def enable():
+    """Start timing imports (idempotent); only imports after this call are measured"""
+    global _enabled
+    if _enabled:
+        return
+    _enabled = True
+    sys.meta_path.insert(0, _TimingFinder())
+    mark('profile enabled')
+
+def enable_from_environment():
+    """Enable profiling when STARTUP_PROFILE is set to a true value"""
+    if os.environ.get('STARTUP_PROFILE', '').lower() in ('1', 'true', 'yes'):
+        enable()
+    return _enabled
+
+def mark(phase):
+    """Record that a startup phase has finished"""
+    if _enabled:
+        with _lock:
+            _phases.append((phase, time.perf_counter() - _PROCESS_START))
+
+def report(top=15, file=None):
+    """Print the slowest imports (inclusive and self time) and the startup phases"""
+    if not _enabled:
+        return None
+    file = file or sys.stderr
+    
+    with _lock:
+        imports = sorted(_imports.items(), key=lambda item: item[1][0], reverse=True)
+        phases = list(_phases)
+    
+    print(f"Startup profile (pid {os.getpid()}):", file=file)
+    for phase, seconds in phases:
+        print(f"  {seconds * 1000:9.1f} ms  {phase}", file=file)
+    print("  Slowest imports (inclusive / self):", file=file)
+    for name, (inclusive, own) in imports[:top]:
+        print(f"  {inclusive * 1000:9.1f} ms {own * 1000:9.1f} ms  {name}", file=file)
+    return {
+        'phases': [{'phase': phase, 'seconds': round(seconds, 4)} for phase, seconds in phases],
+        'imports': [{'module': name, 'inclusive_seconds': round(inclusive, 4), 'self_seconds': round(own, 4)}
+                    for name, (inclusive, own) in imports[:top]]
+    }
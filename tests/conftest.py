@@ -0,0 +1,35 @@
+import os
+import sys
+
+# The application modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+@pytest.fixture(scope='session')
+def app_full_module(tmp_path_factory):
+    """app_full, imported from a scratch directory since it creates its folders on import"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('app'))
+    try:
+        import app_full
+    finally:
+        os.chdir(cwd)
+    return app_full
+
+@pytest.fixture
+def app_client(app_full_module, tmp_path, monkeypatch):
+    """Flask test client whose store, job manager and result cache use a fresh database and folders"""
+    from job_queue import JobManager
+    from persistence import AnalysisStore
+    from result_cache import ResultCache
+    
+    database = str(tmp_path / 'app.db')
+    store = AnalysisStore(database, write_behind=False)
+    job_manager = JobManager(database, str(tmp_path / 'jobs'), app_full_module.run_analysis_pipeline)
+    store.init_db()
+    job_manager.init_db()
+    monkeypatch.setattr(app_full_module, 'store', store)
+    monkeypatch.setattr(app_full_module, 'job_manager', job_manager)
+    monkeypatch.setattr(app_full_module, 'result_cache', ResultCache(directory=str(tmp_path / 'cache'), enabled=False))
+    return app_full_module.app.test_client()
@@ -0,0 +1,119 @@
+import cv2
+import numpy as np
+import pytest
+
+from inference_backends import InferenceBackend
+from inference_scheduler import InferenceScheduler
+from microplastic_analyzer import MicroplasticAnalyzer
+from particle_table import ParticleTable
+
+class _LinearBackend(InferenceBackend):
+    """Softmax of a fixed linear map of per-quadrant channel means; each row depends only on its own crop"""
+    
+    name = 'linear'
+    
+    def __init__(self):
+        super().__init__(None)
+        self.weights = np.random.default_rng(3).normal(size=(12, 8)).astype(np.float32)
+        self.batch_sizes = []
+    
+    def load(self, num_classes):
+        self.num_classes = num_classes
+        return self
+    
+    def predict(self, batch):
+        self.batch_sizes.append(len(batch))
+        batch = np.asarray(batch)
+        if batch.dtype == np.uint8:
+            batch = batch.astype(np.float32) / 255.0
+        quadrants = batch.reshape(len(batch), 2, 112, 2, 112, 3).mean(axis=(2, 4))
+        logits = quadrants.reshape(len(batch), 12) @ self.weights * 20.0
+        scores = np.exp(logits - logits.max(axis=1, keepdims=True))
+        return scores / scores.sum(axis=1, keepdims=True)
+
+def _slide(seed=11, width=400, height=300):
+    """Colored ellipses on a noisy background, some cut off by the image border"""
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 60, size=(height, width, 3), dtype=np.uint8)
+    mask = np.zeros((height, width), dtype=np.uint8)
+    centers = [(0, 0), (width - 1, height // 2)] + [
+        tuple(int(v) for v in rng.integers(0, (width, height))) for _ in range(20)]
+    for center in centers:
+        axes = tuple(int(v) for v in rng.integers(4, 25, size=2))
+        angle = float(rng.integers(0, 180))
+        color = tuple(int(v) for v in rng.integers(80, 256, size=3))
+        cv2.ellipse(image, center, axes, angle, 0, 360, color, -1)
+        cv2.ellipse(mask, center, axes, angle, 0, 360, 255, -1)
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    return image, ParticleTable.from_contours(contours)
+
+@pytest.fixture
+def analyzer():
+    return MicroplasticAnalyzer(backend=_LinearBackend())
+
+def _per_crop(analyzer, image, particles):
+    """One freshly allocated crop and one forward pass per particle"""
+    results = []
+    for index, bbox in enumerate(particles.bbox.tolist()):
+        crop = analyzer._extract_particle_crop(image, bbox)
+        scores = analyzer.backend.predict(crop[np.newaxis])[0]
+        results.append(analyzer._interpret_prediction(scores, particles, index))
+    return results
+
+def _assert_same(results, expected):
+    assert len(results) == len(expected)
+    for result, reference in zip(results, expected):
+        assert result['class_id'] == reference['class_id']
+        assert result['type'] == reference['type']
+        np.testing.assert_allclose(result['all_scores'], reference['all_scores'], rtol=0, atol=1e-6)
+        assert result['confidence'] == pytest.approx(reference['confidence'], abs=1e-6)
+        assert result['particle_features'] == reference['particle_features']
+
+@pytest.mark.parametrize('color', [True, False], ids=['bgr', 'gray'])
+@pytest.mark.parametrize('batch_size', [1, 4, 64])
+def test_batched_matches_per_crop(analyzer, color, batch_size):
+    image, particles = _slide()
+    if not color:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    assert len(particles) > 10
+    expected = _per_crop(analyzer, image, particles)
+    # The scores should pick out more than one class, or class_id equality proves little
+    assert len({result['class_id'] for result in expected}) > 1
+    
+    analyzer.backend.batch_sizes.clear()
+    results = analyzer.classify_particles(image, particles, batch_size=batch_size)
+    
+    _assert_same(results, expected)
+    assert max(analyzer.backend.batch_sizes) == min(batch_size, len(particles))
+    assert sum(analyzer.backend.batch_sizes) == len(particles)
+
+def test_classify_particle_matches_batched(analyzer):
+    image, particles = _slide()
+    results = analyzer.classify_particles(image, particles)
+    for index in (0, len(particles) // 2, len(particles) - 1):
+        _assert_same([analyzer.classify_particle(image, particles.row(index))], [results[index]])
+
+def test_crop_batch_is_reused_across_calls_of_different_sizes(analyzer):
+    image, particles = _slide()
+    expected = _per_crop(analyzer, image, particles)
+    everything = list(range(len(particles)))
+    
+    # Shrinking and growing chunks all come out of the same crop_batch buffer;
+    # stale rows from a larger earlier chunk must never leak into a smaller one
+    calls = [(everything, 64), (everything[:7], 4), (everything[-2:], 4), (everything[3:8], 64), (everything, 5)]
+    for indices, batch_size in calls:
+        results = analyzer.classify_particles(image, particles.select(indices), batch_size=batch_size)
+        _assert_same(results, [expected[index] for index in indices])
+    
+    arena = analyzer._arena()
+    assert arena._buffers['crop_batch'].nbytes == len(particles) * 224 * 224 * 3
+    allocations = arena.get_stats()['allocations']
+    analyzer.classify_particles(image, particles.select(everything[:3]), batch_size=2)
+    assert arena.get_stats()['allocations'] == allocations
+
+def test_scheduler_path_matches_per_crop(analyzer):
+    image, particles = _slide()
+    expected = _per_crop(analyzer, image, particles)
+    analyzer.scheduler = InferenceScheduler(analyzer.backend, max_batch_size=8, max_delay_ms=0)
+    
+    _assert_same(analyzer.classify_particles(image, particles, batch_size=8), expected)
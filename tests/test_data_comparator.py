@@ -0,0 +1,49 @@
+import json
+import os
+
+import pytest
+
+from data_comparator import DataComparator
+
+# Samples and the comparisons the per-sample implementation before compare_many produced for them
+GOLDEN = os.path.join(os.path.dirname(__file__), 'golden', 'comparisons.json')
+
+@pytest.fixture(scope='module')
+def golden():
+    with open(GOLDEN) as f:
+        return json.load(f)
+
+def _without_timestamp(comparison):
+    comparison = dict(comparison)
+    comparison.pop('timestamp')
+    return comparison
+
+def test_compare_many_matches_golden_output(golden):
+    comparisons = DataComparator().compare_many(golden['samples'])
+    assert [_without_timestamp(comparison) for comparison in comparisons] == golden['comparisons']
+
+def test_compare_with_online_data_matches_golden_output(golden):
+    comparator = DataComparator()
+    for sample, expected in zip(golden['samples'], golden['comparisons']):
+        assert _without_timestamp(comparator.compare_with_online_data(sample)) == expected
+
+def test_score_columns_follow_the_baseline_then_new_types(golden):
+    comparator = DataComparator()
+    scores = comparator._score(golden['samples'])
+    
+    assert scores['columns'][:len(comparator.baseline_data)] == list(comparator.baseline_data)
+    assert scores['columns'][len(comparator.baseline_data):] == ['Unknown/Other']
+    assert scores['percentages'].shape == (len(golden['samples']), len(scores['columns']))
+    for row, expected in enumerate(golden['comparisons']):
+        dominant = scores['columns'][scores['dominant'][row]]
+        assert dominant == expected['trend_analysis']['dominant_type']
+
+def test_empty_analysis_scores_as_zero():
+    # The per-sample implementation divided by a zero particle count here and returned an error
+    empty = {'types': [], 'counts': [], 'particle_count': 0, 'size_distribution': {}}
+    comparison = DataComparator().compare_with_online_data(empty)
+    
+    assert 'error' not in comparison
+    assert comparison['baseline_comparison'] == {}
+    assert comparison['trend_analysis']['dominant_type'] is None
+    assert comparison['risk_assessment']['environmental_risk'] == 'Low'
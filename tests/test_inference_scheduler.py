@@ -0,0 +1,141 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from inference_scheduler import InferenceScheduler
+
+class _RecordingBackend:
+    """Scores each crop as (value, -value) and records the batch sizes it was given"""
+    
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.batches = []
+        self.lock = threading.Lock()
+    
+    def predict(self, batch):
+        with self.lock:
+            self.batches.append(len(batch))
+        if self.fail:
+            raise RuntimeError('backend exploded')
+        values = batch.reshape(len(batch), -1)[:, 0].astype(np.float32)
+        return np.stack([values, -values], axis=1)
+
+def _stats(scheduler, batches):
+    """Stats once the scheduler thread has recorded the given number of batches"""
+    deadline = time.monotonic() + 5
+    while scheduler.get_stats()['batches'] < batches and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return scheduler.get_stats()
+
+def _crops(start, count):
+    return np.arange(start, start + count, dtype=np.float32).reshape(count, 1, 1)
+
+def _expected(crops):
+    values = crops.reshape(len(crops))
+    return np.stack([values, -values], axis=1)
+
+def test_concurrent_submitters_get_their_own_slices():
+    backend = _RecordingBackend()
+    scheduler = InferenceScheduler(backend, max_batch_size=64, max_delay_ms=200)
+    barrier = threading.Barrier(8)
+    results = {}
+    
+    def submitter(index):
+        crops = _crops(index * 100, index + 1)
+        barrier.wait()
+        results[index] = (crops, scheduler.predict(crops))
+    
+    threads = [threading.Thread(target=submitter, args=(index,)) for index in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+    
+    assert sorted(results) == list(range(8))
+    for crops, scores in results.values():
+        np.testing.assert_array_equal(scores, _expected(crops))
+    
+    # All 36 crops went through, in fewer forward passes than callers
+    assert sum(backend.batches) == 36
+    assert len(backend.batches) < 8
+    stats = _stats(scheduler, len(backend.batches))
+    assert stats['requests'] == 8
+    assert stats['crops'] == 36
+    assert stats['batches'] == len(backend.batches)
+    assert stats['failed_batches'] == 0
+
+def test_full_batch_dispatches_without_waiting_for_the_delay():
+    backend = _RecordingBackend()
+    scheduler = InferenceScheduler(backend, max_batch_size=4, max_delay_ms=10000)
+    
+    started = time.perf_counter()
+    first = scheduler.submit(_crops(0, 2))
+    second = scheduler.submit(_crops(2, 2))
+    np.testing.assert_array_equal(first.result(timeout=5), _expected(_crops(0, 2)))
+    np.testing.assert_array_equal(second.result(timeout=5), _expected(_crops(2, 2)))
+    
+    assert time.perf_counter() - started < 5
+    assert backend.batches == [4]
+    assert _stats(scheduler, 1)['batch_fill_rate'] == 1.0
+
+def test_partial_batch_dispatches_after_the_delay():
+    backend = _RecordingBackend()
+    scheduler = InferenceScheduler(backend, max_batch_size=64, max_delay_ms=100)
+    
+    started = time.perf_counter()
+    scores = scheduler.predict(_crops(0, 3))
+    
+    assert time.perf_counter() - started >= 0.09
+    np.testing.assert_array_equal(scores, _expected(_crops(0, 3)))
+    assert backend.batches == [3]
+    assert _stats(scheduler, 1)['pending_requests'] == 0
+
+def test_request_that_does_not_fit_opens_the_next_batch():
+    backend = _RecordingBackend()
+    scheduler = InferenceScheduler(backend, max_batch_size=4, max_delay_ms=10000)
+    
+    first = scheduler.submit(_crops(0, 3))
+    # Too big for what is left of the batch, and bigger than a batch on its own
+    second = scheduler.submit(_crops(3, 6))
+    
+    np.testing.assert_array_equal(first.result(timeout=5), _expected(_crops(0, 3)))
+    np.testing.assert_array_equal(second.result(timeout=5), _expected(_crops(3, 6)))
+    # Callers' crops are never split across forward passes
+    assert backend.batches == [3, 6]
+
+def test_carried_request_batches_with_later_arrivals():
+    backend = _RecordingBackend()
+    scheduler = InferenceScheduler(backend, max_batch_size=4, max_delay_ms=10000)
+    
+    futures = [scheduler.submit(_crops(0, 3)), scheduler.submit(_crops(3, 2)),
+               scheduler.submit(_crops(5, 2))]
+    
+    for future, crops in zip(futures, [_crops(0, 3), _crops(3, 2), _crops(5, 2)]):
+        np.testing.assert_array_equal(future.result(timeout=5), _expected(crops))
+    assert backend.batches == [3, 4]
+
+def test_backend_errors_reach_every_caller_in_the_batch():
+    backend = _RecordingBackend(fail=True)
+    scheduler = InferenceScheduler(backend, max_batch_size=4, max_delay_ms=10000)
+    
+    futures = [scheduler.submit(_crops(0, 1)), scheduler.submit(_crops(1, 3))]
+    for future in futures:
+        with pytest.raises(RuntimeError, match='backend exploded'):
+            future.result(timeout=5)
+    assert backend.batches == [4]
+    assert _stats(scheduler, 1)['failed_batches'] == 1
+    
+    # The scheduler thread survives a failed batch
+    backend.fail = False
+    np.testing.assert_array_equal(scheduler.predict(_crops(0, 4)), _expected(_crops(0, 4)))
+    stats = _stats(scheduler, 2)
+    assert (stats['batches'], stats['failed_batches']) == (2, 1)
+
+def test_empty_submit_resolves_immediately():
+    backend = _RecordingBackend()
+    scheduler = InferenceScheduler(backend, max_batch_size=4, max_delay_ms=10000)
+    
+    assert scheduler.predict(np.empty((0, 1, 1), dtype=np.float32)).shape == (0, 0)
+    assert backend.batches == []
@@ -0,0 +1,161 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+from io import BytesIO
+
+import cv2
+import numpy as np
+import pytest
+
+import job_queue
+from job_queue import JobManager, JobQueueFull
+
+def _wait(manager, job_id, status='done', timeout=10):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.get(job_id)
+        if job['status'] == status:
+            return job
+        time.sleep(0.01)
+    raise AssertionError(f"job {job_id} is {manager.get(job_id)['status']}, not {status}")
+
+class _Pipeline:
+    """Stand-in for run_analysis_pipeline that records its calls and can be held at the start"""
+    
+    def __init__(self, block=False):
+        self.calls = []
+        self.started = threading.Event()
+        self.release = threading.Event()
+        if not block:
+            self.release.set()
+    
+    def __call__(self, image_bytes, filename, progress_callback, site=None):
+        self.calls.append((bytes(image_bytes), filename, site))
+        self.started.set()
+        self.release.wait(10)
+        progress_callback(0.5, 'classifying')
+        return b'{"particle_count": 3}', 'miss'
+
+def _manager(tmp_path, pipeline, **kwargs):
+    manager = JobManager(str(tmp_path / 'jobs.db'), str(tmp_path / 'uploads'), pipeline, **kwargs)
+    manager.init_db()
+    return manager
+
+def _insert_running(manager, job_id, pid, instance):
+    """A job as a worker leaves it when it dies halfway through the analysis"""
+    os.makedirs(manager.upload_folder, exist_ok=True)
+    upload_path = os.path.join(manager.upload_folder, job_id)
+    with open(upload_path, 'wb') as f:
+        f.write(b'image')
+    conn = manager._connect()
+    conn.execute('''
+        INSERT INTO jobs (id, filename, upload_path, status, progress, stage, worker_pid, worker_instance,
+                          created_at, updated_at)
+        VALUES (?, 'crashed.png', ?, 'running', 0.4, 'classifying', ?, ?, ?, ?)
+    ''', (job_id, upload_path, pid, instance, time.time(), time.time()))
+    conn.commit()
+
+def test_submitted_job_runs_and_reports_its_result(tmp_path):
+    pipeline = _Pipeline()
+    manager = _manager(tmp_path, pipeline)
+    
+    job_id = manager.submit(b'image', 'sample.png', site='river')
+    job = _wait(manager, job_id)
+    
+    assert job['result'] == {'particle_count': 3}
+    assert job['progress'] == 1.0
+    assert pipeline.calls == [(b'image', 'sample.png', 'river')]
+    # The stored upload is removed once the job is finished
+    assert os.listdir(manager.upload_folder) == []
+    assert manager.get('missing') is None
+
+def test_failed_analysis_marks_the_job_failed(tmp_path):
+    def pipeline(image_bytes, filename, progress_callback, site=None):
+        raise ValueError("no particles")
+    manager = _manager(tmp_path, pipeline)
+    
+    job = _wait(manager, manager.submit(b'image', 'sample.png'), status='failed')
+    assert job['error'] == 'Analysis failed: no particles'
+
+def test_a_job_is_claimed_only_once(tmp_path):
+    manager = _manager(tmp_path, _Pipeline())
+    conn = manager._connect()
+    conn.execute("INSERT INTO jobs (id, status, created_at) VALUES ('job', 'queued', 0)")
+    conn.commit()
+    
+    assert manager._claim('job')
+    assert not manager._claim('job')
+    row = conn.execute("SELECT status, worker_pid, worker_instance FROM jobs WHERE id = 'job'").fetchone()
+    assert tuple(row) == ('running', os.getpid(), job_queue._instance_token())
+
+def test_full_queue_rejects_new_jobs(tmp_path):
+    pipeline = _Pipeline(block=True)
+    manager = _manager(tmp_path, pipeline, max_workers=1, max_pending=1)
+    
+    first = manager.submit(b'one', 'one.png')
+    assert pipeline.started.wait(10)
+    second = manager.submit(b'two', 'two.png')
+    with pytest.raises(JobQueueFull):
+        manager.submit(b'three', 'three.png')
+    
+    pipeline.release.set()
+    _wait(manager, first)
+    _wait(manager, second)
+    # Slots are given back as jobs finish
+    _wait(manager, manager.submit(b'four', 'four.png'))
+
+def test_resume_requeues_jobs_of_dead_workers(tmp_path):
+    pipeline = _Pipeline()
+    manager = _manager(tmp_path, pipeline)
+    
+    # An earlier process with this very pid, as after a container restart
+    _insert_running(manager, 'same-pid', os.getpid(), 'earlier-process')
+    # A process that has exited
+    finished = subprocess.run([sys.executable, '-c', 'import os; print(os.getpid())'],
+                              capture_output=True, text=True, check=True)
+    _insert_running(manager, 'dead-pid', int(finished.stdout), job_queue._process_start_time(1))
+    # The pid of a running process that is not the one that claimed the job
+    _insert_running(manager, 'reused-pid', 1, 'another-process')
+    # Still being analyzed by this process
+    _insert_running(manager, 'alive', os.getpid(), job_queue._instance_token())
+    
+    assert manager.resume_pending() == 3
+    for job_id in ('same-pid', 'dead-pid', 'reused-pid'):
+        assert _wait(manager, job_id)['result'] == {'particle_count': 3}
+    assert manager.get('alive')['status'] == 'running'
+    assert len(pipeline.calls) == 3
+
+def test_resumed_jobs_bypass_the_admission_limit(tmp_path):
+    manager = _manager(tmp_path, _Pipeline(), max_workers=1, max_pending=0)
+    for index in range(3):
+        _insert_running(manager, f'job-{index}', os.getpid(), 'earlier-process')
+    
+    assert manager.resume_pending() == 3
+    for index in range(3):
+        _wait(manager, f'job-{index}')
+
+def test_jobs_route_answers_503_when_the_queue_is_full(app_full_module, app_client, monkeypatch, tmp_path):
+    pipeline = _Pipeline(block=True)
+    manager = _manager(tmp_path, pipeline, max_workers=1, max_pending=0)
+    monkeypatch.setattr(app_full_module, 'job_manager', manager)
+    png = cv2.imencode('.png', np.zeros((8, 8, 3), dtype=np.uint8))[1].tobytes()
+    
+    def post():
+        return app_client.post('/jobs', data={'file': (BytesIO(png), 'sample.png')},
+                               content_type='multipart/form-data')
+    
+    accepted = post()
+    assert accepted.status_code == 202
+    job_id = accepted.get_json()['job_id']
+    
+    rejected = post()
+    assert rejected.status_code == 503
+    assert rejected.headers['Retry-After'] == '10'
+    
+    pipeline.release.set()
+    _wait(manager, job_id)
+    status = app_client.get(f'/jobs/{job_id}')
+    assert status.get_json()['result'] == {'particle_count': 3}
+    assert app_client.get('/jobs/missing').status_code == 404
@@ -0,0 +1,14 @@
+import metrics
+from config import Config
+
+def test_stage_totals_sum_every_label_set(monkeypatch):
+    monkeypatch.setattr(Config, 'METRICS_ENABLED', True)
+    before = metrics.stage_totals()
+    
+    with metrics.trace() as trace:
+        trace.set_labels(particles=5, pixels=640 * 480)
+        metrics.record('test_stage', 0.25)
+    metrics.record('test_stage', 0.5)
+    
+    after = metrics.stage_totals()
+    assert after['test_stage'] - before.get('test_stage', 0.0) == 0.75
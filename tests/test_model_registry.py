@@ -0,0 +1,17 @@
+import logging
+
+from model_registry import ModelRegistry
+
+def test_failed_background_preload_is_recorded_and_logged(monkeypatch, caplog):
+    registry = ModelRegistry()
+    
+    def broken_analyzer():
+        raise OSError("models/microplastic_model.h5 is unreadable")
+    monkeypatch.setattr(registry, 'get_analyzer', broken_analyzer)
+    
+    with caplog.at_level(logging.ERROR, logger='model_registry'):
+        registry.preload_in_background().join(timeout=10)
+    
+    assert registry.stats['preload_error'] == "models/microplastic_model.h5 is unreadable"
+    assert not registry.stats['loaded']
+    assert 'Background model preload failed' in caplog.text
@@ -0,0 +1,74 @@
+import cv2
+import numpy as np
+import pytest
+
+from particle_table import ParticleTable
+
+def _random_contours(seed, count=300):
+    """Random polygons of 1 to 40 points, self-intersecting ones included, plus traced blob outlines"""
+    rng = np.random.default_rng(seed)
+    contours = []
+    for _ in range(count):
+        n = int(rng.choice([1, 2, 3, int(rng.integers(4, 41))]))
+        origin = rng.integers(0, 5000, size=2)
+        spread = int(rng.integers(1, 300))
+        points = origin + rng.integers(0, spread, size=(n, 2))
+        contours.append(points.reshape(-1, 1, 2).astype(np.int32))
+    
+    image = np.zeros((400, 400), dtype=np.uint8)
+    for _ in range(60):
+        center = tuple(int(v) for v in rng.integers(0, 400, size=2))
+        axes = tuple(int(v) for v in rng.integers(1, 25, size=2))
+        cv2.ellipse(image, center, axes, float(rng.integers(0, 180)), 0, 360, 255, -1)
+    traced, _ = cv2.findContours(image, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    return contours + list(traced)
+
+def _reference(contours, min_area):
+    """Per-contour features from the OpenCV functions, with the same filters"""
+    rows = []
+    for contour in contours:
+        x, y, w, h = cv2.boundingRect(contour)
+        area = cv2.contourArea(contour)
+        if not (area > min_area and 0.1 < w / h < 10):
+            continue
+        perimeter = cv2.arcLength(contour, True)
+        hull_area = cv2.contourArea(cv2.convexHull(contour))
+        rows.append((x, y, w, h, area, perimeter,
+                     4 * np.pi * area / (perimeter * perimeter) if perimeter > 0 else 0.0,
+                     area / hull_area if hull_area > 0 else 0.0))
+    return np.array(rows, dtype=np.float64).reshape(-1, 8)
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+@pytest.mark.parametrize('min_area', [-1, 30])
+def test_from_contours_matches_opencv_per_contour(seed, min_area):
+    contours = _random_contours(seed)
+    table = ParticleTable.from_contours(contours, min_area=min_area)
+    expected = _reference(contours, min_area)
+    
+    assert len(table) == len(expected)
+    np.testing.assert_array_equal(table.bbox, expected[:, :4].astype(np.int32))
+    np.testing.assert_array_equal(table.area, expected[:, 4])
+    np.testing.assert_allclose(table.perimeter, expected[:, 5], rtol=1e-12)
+    np.testing.assert_allclose(table.circularity, expected[:, 6], rtol=1e-9)
+    np.testing.assert_allclose(table.solidity, expected[:, 7], rtol=1e-12)
+
+def test_from_contours_handles_single_and_two_point_contours():
+    contours = [
+        np.array([[[5, 7]]], dtype=np.int32),
+        np.array([[[0, 0]], [[3, 4]]], dtype=np.int32),
+        np.array([[[10, 10]], [[10, 10]]], dtype=np.int32)
+    ]
+    table = ParticleTable.from_contours(contours, min_area=-1)
+    
+    np.testing.assert_array_equal(table.bbox, [cv2.boundingRect(c) for c in contours])
+    np.testing.assert_array_equal(table.area, [0.0, 0.0, 0.0])
+    np.testing.assert_allclose(table.perimeter, [cv2.arcLength(c, True) for c in contours])
+    np.testing.assert_array_equal(table.perimeter, [0.0, 10.0, 0.0])
+    np.testing.assert_array_equal(table.circularity, [0.0, 0.0, 0.0])
+    np.testing.assert_array_equal(table.solidity, [0.0, 0.0, 0.0])
+    
+    # With the default threshold none of them is a particle
+    assert len(ParticleTable.from_contours(contours)) == 0
+
+def test_from_contours_without_contours_is_empty():
+    assert len(ParticleTable.from_contours([])) == 0
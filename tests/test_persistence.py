@@ -0,0 +1,225 @@
+import sqlite3
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+import persistence
+from config import Config
+from persistence import AnalysisStore, decode_cursor
+
+def _analysis(particles=3):
+    return {
+        'types': ['Acrylic'],
+        'confidence_scores': [0.8] * particles,
+        'particle_count': particles,
+        'size_distribution': {'small': particles, 'medium': 0, 'large': 0},
+        'particles': [
+            {'size_micrometers': 50, 'area': 100.0, 'circularity': 0.5, 'solidity': 0.9, 'aspect_ratio': 1.0,
+             'classification': {'type': 'Acrylic', 'confidence': 0.8}}
+            for _ in range(particles)
+        ]
+    }
+
+def _count(store):
+    return store.connection().execute('SELECT COUNT(*) FROM analyses').fetchone()[0]
+
+def _flaky_write(store, failures, error=sqlite3.OperationalError('database is locked')):
+    real_write = store._write
+    calls = {'count': 0}
+    
+    def write(records):
+        calls['count'] += 1
+        if calls['count'] <= failures:
+            raise error
+        real_write(records)
+    
+    store._write = write
+    return calls
+
+def test_write_behind_retries_locked_batches(tmp_path):
+    store = AnalysisStore(str(tmp_path / 'a.db'), write_behind=True)
+    store.init_db()
+    _flaky_write(store, failures=2)
+    
+    store.save_analysis('a.png', _analysis(), {})
+    store.flush()
+    
+    assert _count(store) == 1
+    stats = store.get_stats()
+    assert stats['write_retries'] == 2
+    assert stats['write_errors'] == 0
+
+def test_batches_that_keep_failing_are_written_by_flush(tmp_path, monkeypatch):
+    monkeypatch.setattr(Config, 'DB_WRITE_RETRY_SECONDS', 0.0)
+    store = AnalysisStore(str(tmp_path / 'a.db'), write_behind=True)
+    store.init_db()
+    # Fails in the writer thread, then succeeds when flush() writes synchronously
+    _flaky_write(store, failures=1)
+    
+    store.save_analysis('a.png', _analysis(), {})
+    store.flush()
+    
+    assert _count(store) == 1
+    stats = store.get_stats()
+    assert stats['write_errors'] == 1
+    assert stats['failed_pending'] == 0
+
+def _particle(particle_type, size, confidence=0.9):
+    return {'size_micrometers': size, 'area': float(size * size), 'circularity': 0.7, 'solidity': 0.9,
+            'aspect_ratio': 1.2, 'classification': {'type': particle_type, 'confidence': confidence}}
+
+def _save_at(store, monkeypatch, date, particles, filename='sample.png', site=None):
+    """Store one analysis of the given (type, size) particles as if it finished at date"""
+    monkeypatch.setattr(persistence, '_timestamp', lambda: date)
+    analysis = {
+        'types': sorted({particle_type for particle_type, _ in particles}),
+        'confidence_scores': [0.9] * len(particles),
+        'particle_count': len(particles),
+        'size_distribution': {'small': len(particles), 'medium': 0, 'large': 0},
+        'particles': [_particle(particle_type, size) for particle_type, size in particles]
+    }
+    store.save_analysis(filename, analysis, {}, site)
+
+@pytest.fixture
+def particle_store(tmp_path, monkeypatch):
+    store = AnalysisStore(str(tmp_path / 'a.db'), write_behind=False)
+    store.init_db()
+    _save_at(store, monkeypatch, '2026-01-01 10:00:00', [('PE', 20), ('PS', 150)])
+    _save_at(store, monkeypatch, '2026-01-02 10:00:00', [('PE', 80), ('PE', 600)])
+    _save_at(store, monkeypatch, '2026-01-03 10:00:00', [('PVC', 40), ('PS', 90)])
+    return store
+
+def test_find_particles_filters_by_type_size_and_date(particle_store):
+    def found(**filters):
+        return [(row['particle_type'], row['size_micrometers']) for row in particle_store.find_particles(**filters)]
+    
+    assert len(found()) == 6
+    assert sorted(found(particle_type='PE')) == [('PE', 20), ('PE', 80), ('PE', 600)]
+    assert sorted(found(min_size=80, max_size=150)) == [('PE', 80), ('PS', 90), ('PS', 150)]
+    # until is exclusive
+    assert sorted(found(since='2026-01-02', until='2026-01-03')) == [('PE', 80), ('PE', 600)]
+    assert sorted(found(particle_type='PE', min_size=50, since='2026-01-02')) == [('PE', 80), ('PE', 600)]
+    assert found(particle_type='Acrylic') == []
+    # Newest first, and limited
+    rows = particle_store.find_particles(limit=2)
+    assert [row['analysis_date'] for row in rows] == ['2026-01-03 10:00:00'] * 2
+
+def test_find_particles_searches_an_index(particle_store):
+    conn = particle_store.connection()
+    for where, params in (('particle_type = ?', ('PE',)),
+                          ('particle_type = ? AND analysis_date >= ?', ('PE', '2026-01-02')),
+                          ('analysis_date >= ? AND analysis_date < ?', ('2026-01-02', '2026-01-03'))):
+        plan = ' '.join(row[3] for row in conn.execute(
+            f'EXPLAIN QUERY PLAN SELECT analysis_id FROM particles WHERE {where} '
+            f'ORDER BY analysis_date DESC LIMIT ?', params + (10,)))
+        assert 'USING INDEX idx_particles_' in plan and 'SEARCH' in plan, plan
+        # The index already yields the date order
+        assert 'TEMP B-TREE' not in plan, plan
+
+def test_particles_route_clamps_the_limit(app_full_module, app_client, monkeypatch):
+    store = app_full_module.store
+    _save_at(store, monkeypatch, '2026-01-01 10:00:00', [('PE', 20), ('PS', 150), ('PE', 30)])
+    
+    assert len(app_client.get('/particles?limit=-1').get_json()) == 1
+    assert len(app_client.get('/particles?limit=0').get_json()) == 1
+    assert len(app_client.get('/particles?limit=2').get_json()) == 2
+    rows = app_client.get('/particles?type=PE&min_size=25').get_json()
+    assert [(row['particle_type'], row['size_micrometers']) for row in rows] == [('PE', 30)]
+
+@pytest.fixture
+def history_store(tmp_path, monkeypatch):
+    """Seven analyses, five of them finished in the same second"""
+    store = AnalysisStore(str(tmp_path / 'h.db'), write_behind=False)
+    store.init_db()
+    _save_at(store, monkeypatch, '2026-02-01 09:00:00', [('PE', 20)], 'early.png')
+    for index in range(5):
+        _save_at(store, monkeypatch, '2026-02-02 12:00:00', [('PS', 30)] * (index + 1), f'tied-{index}.png')
+    _save_at(store, monkeypatch, '2026-02-03 08:00:00', [('PVC', 40), ('PE', 10)], 'late.png')
+    return store
+
+def _all_pages(store, limit, **filters):
+    pages = []
+    after = None
+    while True:
+        rows, after = store.history(['id', 'date'], limit=limit, after=after, **filters)
+        pages.append(rows)
+        if after is None:
+            return pages
+
+def test_history_pages_past_tied_timestamps(history_store):
+    expected = [(row['date'], row['id']) for row in history_store.history(['id', 'date'], limit=100)[0]]
+    assert expected == sorted(expected, reverse=True)
+    assert len(expected) == 7
+    
+    for limit in (1, 2, 3, 7):
+        pages = _all_pages(history_store, limit)
+        assert [(row['date'], row['id']) for page in pages for row in page] == expected
+        assert all(len(page) == limit for page in pages[:-1])
+    # A full last page is not followed by an empty one
+    assert len(_all_pages(history_store, 7)) == 1
+
+def test_history_filters(history_store):
+    def filenames(**filters):
+        rows, _ = history_store.history(['filename'], limit=100, **filters)
+        return [row['filename'] for row in rows]
+    
+    assert filenames(particle_type='PE') == ['late.png', 'early.png']
+    assert filenames(min_particles=2, max_particles=3) == ['late.png', 'tied-2.png', 'tied-1.png']
+    # until is exclusive
+    assert filenames(since='2026-02-02', until='2026-02-03') == [f'tied-{index}.png' for index in range(4, -1, -1)]
+    assert filenames(particle_type='PS', min_particles=5) == ['tied-4.png']
+    
+    rows, next_key = history_store.history(['filename'], limit=2, particle_type='PS')
+    rows, _ = history_store.history(['filename'], limit=2, after=next_key, particle_type='PS')
+    assert [row['filename'] for row in rows] == ['tied-2.png', 'tied-1.png']
+
+def test_history_version_changes_on_insert(history_store, monkeypatch):
+    before = history_store.history_version()
+    assert before[1] == '2026-02-03 08:00:00'
+    # Even an insert with an older timestamp changes the newest id
+    _save_at(history_store, monkeypatch, '2026-01-01 00:00:00', [('PE', 5)])
+    assert history_store.history_version() != before
+
+def test_history_route_follows_cursors_and_answers_304(app_full_module, app_client, monkeypatch):
+    store = app_full_module.store
+    for index in range(5):
+        _save_at(store, monkeypatch, '2026-02-02 12:00:00', [('PS', 30)], f'tied-{index}.png')
+    
+    seen = []
+    response = app_client.get('/history?limit=2&fields=filename,particle_count&type=PS')
+    while True:
+        assert response.status_code == 200
+        seen.extend(row['filename'] for row in response.get_json())
+        cursor = response.headers.get('X-Next-Cursor')
+        if cursor is None:
+            assert 'Link' not in response.headers
+            break
+        assert decode_cursor(cursor)[0] == '2026-02-02 12:00:00'
+        # The Link header repeats the query with the next cursor
+        link = response.headers['Link']
+        assert link.endswith('>; rel="next"')
+        next_url = link[1:link.index('>')]
+        assert parse_qs(urlsplit(next_url).query) == {
+            'limit': ['2'], 'fields': ['filename,particle_count'], 'type': ['PS'], 'cursor': [cursor]}
+        response = app_client.get(next_url)
+    assert seen == [f'tied-{index}.png' for index in range(4, -1, -1)]
+    
+    first = app_client.get('/history')
+    etag = first.headers['ETag']
+    assert first.headers['Last-Modified'] == 'Mon, 02 Feb 2026 12:00:00 GMT'
+    assert app_client.get('/history', headers={'If-None-Match': etag}).status_code == 304
+    assert app_client.get('/history', headers={'If-Modified-Since': first.headers['Last-Modified']}).status_code == 304
+    # Another query is another resource
+    assert app_client.get('/history?limit=1', headers={'If-None-Match': etag}).status_code == 200
+    
+    _save_at(store, monkeypatch, '2026-02-02 12:00:00', [('PE', 10)], 'new.png')
+    changed = app_client.get('/history', headers={'If-None-Match': etag})
+    assert changed.status_code == 200
+    assert changed.headers['ETag'] != etag
+    assert changed.get_json()[0]['filename'] == 'new.png'
+
+def test_history_route_rejects_bad_cursors_and_fields(app_client):
+    assert app_client.get('/history?cursor=not-a-cursor').status_code == 400
+    response = app_client.get('/history?fields=id,password')
+    assert response.status_code == 400
+    assert 'password' in response.get_json()['error']
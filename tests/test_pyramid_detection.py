@@ -0,0 +1,120 @@
+import cv2
+import numpy as np
+import pytest
+
+from inference_backends import InferenceBackend
+from microplastic_analyzer import MicroplasticAnalyzer
+from particle_table import ParticleTable
+from pyramid_detection import build_pyramid_mask, build_roi_mask, find_candidate_rois
+
+class _DetectionOnlyBackend(InferenceBackend):
+    """Detection never runs the classifier, so no model is loaded"""
+    
+    name = 'detection-only'
+    
+    def __init__(self):
+        super().__init__(None)
+    
+    def load(self, num_classes):
+        self.num_classes = num_classes
+        return self
+
+@pytest.fixture
+def analyzer():
+    # The real filter, threshold and morphology pipeline: the pyramid relies on
+    # the adaptive threshold keeping flat regions white
+    return MicroplasticAnalyzer(backend=_DetectionOnlyBackend())
+
+def _slide(width=1200, height=900, seed=5):
+    """Clusters of dark particles on an otherwise flat slide, two of them cut by the border"""
+    image = np.full((height, width), 190, dtype=np.uint8)
+    rng = np.random.default_rng(seed)
+    for cx, cy in ((150, 120), (900, 300), (500, 700), (width - 10, 450), (5, height - 5)):
+        for _ in range(6):
+            x, y = cx + int(rng.integers(-40, 41)), cy + int(rng.integers(-40, 41))
+            axes = (int(rng.integers(4, 14)), int(rng.integers(4, 14)))
+            cv2.ellipse(image, (x, y), axes, float(rng.integers(0, 180)), 0, 360, int(rng.integers(20, 120)), -1)
+    cv2.circle(image, (300, 450), 20, 60, 3)
+    return image
+
+def _all_particles(mask):
+    """Particles of every contour level, so nested ones are compared too"""
+    contours, _ = cv2.findContours(mask, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    table = ParticleTable.from_contours(contours)
+    return table.select(np.lexsort((table.bbox[:, 0], table.bbox[:, 1])))
+
+def _assert_same_particles(table, expected):
+    assert len(table) == len(expected)
+    np.testing.assert_array_equal(table.bbox, expected.bbox)
+    np.testing.assert_allclose(table.area, expected.area)
+    np.testing.assert_allclose(table.perimeter, expected.perimeter)
+    np.testing.assert_allclose(table.circularity, expected.circularity)
+    np.testing.assert_allclose(table.solidity, expected.solidity)
+
+def test_pyramid_mask_matches_full_frame_mask(analyzer):
+    gray = _slide()
+    full = analyzer._particle_mask(gray)
+    
+    mask, stats = build_pyramid_mask(gray, analyzer._particle_mask)
+    
+    assert not stats['fallback']
+    assert stats['candidates'] >= 5
+    assert stats['coverage'] < 0.2
+    np.testing.assert_array_equal(mask, full)
+    particles = _all_particles(full)
+    assert len(particles) > 15
+    _assert_same_particles(_all_particles(mask), particles)
+
+def test_pyramid_detection_matches_full_frame_detection(analyzer):
+    gray = _slide()
+    
+    full = analyzer._find_particles(gray, mode='full')
+    pyramid = analyzer._find_particles(gray, mode='pyramid')
+    
+    # Includes the slide-sized background region and the particles cut by the border
+    assert len(full) >= 3
+    _assert_same_particles(pyramid.select(np.lexsort((pyramid.bbox[:, 0], pyramid.bbox[:, 1]))),
+                           full.select(np.lexsort((full.bbox[:, 0], full.bbox[:, 1]))))
+
+def test_candidates_cover_every_particle(analyzer):
+    gray = _slide()
+    rois = find_candidate_rois(gray, scale=4, contrast=8)
+    
+    covered = np.zeros(gray.shape, dtype=bool)
+    for x0, y0, x1, y1 in rois:
+        covered[y0:y1, x0:x1] = True
+    assert covered[gray != 190].all()
+
+def test_roi_mask_matches_full_frame_inside_the_rois(analyzer):
+    gray = _slide()
+    full = analyzer._particle_mask(gray)
+    rois = [(100, 60, 220, 200), (850, 250, 960, 360), (1150, 400, 1200, 500)]
+    
+    mask, stats = build_roi_mask(gray, rois, analyzer._particle_mask)
+    
+    assert (stats['candidates'], stats['fallback']) == (3, False)
+    outside = np.ones(gray.shape, dtype=bool)
+    for x0, y0, x1, y1 in rois:
+        np.testing.assert_array_equal(mask[y0:y1, x0:x1], full[y0:y1, x0:x1])
+        outside[y0:y1, x0:x1] = False
+    assert (mask[outside] == 255).all()
+
+def test_halo_makes_roi_seams_invisible(analyzer):
+    gray = _slide()
+    # A grid of small boxes cuts through every particle; each box edge is
+    # only right if its window carries a large enough halo
+    rois = [(x, y, x + 30, y + 30) for y in range(0, 900, 30) for x in range(0, 1200, 30)]
+    
+    mask, stats = build_roi_mask(gray, rois, analyzer._particle_mask, max_coverage=10)
+    
+    assert not stats['fallback']
+    np.testing.assert_array_equal(mask, analyzer._particle_mask(gray))
+
+def test_high_coverage_falls_back_to_the_full_frame(analyzer):
+    gray = _slide()
+    full = analyzer._particle_mask(gray)
+    
+    mask, stats = build_pyramid_mask(gray, analyzer._particle_mask, max_coverage=0.05)
+    
+    assert stats['fallback']
+    np.testing.assert_array_equal(mask, full)
@@ -0,0 +1,85 @@
+import json
+
+import msgpack
+from flask import Flask
+
+from response_format import COMPACT_FORMAT, compact_payload, project_fields, shaped_response
+
+def _solution(name):
+    return {'name': name, 'description': f'{name} description', 'effectiveness': 'High', 'cost': 'Medium'}
+
+def _payload():
+    analysis = {
+        'types': ['Polystyrene (PS)', 'Acrylic'],
+        'counts': [2, 1],
+        'confidence_scores': [0.9, 0.8, 0.7],
+        'particle_count': 3,
+        'size_distribution': {'small': 1, 'medium': 2, 'large': 0},
+        'particles': [
+            {
+                'size_micrometers': size,
+                'area': size * 10.0,
+                'classification': {
+                    'type': particle_type,
+                    'confidence': confidence,
+                    'class_id': class_id,
+                    'all_scores': [confidence] * 8,
+                    'particle_features': {'circularity': 0.5, 'solidity': 0.9, 'aspect_ratio': 1.0}
+                },
+                'circularity': 0.5,
+                'solidity': 0.9,
+                'aspect_ratio': 1.0
+            }
+            for size, particle_type, confidence, class_id in (
+                (80, 'Polystyrene (PS)', 0.9, 2), (120, 'Polystyrene (PS)', 0.8, 2), (300, 'Acrylic', 0.7, 6)
+            )
+        ],
+        'average_confidence': 0.8
+    }
+    shared = _solution('Filter installation')
+    return {
+        'success': True,
+        'analysis': analysis,
+        'comparison': {'sample_analysis': analysis, 'risk_assessment': {'overall_risk': 'Medium'}},
+        'recommendations': {
+            'prevention_solutions': [shared, _solution('Bans')],
+            'remediation_solutions': [_solution('Cleanup')],
+            'monitoring_solutions': [],
+            'implementation_plan': {'immediate': {'timeline': '0-3 months', 'actions': [dict(shared)]}},
+            'priority_level': 'Medium'
+        },
+        'visualization': None
+    }
+
+def test_compact_payload_round_trips_through_msgpack():
+    compact = compact_payload(json.loads(json.dumps(_payload())))
+    assert compact['format'] == COMPACT_FORMAT
+    assert msgpack.unpackb(msgpack.packb(compact, use_bin_type=True), raw=False) == compact
+
+def test_shaped_response_negotiates_msgpack():
+    app = Flask(__name__)
+    body = json.dumps(_payload()).encode('utf-8')
+    with app.test_request_context('/upload?view=compact', headers={'Accept': 'application/msgpack'}):
+        response = shaped_response(body)
+    assert response.mimetype == 'application/msgpack'
+    assert msgpack.unpackb(response.get_data(), raw=False) == compact_payload(json.loads(body))
+
+def test_shaped_response_sends_json_body_untouched():
+    app = Flask(__name__)
+    body = json.dumps(_payload()).encode('utf-8')
+    with app.test_request_context('/upload'):
+        response = shaped_response(body)
+    assert response.mimetype == 'application/json'
+    assert response.get_data() == body
+
+def test_project_fields_keeps_existing_paths():
+    projected = project_fields(_payload(), ['analysis.types', 'analysis.particle_count', 'recommendations.priority_level'])
+    assert projected == {
+        'success': True,
+        'analysis': {'types': ['Polystyrene (PS)', 'Acrylic'], 'particle_count': 3},
+        'recommendations': {'priority_level': 'Medium'}
+    }
+
+def test_project_fields_drops_parents_of_missing_leaves():
+    projected = project_fields(_payload(), ['analysis.missing', 'comparison.risk_assessment.nope', 'nothing.here'])
+    assert projected == {'success': True}
@@ -0,0 +1,128 @@
+import result_cache
+from result_cache import ResultCache, analysis_settings, pipeline_fingerprint
+
+def test_settings_carry_pipeline_code_fingerprint():
+    settings = analysis_settings()
+    assert settings['pipeline_version'] == result_cache.ANALYSIS_PIPELINE_VERSION
+    assert settings['pipeline_code'] == pipeline_fingerprint()
+
+def test_key_changes_with_pipeline_code(monkeypatch, tmp_path):
+    cache = ResultCache(directory=str(tmp_path), enabled=True)
+    before = cache.make_key('image', 'model', analysis_settings())
+    monkeypatch.setattr(result_cache, 'pipeline_fingerprint', lambda: 'changed')
+    assert cache.make_key('image', 'model', analysis_settings()) != before
+
+def _key(cache, image='image', model='keras:model.h5:1:1'):
+    return cache.make_key(image, model, analysis_settings())
+
+def test_memory_tier_evicts_least_recently_used(tmp_path):
+    cache = ResultCache(directory=str(tmp_path), max_entries=2, enabled=True)
+    a, b, c = (_key(cache, image) for image in 'abc')
+    cache.put(a, b'A')
+    cache.put(b, b'B')
+    assert cache.get(a) == b'A'
+    cache.put(c, b'C')
+    
+    # b was the least recently used entry
+    stats = cache.get_stats()
+    assert stats['evictions'] == 1
+    assert stats['memory_entries'] == 2
+    cache.get(a)
+    cache.get(c)
+    assert cache.get_stats()['memory_hits'] == 3
+    assert cache.get(b) == b'B'
+    assert cache.get_stats()['disk_hits'] == 1
+
+def test_disk_tier_reads_through_and_promotes(tmp_path):
+    key = _key(ResultCache(directory=str(tmp_path), enabled=True))
+    ResultCache(directory=str(tmp_path), enabled=True).put(key, b'{"success":true}')
+    
+    # A new process starts with an empty memory tier
+    cache = ResultCache(directory=str(tmp_path), enabled=True)
+    assert cache.get(key) == b'{"success":true}'
+    assert cache.get(key) == b'{"success":true}'
+    stats = cache.get_stats()
+    assert (stats['disk_hits'], stats['memory_hits'], stats['memory_entries']) == (1, 1, 1)
+
+def test_stats_count_hits_misses_and_stores(tmp_path):
+    cache = ResultCache(directory=str(tmp_path), enabled=True)
+    key = _key(cache)
+    assert cache.get(key) is None
+    cache.put(key, b'1234')
+    cache.get(key)
+    cache.clear_memory()
+    cache.get(key)
+    
+    stats = cache.get_stats()
+    assert stats['misses'] == 1
+    assert stats['stores'] == 1
+    assert stats['memory_hits'] == 1
+    assert stats['disk_hits'] == 1
+    assert stats['memory_bytes'] == 4
+    assert stats['hit_rate'] == round(2 / 3, 4)
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = ResultCache(directory=str(tmp_path), enabled=False)
+    key = _key(cache)
+    cache.put(key, b'1')
+    assert cache.get(key) is None
+    assert list(tmp_path.iterdir()) == []
+
+def test_results_of_another_model_or_pipeline_are_not_served(tmp_path, monkeypatch):
+    cache = ResultCache(directory=str(tmp_path), enabled=True)
+    cache.put(_key(cache), b'old')
+    
+    assert cache.get(_key(cache, model='keras:model.h5:2:2')) is None
+    with monkeypatch.context() as patch:
+        patch.setattr(result_cache, 'pipeline_fingerprint', lambda: 'changed')
+        assert cache.get(_key(cache)) is None
+    with monkeypatch.context() as patch:
+        patch.setattr(result_cache, 'ANALYSIS_PIPELINE_VERSION', result_cache.ANALYSIS_PIPELINE_VERSION + 1)
+        assert cache.get(_key(cache)) is None
+    assert cache.get(_key(cache)) == b'old'
+
+def test_model_version_follows_the_model_file(tmp_path, monkeypatch):
+    from config import Config
+    
+    model_path = tmp_path / 'model.h5'
+    monkeypatch.setattr(Config, 'MODEL_PATH', str(model_path))
+    assert result_cache.model_version('keras') == 'keras:model.h5:missing'
+    model_path.write_bytes(b'weights')
+    assert result_cache.model_version('keras').startswith('keras:model.h5:7:')
+
+class _Registry:
+    """Stands in for the model registry; the analyzer creates the model file on its first analysis"""
+    
+    def __init__(self, state):
+        self.state = state
+    
+    def get_analyzer(self):
+        return self
+    
+    def get_comparator(self):
+        from data_comparator import DataComparator
+        return DataComparator()
+    
+    def get_recommender(self):
+        from solution_recommender import SolutionRecommender
+        return SolutionRecommender()
+    
+    def analyze_image(self, image_bytes, progress_callback=None):
+        self.state['model'] = 'keras:model.h5:7:1'
+        self.state['analyses'] += 1
+        return {'types': [], 'counts': [], 'confidence_scores': [], 'particle_count': 0,
+                'size_distribution': {}, 'particles': []}
+
+def test_first_analysis_on_a_fresh_deployment_is_cached_under_the_created_model(
+        app_full_module, app_client, monkeypatch, tmp_path):
+    state = {'model': 'keras:model.h5:missing', 'analyses': 0}
+    monkeypatch.setattr(app_full_module, 'registry', _Registry(state))
+    monkeypatch.setattr(app_full_module, 'model_version', lambda: state['model'])
+    monkeypatch.setattr(app_full_module, 'result_cache', ResultCache(directory=str(tmp_path / 'c'), enabled=True))
+    
+    first, first_status = app_full_module.run_analysis_pipeline(b'image', 'a.png')
+    second, second_status = app_full_module.run_analysis_pipeline(b'image', 'a.png')
+    
+    assert (first_status, second_status) == ('MISS', 'HIT')
+    assert second == first
+    assert state['analyses'] == 1
@@ -0,0 +1,71 @@
+import copy
+import json
+import os
+
+import pytest
+
+from data_comparator import DataComparator
+from solution_recommender import SolutionRecommender
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), 'golden')
+
+@pytest.fixture(scope='module')
+def golden():
+    """The fixed samples, their comparisons and the recommendations the uncached recommender produced"""
+    with open(os.path.join(GOLDEN_DIR, 'comparisons.json')) as f:
+        samples = json.load(f)['samples']
+    with open(os.path.join(GOLDEN_DIR, 'recommendations.json')) as f:
+        recommendations = json.load(f)
+    return samples, DataComparator().compare_many(samples), recommendations
+
+def _without_timestamp(recommendations):
+    recommendations = dict(recommendations)
+    recommendations.pop('timestamp')
+    return recommendations
+
+def test_recommendations_match_golden_output(golden):
+    samples, comparisons, expected = golden
+    recommender = SolutionRecommender()
+    
+    # Twice, so the second pass is served from the cache
+    for _ in range(2):
+        results = [recommender.get_recommendations(sample, comparison)
+                   for sample, comparison in zip(samples, comparisons)]
+        assert [_without_timestamp(result) for result in results] == expected
+    assert recommender.get_cache_stats()['hits'] >= len(samples)
+
+def test_batch_recommendations_match_golden_output(golden):
+    samples, comparisons, expected = golden
+    results = SolutionRecommender().get_recommendations_many(samples, comparisons)
+    assert [_without_timestamp(result) for result in results] == expected
+
+def test_mutating_a_result_leaves_the_cache_alone(golden):
+    samples, comparisons, expected = golden
+    recommender = SolutionRecommender()
+    database = copy.deepcopy(recommender.solution_database)
+    # A sample with prevention and remediation solutions and milestones
+    index = next(i for i, result in enumerate(expected)
+                 if result['prevention_solutions'] and result['remediation_solutions']
+                 and result['timeline']['milestones'])
+    sample, comparison = samples[index], comparisons[index]
+    
+    result = recommender.get_recommendations(sample, comparison)
+    result['priority_level'] = 'None'
+    result['prevention_solutions'][0]['solution'] = 'Changed'
+    result['prevention_solutions'].clear()
+    result['remediation_solutions'][0]['cost'] = 'Free'
+    result['monitoring_solutions'][0]['effectiveness'] = 'None'
+    result['monitoring_solutions'].append({'solution': 'Extra'})
+    for phase in result['implementation_plan'].values():
+        for action in phase['actions']:
+            action['implementation'] = 'Changed'
+        phase['actions'].clear()
+    result['cost_estimate']['cost_breakdown']['prevention'] = -1
+    result['cost_estimate']['funding_sources'].clear()
+    result['timeline']['milestones'][0]['timeframe'] = 'Never'
+    result['timeline']['milestones'].clear()
+    
+    again = recommender.get_recommendations(sample, comparison)
+    assert recommender.get_cache_stats()['hits'] == 1
+    assert _without_timestamp(again) == expected[index]
+    assert recommender.solution_database == database
@@ -0,0 +1,120 @@
+import logging
+
+import cv2
+import numpy as np
+import pytest
+
+from inference_backends import InferenceBackend
+from microplastic_analyzer import MicroplasticAnalyzer
+from tiled_detection import TiledImageReader, _UnionFind
+
+TILE_SIZE = 256
+TILE_OVERLAP = 96
+
+class _DetectionOnlyBackend(InferenceBackend):
+    """Detection never runs the classifier, so no model is loaded"""
+    
+    name = 'detection-only'
+    
+    def __init__(self):
+        super().__init__(None)
+    
+    def load(self, num_classes):
+        self.num_classes = num_classes
+        return self
+
+@pytest.fixture
+def analyzer():
+    analyzer = MicroplasticAnalyzer(backend=_DetectionOnlyBackend())
+    # A global threshold gives every drawn particle exactly its drawn shape
+    analyzer._denoise = lambda gray, out=None: gray
+    analyzer._threshold_mask = lambda filtered, out=None, scratch=None: cv2.threshold(
+        filtered, 127, 255, cv2.THRESH_BINARY, dst=out)[1]
+    return analyzer
+
+def _ring(image, center, outer, hole):
+    cv2.circle(image, center, outer, 255, -1)
+    cv2.circle(image, center, hole, 0, -1)
+
+def _slide(width=700, height=600, seed=7):
+    """Particles across and along the tile seams, rings with particles in their holes and random blobs
+    
+    With 256 px tiles and a 96 px overlap the cores meet at x = 208, 368,
+    510 and y = 208, 368, 460.
+    """
+    image = np.zeros((height, width), dtype=np.uint8)
+    for x, y in ((208, 100), (368, 520), (510, 300), (100, 208), (600, 368), (300, 460), (208, 208), (510, 460)):
+        cv2.ellipse(image, (x, y), (12, 7), 30, 0, 360, 255, -1)
+    
+    # Ring whose first pixel lies left of the seam and whose nested particle lies right of it
+    _ring(image, (205, 300), 16, 11)
+    cv2.circle(image, (210, 300), 4, 255, -1)
+    # Ring in a ring, straddling a horizontal seam
+    _ring(image, (440, 366), 16, 11)
+    _ring(image, (440, 366), 8, 5)
+    # Ring around a particle, split by both seams
+    _ring(image, (368, 208), 16, 11)
+    cv2.circle(image, (368, 208), 5, 255, -1)
+    
+    rng = np.random.default_rng(seed)
+    for _ in range(400):
+        x, y = int(rng.integers(20, width - 20)), int(rng.integers(20, height - 20))
+        if image[y - 18:y + 19, x - 18:x + 19].any():
+            continue
+        axes = (int(rng.integers(3, 12)), int(rng.integers(3, 12)))
+        cv2.ellipse(image, (x, y), axes, float(rng.integers(0, 180)), 0, 360, 255, -1)
+    return image
+
+def _sorted(table):
+    order = np.lexsort((table.bbox[:, 0], table.bbox[:, 1]))
+    return table.select(order)
+
+def test_tiled_detection_matches_full_frame_detection(analyzer, tmp_path):
+    tifffile = pytest.importorskip('tifffile')
+    path = str(tmp_path / 'slide.tif')
+    tifffile.imwrite(path, _slide())
+    
+    reader = TiledImageReader(path)
+    assert reader.backend == 'memmap'
+    full = _sorted(analyzer.detect_particles(path))
+    tiled = _sorted(analyzer.detect_particles_tiled(reader, TILE_SIZE, TILE_OVERLAP))
+    
+    assert len(full) > 30
+    np.testing.assert_array_equal(tiled.bbox, full.bbox)
+    np.testing.assert_allclose(tiled.area, full.area)
+    np.testing.assert_allclose(tiled.perimeter, full.perimeter)
+    np.testing.assert_allclose(tiled.circularity, full.circularity)
+    np.testing.assert_allclose(tiled.solidity, full.solidity)
+    
+    # The particles nested in ring holes are not external
+    boxes = set(map(tuple, full.bbox.tolist()))
+    assert (206, 296, 9, 9) not in boxes
+    assert (363, 203, 11, 11) not in boxes
+
+def test_non_tiff_images_are_decoded_with_a_warning(tmp_path, caplog):
+    path = str(tmp_path / 'slide.png')
+    cv2.imwrite(path, _slide(200, 100))
+    
+    with caplog.at_level(logging.WARNING, logger='tiled_detection'):
+        reader = TiledImageReader(path)
+    assert reader.backend == 'decoded'
+    assert 'only TIFFs can be read in tiles' in caplog.text
+
+def test_union_find_compaction_keeps_only_referenced_regions():
+    regions = _UnionFind()
+    first = regions.add(6)
+    regions.union(first, 0)
+    regions.union(first + 1, first + 2)
+    regions.union(first + 3, first + 4)
+    
+    edge = np.array([-1, first + 2, first, first + 4, -1])
+    kept = np.array([first + 1, first + 5])
+    edge, kept = regions.compact([edge, kept])
+    
+    # Outside, {1, 2}, {3, 4} and 5; label 6 is no longer referenced
+    assert len(regions.parent) == 4
+    assert edge[0] == -1 and edge[-1] == -1
+    assert edge[2] == 0
+    assert edge[1] == kept[0]
+    assert len({int(edge[1]), int(edge[3]), int(kept[1])}) == 3
+    assert regions.find(int(edge[3])) == edge[3]
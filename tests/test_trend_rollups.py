@@ -0,0 +1,113 @@
+import pytest
+
+import persistence
+import trend_rollups
+from persistence import AnalysisStore
+
+# (finished at, site, particle types, (small, medium, large))
+ANALYSES = [
+    ('2026-03-01 08:00:00', 'river', ['PE', 'PE', 'PS'], (2, 1, 0)),
+    ('2026-03-01 17:30:00', 'river', ['PE'], (1, 0, 0)),
+    ('2026-03-01 23:59:59', 'beach', ['PVC', 'PET'], (0, 1, 1)),
+    ('2026-03-02 00:00:00', None, ['PS', 'PS', 'PS', 'PE'], (4, 0, 0)),
+    ('2026-03-02 12:00:00', 'beach', [], (0, 0, 0)),
+    ('2026-03-03 06:00:00', 'river', ['Acrylic', 'PE'], (1, 1, 0)),
+    ('2026-03-04 10:00:00', 'beach', ['PE', 'PP', 'PS', 'PVC'], (1, 2, 1))
+]
+
+def _save(store, monkeypatch, date, site, particle_types, sizes):
+    monkeypatch.setattr(persistence, '_timestamp', lambda: date)
+    store.save_analysis('sample.png', {
+        'types': sorted(set(particle_types)),
+        'confidence_scores': [0.9] * len(particle_types),
+        'particle_count': len(particle_types),
+        'size_distribution': dict(zip(trend_rollups.SIZE_CLASSES, sizes)),
+        'particles': [{'size_micrometers': 50, 'classification': {'type': particle_type, 'confidence': 0.9}}
+                      for particle_type in particle_types]
+    }, {}, site)
+
+def _rollups(conn):
+    return (sorted(tuple(row) for row in conn.execute('SELECT * FROM rollup_daily')),
+            sorted(tuple(row) for row in conn.execute('SELECT * FROM rollup_daily_types')))
+
+@pytest.fixture(params=[False, True], ids=['synchronous', 'write-behind'])
+def store(request, tmp_path, monkeypatch):
+    """A store holding ANALYSES, written directly or through the batched write-behind writer"""
+    store = AnalysisStore(str(tmp_path / 'trends.db'), write_behind=request.param, batch_size=4)
+    store.init_db()
+    for analysis in ANALYSES:
+        _save(store, monkeypatch, *analysis)
+    store.flush()
+    return store
+
+def test_incremental_rollups_equal_a_backfill(store):
+    conn = store.connection()
+    incremental = _rollups(conn)
+    assert trend_rollups.backfill(conn) == 6
+    assert _rollups(conn) == incremental
+    
+    daily, types = incremental
+    assert ('2026-03-01', 'river', 2, 4, 3, 1, 0) in daily
+    assert ('2026-03-02', '', 1, 4, 4, 0, 0) in daily
+    assert ('2026-03-02', 'beach', 1, 0, 0, 0, 0) in daily
+    assert ('2026-03-01', 'river', 'PE', 3) in types
+
+def test_backfill_command_rebuilds_rollups(store, capsys):
+    conn = store.connection()
+    expected = _rollups(conn)
+    with conn:
+        conn.execute('DELETE FROM rollup_daily')
+        conn.execute("UPDATE rollup_daily_types SET particles = 99")
+    
+    assert trend_rollups.main(['backfill', '--database', store.database]) == 0
+    assert _rollups(conn) == expected
+    assert 'Rebuilt 6 daily rollup buckets' in capsys.readouterr().out
+
+def test_query_trends_groups_and_windows(store):
+    conn = store.connection()
+    
+    days = trend_rollups.query_trends(conn)
+    assert [bucket['day'] for bucket in days] == ['2026-03-01', '2026-03-02', '2026-03-03', '2026-03-04']
+    first = days[0]
+    assert (first['analyses'], first['particle_count']) == (3, 6)
+    assert first['size_distribution'] == {'small': 3, 'medium': 2, 'large': 1}
+    assert first['type_counts'] == {'PE': 3, 'PS': 1, 'PVC': 1, 'PET': 1}
+    assert first['dominant_type'] == 'PE'
+    
+    sites = trend_rollups.query_trends(conn, since='2026-03-02', until='2026-03-04', group_by='site')
+    assert [(bucket['site'], bucket['analyses'], bucket['particle_count']) for bucket in sites] == [
+        ('', 1, 4), ('beach', 1, 0), ('river', 1, 2)]
+    assert sites[1]['dominant_type'] is None
+    
+    total, = trend_rollups.query_trends(conn, site='river', group_by=None)
+    assert (total['analyses'], total['particle_count']) == (3, 6)
+    assert total['type_counts'] == {'PE': 4, 'PS': 1, 'Acrylic': 1}
+    assert total['diversity_index'] == trend_rollups.shannon_index({'PE': 4, 'PS': 1, 'Acrylic': 1})
+    
+    with pytest.raises(ValueError):
+        trend_rollups.query_trends(conn, group_by='week')
+
+def test_shannon_index():
+    assert trend_rollups.shannon_index({}) == 0.0
+    assert str(trend_rollups.shannon_index({'PE': 5})) == '0.0'
+    assert trend_rollups.shannon_index({'PE': 1, 'PS': 1}) == 0.693
+    assert trend_rollups.shannon_index({'PE': 2, 'PS': 1, 'PVC': 1}) == 1.040
+    assert trend_rollups.shannon_index({'PE': 3, 'PS': 0}) == 0.0
+
+def test_trends_route_filters_by_since_and_until(app_full_module, app_client, monkeypatch):
+    for analysis in ANALYSES:
+        _save(app_full_module.store, monkeypatch, *analysis)
+    
+    def days(query):
+        return [(bucket['day'], bucket['analyses']) for bucket in app_client.get(f'/trends?{query}').get_json()]
+    
+    assert days('') == [('2026-03-01', 3), ('2026-03-02', 2), ('2026-03-03', 1), ('2026-03-04', 1)]
+    # since is inclusive, until exclusive
+    assert days('since=2026-03-02&until=2026-03-04') == [('2026-03-02', 2), ('2026-03-03', 1)]
+    assert days('since=2026-03-04') == [('2026-03-04', 1)]
+    assert days('until=2026-03-01') == []
+    assert days('since=2026-03-01&site=beach') == [('2026-03-01', 1), ('2026-03-02', 1), ('2026-03-04', 1)]
+    
+    total = app_client.get('/trends?group_by=none&since=2026-03-03').get_json()
+    assert [(bucket['analyses'], bucket['particle_count']) for bucket in total] == [(2, 6)]
+    assert app_client.get('/trends?group_by=week').status_code == 400
@@ -0,0 +1,40 @@
+import pytest
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+from upload_ingest import UploadBuffer, allowed_file
+
+@pytest.mark.parametrize('filename', ['slide.tif', 'slide.TIFF', 'a.png', 'b.jpg', 'c.jpeg', 'd.bmp', 'e.gif'])
+def test_image_extensions_are_allowed(filename):
+    assert allowed_file(filename)
+
+@pytest.mark.parametrize('filename', ['a.exe', 'noextension', 'archive.tar.gz'])
+def test_other_extensions_are_rejected(filename):
+    assert not allowed_file(filename)
+
+def test_tiff_header_is_sniffed():
+    upload = UploadBuffer('slide.tif')
+    upload.write(b'II*\x00' + b'\x00' * 64)
+    assert upload.finish().image_format == 'tiff'
+
+def test_non_image_body_is_rejected_from_its_first_bytes():
+    upload = UploadBuffer('a.png')
+    with pytest.raises(UnsupportedMediaType):
+        upload.write(b'<html>not an image</html>')
+
+def test_oversized_body_is_rejected():
+    upload = UploadBuffer('a.png', max_bytes=16)
+    upload.write(b'\x89PNG\r\n\x1a\n')
+    with pytest.raises(RequestEntityTooLarge):
+        upload.write(b'\x00' * 16)
+
+def test_spooled_upload_is_viewed_without_copy_and_hashed():
+    import hashlib
+    
+    data = b'\x89PNG\r\n\x1a\n' + bytes(range(256)) * 8
+    upload = UploadBuffer('a.png', spool_bytes=64)
+    for start in range(0, len(data), 100):
+        upload.write(data[start:start + 100])
+    assert upload.spooled_to_disk
+    assert bytes(upload.view()) == data
+    assert upload.sha256 == hashlib.sha256(data).hexdigest()
+    upload.close()
@@ -0,0 +1,134 @@
+import cv2
+import numpy as np
+import pytest
+
+from microplastic_analyzer import MicroplasticAnalyzer
+from particle_table import ParticleTable
+from video_analysis import ParticleTracker, VideoAnalyzer
+
+WIDTH, HEIGHT = 160, 120
+
+class _RecordingAnalyzer:
+    """Finds bright blobs by thresholding, classifies everything as PE and records each detection call"""
+    
+    calculate_size_distribution = MicroplasticAnalyzer.calculate_size_distribution
+    
+    def __init__(self):
+        self.find_calls = []
+        self.classified = 0
+    
+    def _find_particles(self, gray, rois=None):
+        self.find_calls.append(rois)
+        mask = np.zeros_like(gray)
+        for x0, y0, x1, y1 in ([(0, 0, gray.shape[1], gray.shape[0])] if rois is None else rois):
+            mask[y0:y1, x0:x1] = (gray[y0:y1, x0:x1] > 127) * 255
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        return ParticleTable.from_contours(contours, min_area=10)
+    
+    def classify_particles(self, image, particles):
+        self.classified += len(particles)
+        return [{'type': 'Polyethylene (PE)', 'confidence': 1.0} for _ in range(len(particles))]
+
+def _frame(*squares):
+    """Black frame with 8x8 white squares at the given top-left corners"""
+    frame = np.zeros((HEIGHT, WIDTH, 3), dtype=np.uint8)
+    for x, y in squares:
+        frame[y:y + 8, x:x + 8] = 255
+    return frame
+
+def _write_sequence(directory, frames):
+    for index, frame in enumerate(frames):
+        cv2.imwrite(str(directory / f'frame_{index}.png'), frame)
+    return str(directory)
+
+def _analyze(tmp_path, frames, fps=4, window_seconds=1.0, **kwargs):
+    analyzer = _RecordingAnalyzer()
+    video = VideoAnalyzer(analyzer, fps=fps, window_seconds=window_seconds, motion_threshold=12,
+                          max_distance=kwargs.pop('max_distance', 20), max_gap=kwargs.pop('max_gap', 2))
+    windows = list(video.analyze(_write_sequence(tmp_path, frames)))
+    return analyzer, video, windows
+
+def test_tracker_matches_a_moving_particle():
+    tracker = ParticleTracker(max_distance=10, max_gap=2)
+    assert tracker.update(0, [(10, 10)]).tolist() == [True]
+    assert tracker.update(1, [(16, 10)]).tolist() == [False]
+    # The prediction follows the velocity, so a faster step than max_distance still matches
+    assert tracker.update(2, [(22, 11)]).tolist() == [False]
+    assert tracker.update(3, [(28, 12), (80, 80)]).tolist() == [False, True]
+    assert tracker.tracks_started == 2
+    assert len(tracker) == 2
+
+def test_tracker_drops_tracks_after_max_gap():
+    tracker = ParticleTracker(max_distance=10, max_gap=2)
+    tracker.update(0, [(10, 10)])
+    tracker.update(1, [])
+    tracker.update(2, [])
+    assert len(tracker) == 1
+    # Missed for max_gap frames, then seen again: the same track
+    assert tracker.update(3, [(10, 10)]).tolist() == [False]
+    for index in (4, 5, 6):
+        tracker.update(index, [])
+    assert len(tracker) == 0
+    assert tracker.update(7, [(10, 10)]).tolist() == [True]
+    assert tracker.tracks_started == 2
+
+def test_tracker_keeps_tracks_outside_the_analyzed_regions():
+    tracker = ParticleTracker(max_distance=10, max_gap=1)
+    tracker.update(0, [(10, 10), (100, 100)])
+    # Only the region around the first particle changed for many frames
+    for index in range(1, 6):
+        tracker.update(index, [(10, 10)], rois=[(0, 0, 30, 30)])
+    assert len(tracker) == 2
+    # A particle gone from an analyzed region is dropped after max_gap
+    tracker.update(6, [(10, 10)], rois=[(0, 0, 30, 30), (90, 90, 110, 110)])
+    tracker.update(7, [(10, 10)], rois=[(0, 0, 30, 30), (90, 90, 110, 110)])
+    assert len(tracker) == 1
+
+def test_moving_particle_is_counted_once(tmp_path):
+    frames = [_frame((10 + 6 * index, 50)) for index in range(12)]
+    analyzer, video, windows = _analyze(tmp_path, frames)
+    
+    assert video.stats['particles'] == 1
+    assert analyzer.classified == 1
+    assert sum(window['particle_count'] for window in windows) == 1
+    assert windows[0]['type_counts'] == {'Polyethylene (PE)': 1}
+    assert windows[0]['size_distribution'] == {'small': 1, 'medium': 0, 'large': 0}
+    # Only the first frame is analyzed in full
+    assert analyzer.find_calls[0] is None
+    assert all(rois for rois in analyzer.find_calls[1:])
+
+def test_static_frames_are_skipped_without_detection(tmp_path):
+    still = _frame((40, 40))
+    frames = [still] * 5 + [_frame((40, 40), (100, 20))] + [_frame((40, 40), (100, 20))] * 3
+    analyzer, video, windows = _analyze(tmp_path, frames, fps=10, window_seconds=10)
+    
+    assert video.stats['frames'] == 9
+    assert video.stats['frames_skipped'] == 7
+    assert len(analyzer.find_calls) == 2
+    assert video.stats['particles'] == 2
+    assert windows[0]['frames_skipped'] == 7
+    # The still particle kept its track through the skipped frames
+    assert windows[0]['active_tracks'] == 2
+
+@pytest.mark.parametrize('fps, window_seconds, frames, expected', [
+    (4, 1.0, 10, [(0, 4), (1, 4), (2, 2)]),
+    (2, 1.5, 7, [(0, 3), (1, 3), (2, 1)]),
+    (10, 0.5, 5, [(0, 5)]),
+    (1, 10.0, 3, [(0, 3)])
+])
+def test_windows_follow_fps_and_window_seconds(tmp_path, fps, window_seconds, frames, expected):
+    _, video, windows = _analyze(tmp_path, [_frame()] * frames, fps=fps, window_seconds=window_seconds)
+    
+    assert [(window['window'], window['frames']) for window in windows] == expected
+    for window in windows:
+        assert window['start_seconds'] == window['window'] * window_seconds
+        assert window['end_seconds'] == (window['window'] + 1) * window_seconds
+    assert video.stats['frames'] == frames
+    assert video.stats['source_fps'] == fps
+
+def test_particle_entering_in_a_later_window_is_counted_there(tmp_path):
+    frames = [_frame()] * 4 + [_frame((20 + 5 * index, 30)) for index in range(4)]
+    _, video, windows = _analyze(tmp_path, frames)
+    
+    assert [window['particle_count'] for window in windows] == [0, 1]
+    assert video.stats['particles'] == 1
@@ -0,0 +1,330 @@
+"""
+Out-of-core tiled particle detection for whole-slide scans
+Reads large images in overlapping tiles and merges particles across tile borders
+"""
+
+import logging
+import os
+import cv2
+import numpy as np
+
+from particle_table import ParticleTable
+
+logger = logging.getLogger(__name__)
+
+# Distance in pixels over which a tile edge can change the detection mask:
+# bilateralFilter d=9 (radius 4) + adaptiveThreshold block 11 (radius 5)
+# + MORPH_CLOSE and MORPH_OPEN with a 3x3 kernel (radius 2 each)
+DETECTION_HALO = 4 + 5 + 2 + 2
+
+class TiledImageReader:
+    """Serves windows of a large image without decoding the full frame when the format allows"""
+    
+    def __init__(self, image_path):
+        self.path = os.fspath(image_path)
+        self.backend = None
+        self._array = None
+        self._is_bgr = False
+        self._open()
+        
+        self.height, self.width = self._array.shape[:2]
+        # Mimic a decoded BGR image so classification can crop from the reader
+        self.shape = (self.height, self.width, 3)
+    
+    def _open(self):
+        """Open the image, preferring memory-mapped or chunked access for TIFFs"""
+        if os.path.splitext(self.path)[1].lower() not in ('.tif', '.tiff'):
+            reason = "only TIFFs can be read in tiles"
+        else:
+            try:
+                import tifffile
+            except ImportError:
+                tifffile = None
+                reason = "tifffile is not installed"
+            
+            if tifffile is not None:
+                # Uncompressed, contiguous TIFFs can be memory-mapped directly
+                try:
+                    self._array = tifffile.memmap(self.path, mode='r')
+                    self.backend = 'memmap'
+                    return
+                except Exception:
+                    pass
+                
+                # Tiled or compressed TIFFs can be read chunk by chunk through zarr
+                try:
+                    import zarr
+                    store = tifffile.imread(self.path, aszarr=True)
+                    array = zarr.open(store, mode='r')
+                    if not hasattr(array, 'shape'):
+                        # Pyramidal TIFF: level 0 is the full-resolution image
+                        array = array['0']
+                    self._array = array
+                    self.backend = 'zarr'
+                    return
+                except Exception as e:
+                    reason = f"the TIFF could not be memory-mapped or opened through zarr ({e})"
+        
+        # Fall back to decoding the whole frame once
+        logger.warning("Decoding all of %s into memory for tiled detection: %s", self.path, reason)
+        image = cv2.imread(self.path, cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError("Could not load image")
+        self._array = image
+        self._is_bgr = True
+        self.backend = 'decoded'
+    
+    def _read_window(self, y0, y1, x0, x1):
+        """Read a window as an 8-bit array with 1 or 3 channels in source order"""
+        window = np.asarray(self._array[y0:y1, x0:x1])
+        
+        if window.dtype == np.uint16:
+            # Same 16-to-8 bit scaling cv2.imread applies for IMREAD_COLOR
+            window = cv2.convertScaleAbs(window, alpha=1.0 / 256)
+        elif window.dtype != np.uint8:
+            window = np.clip(window, 0, 255).astype(np.uint8)
+        
+        if window.ndim == 3:
+            if window.shape[2] == 1:
+                window = window[:, :, 0]
+            elif window.shape[2] > 3:
+                # Drop alpha or extra samples
+                window = window[:, :, :3]
+        
+        return np.ascontiguousarray(window)
+    
+    def read_gray(self, y0, y1, x0, x1):
+        """Read a window converted to grayscale"""
+        window = self._read_window(y0, y1, x0, x1)
+        if window.ndim == 2:
+            return window
+        code = cv2.COLOR_BGR2GRAY if self._is_bgr else cv2.COLOR_RGB2GRAY
+        return cv2.cvtColor(window, code)
+    
+    def read_bgr(self, y0, y1, x0, x1):
+        """Read a window converted to BGR, like cv2.imread would return it"""
+        window = self._read_window(y0, y1, x0, x1)
+        if window.ndim == 2:
+            return cv2.cvtColor(window, cv2.COLOR_GRAY2BGR)
+        if self._is_bgr:
+            return window
+        return cv2.cvtColor(window, cv2.COLOR_RGB2BGR)
+    
+    def __getitem__(self, key):
+        """Support image[y1:y2, x1:x2] crops as used by particle classification"""
+        rows, cols = key
+        y0, y1, _ = rows.indices(self.height)
+        x0, x1, _ = cols.indices(self.width)
+        return self.read_bgr(y0, y1, x0, x1)
+
+class _UnionFind:
+    """Union-find over black-region labels of all tiles; label 0 is the area outside the image"""
+    
+    def __init__(self):
+        self.parent = [0]
+    
+    def add(self, count):
+        """Reserve count new labels and return the first one"""
+        first = len(self.parent)
+        self.parent.extend(range(first, first + count))
+        return first
+    
+    def find(self, label):
+        parent = self.parent
+        while parent[label] != label:
+            parent[label] = parent[parent[label]]
+            label = parent[label]
+        return label
+    
+    def union(self, a, b):
+        root_a = self.find(a)
+        root_b = self.find(b)
+        if root_a != root_b:
+            # The smaller label wins, so the outside stays rooted at 0
+            if root_a < root_b:
+                self.parent[root_b] = root_a
+            else:
+                self.parent[root_a] = root_b
+    
+    def union_pairs(self, a, b):
+        """Union label vectors element-wise, skipping white pixels (-1)"""
+        both = (a >= 0) & (b >= 0)
+        if not both.any():
+            return
+        pairs = np.unique(np.column_stack([a[both], b[both]]), axis=0)
+        for label_a, label_b in pairs.tolist():
+            self.union(label_a, label_b)
+    
+    def compact(self, arrays):
+        """Renumber the roots of the labels in arrays densely and forget every other label
+        
+        Returns the arrays with each label replaced by its new root; -1
+        stays -1 and the outside stays 0. Labels not in arrays become invalid.
+        """
+        roots = np.array([self.find(label) for label in range(len(self.parent))], dtype=np.int64)
+        used = [roots[array[array >= 0]] for array in arrays]
+        live = np.union1d(np.concatenate(used), [0]) if used else np.zeros(1, dtype=np.int64)
+        renumber = np.full(len(self.parent), -1, dtype=np.int64)
+        renumber[live] = np.arange(len(live))
+        self.parent = list(range(len(live)))
+        return [np.where(array >= 0, renumber[roots[np.maximum(array, 0)]], -1) for array in arrays]
+
+def _tile_starts(length, tile_size, step):
+    """Start offsets of overlapping tiles covering [0, length)"""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, step))
+    starts.append(length - tile_size)
+    return starts
+
+def _core_bounds(starts, tile_size, length):
+    """Split [0, length) into disjoint cores, one per tile, meeting halfway through each overlap"""
+    bounds = [0]
+    for previous, start in zip(starts, starts[1:]):
+        bounds.append((start + previous + tile_size) // 2)
+    bounds.append(length)
+    return bounds
+
+def detect_particles_tiled(reader, compute_mask, tile_size, overlap, min_area=30, keep_contours=False):
+    """Detect particles tile by tile with the same result as a full-frame RETR_EXTERNAL run
+    
+    Pixels within DETECTION_HALO of an inner tile edge may differ from a
+    full-frame mask, so every tile owns a disjoint core well inside its
+    exact region. A particle belongs to the tile whose core holds its first
+    pixel in raster order and must lie entirely inside that tile's exact
+    region, which holds for particles up to about
+    overlap / 2 - DETECTION_HALO pixels.
+    
+    Whether a particle is external (not nested in a hole of another
+    particle) is a global property. The black pixel left of a particle's
+    first pixel lies in the region surrounding it, so the particle is
+    external exactly when that black region reaches the image border.
+    Black regions are labeled per core and joined across core seams with
+    union-find, which keeps memory bounded by the tile size plus one row
+    of labels per tile column: after each tile row the forest is shrunk to
+    the regions still referenced by that row's bottom edge or by a kept
+    particle.
+    """
+    margin = DETECTION_HALO + 1
+    if overlap <= 2 * margin:
+        raise ValueError(f"Tile overlap must be larger than {2 * margin} pixels")
+    if tile_size <= overlap:
+        raise ValueError("Tile size must be larger than the tile overlap")
+    
+    step = tile_size - overlap
+    height, width = reader.height, reader.width
+    y_starts = _tile_starts(height, tile_size, step)
+    x_starts = _tile_starts(width, tile_size, step)
+    y_bounds = _core_bounds(y_starts, tile_size, height)
+    x_bounds = _core_bounds(x_starts, tile_size, width)
+    
+    regions = _UnionFind()
+    # Global black-region labels along the bottom row of each core in the previous tile row
+    above = [None] * len(x_starts)
+    tables = []
+    region_labels = []
+    skipped = 0
+    
+    for row, y0 in enumerate(y_starts):
+        y1 = min(y0 + tile_size, height)
+        cy0, cy1 = y_bounds[row], y_bounds[row + 1]
+        # Global labels along the right column of the previous core in this row
+        left = None
+        
+        for col, x0 in enumerate(x_starts):
+            x1 = min(x0 + tile_size, width)
+            cx0, cx1 = x_bounds[col], x_bounds[col + 1]
+            
+            mask = compute_mask(reader.read_gray(y0, y1, x0, x1))
+            
+            # Label the black regions of this core (4-connected, as findContours sees them)
+            core = mask[cy0 - y0:cy1 - y0, cx0 - x0:cx1 - x0]
+            count, labels = cv2.connectedComponents((core == 0).astype(np.uint8), connectivity=4, ltype=cv2.CV_32S)
+            offset = regions.add(count - 1) - 1
+            
+            def to_global(local):
+                return np.where(local > 0, local + offset, -1)
+            
+            # Black regions touching the image border connect to the outside
+            outside_edges = []
+            if cy0 == 0:
+                outside_edges.append(labels[0, :])
+            if cy1 == height:
+                outside_edges.append(labels[-1, :])
+            if cx0 == 0:
+                outside_edges.append(labels[:, 0])
+            if cx1 == width:
+                outside_edges.append(labels[:, -1])
+            for edge in outside_edges:
+                edge = to_global(edge)
+                regions.union_pairs(edge, np.zeros_like(edge))
+            
+            # Join black regions across the seams with already processed cores
+            if left is not None:
+                regions.union_pairs(left, to_global(labels[:, 0]))
+            if above[col] is not None:
+                regions.union_pairs(above[col], to_global(labels[0, :]))
+            
+            # Outer boundaries of every white component, nested or not
+            contours, hierarchy = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+            outer = [contour for contour, links in zip(contours, hierarchy[0] if len(contours) else [])
+                     if links[3] < 0]
+            table = ParticleTable.from_contours(outer, min_area=min_area, keep_contours=True)
+            
+            if len(table):
+                # First pixel of each particle in raster order, in image coordinates
+                first = np.array([contour[0, 0] for contour in table.contours]) + np.array([x0, y0])
+                table = table.offset(x0, y0)
+                first_x, first_y = first[:, 0], first[:, 1]
+                owned = (first_x >= cx0) & (first_x < cx1) & (first_y >= cy0) & (first_y < cy1)
+                
+                # Exact region of this tile; image borders are exact already
+                lo_x = x0 + margin if x0 > 0 else 0
+                lo_y = y0 + margin if y0 > 0 else 0
+                hi_x = x1 - margin if x1 < width else width
+                hi_y = y1 - margin if y1 < height else height
+                x, y, w, h = table.bbox.T
+                inside = (x >= lo_x) & (y >= lo_y) & (x + w <= hi_x) & (y + h <= hi_y)
+                
+                skipped += int(np.count_nonzero(owned & ~inside))
+                keep = np.flatnonzero(owned & inside)
+                
+                # Black region surrounding each particle: the pixel left of its first pixel
+                probe_x = first_x[keep] - 1
+                probe_y = first_y[keep]
+                surrounding = np.zeros(len(keep), dtype=np.int64)
+                in_core = probe_x >= cx0
+                surrounding[in_core] = labels[probe_y[in_core] - cy0, probe_x[in_core] - cx0] + offset
+                in_left = (probe_x >= 0) & ~in_core
+                if in_left.any():
+                    surrounding[in_left] = left[probe_y[in_left] - cy0]
+                
+                tables.append(table.select(keep))
+                region_labels.append(surrounding)
+            
+            left = to_global(labels[:, -1])
+            above[col] = to_global(labels[-1, :])
+            del mask, core, labels
+        
+        # Later rows only reach this row's regions through its bottom edge
+        relabeled = regions.compact(above + region_labels)
+        above, region_labels = relabeled[:len(above)], relabeled[len(above):]
+    
+    if skipped:
+        logger.warning("Tiled detection skipped %d particles too large for a tile overlap of %d pixels",
+                       skipped, overlap)
+    
+    particles = ParticleTable.concatenate(tables)
+    if not len(particles):
+        return particles
+    
+    # Keep only particles whose surrounding region reaches the image border
+    surrounding = np.concatenate(region_labels).tolist()
+    external = np.array([regions.find(label) == 0 for label in surrounding], dtype=bool)
+    particles = particles.select(external)
+    if not keep_contours:
+        particles.contours = None
+    
+    # Stable row-major order, independent of the tile layout
+    order = np.lexsort((particles.bbox[:, 0], particles.bbox[:, 1]))
+    return particles.select(order)
@@ -0,0 +1,184 @@
+"""
+Trend rollups for the Microplastic Analysis System
+Per-day, per-site particle totals kept up to date as analyses are stored, so trend queries read buckets instead of analyses
+"""
+
+import argparse
+import math
+import sys
+import time
+
+# Sites are optional; analyses without one are rolled up under ''
+NO_SITE = ''
+
+SIZE_CLASSES = ('small', 'medium', 'large')
+
+def create_tables(conn):
+    """Create the rollup tables (call inside the caller's transaction)"""
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_daily (
+            day TEXT NOT NULL,
+            site TEXT NOT NULL,
+            analyses INTEGER NOT NULL DEFAULT 0,
+            particles INTEGER NOT NULL DEFAULT 0,
+            size_small INTEGER NOT NULL DEFAULT 0,
+            size_medium INTEGER NOT NULL DEFAULT 0,
+            size_large INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, site)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS rollup_daily_types (
+            day TEXT NOT NULL,
+            site TEXT NOT NULL,
+            particle_type TEXT NOT NULL,
+            particles INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, site, particle_type)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_rollup_daily_site ON rollup_daily (site, day)')
+
+class RollupBatch:
+    """Rollup increments for a batch of analyses, merged per bucket before they are written"""
+    
+    def __init__(self):
+        self.daily = {}
+        self.types = {}
+    
+    def add(self, analysis_date, site, particle_count, size_distribution, particle_types):
+        """Count one analysis; particle_types holds one type name per particle"""
+        key = (analysis_date[:10], site or NO_SITE)
+        totals = self.daily.setdefault(key, [0, 0, 0, 0, 0])
+        totals[0] += 1
+        totals[1] += particle_count
+        for index, size_class in enumerate(SIZE_CLASSES):
+            totals[2 + index] += int(size_distribution.get(size_class, 0))
+        for particle_type in particle_types:
+            type_key = key + (particle_type,)
+            self.types[type_key] = self.types.get(type_key, 0) + 1
+    
+    def apply(self, conn):
+        """Add the batch to the rollup tables (call inside the insert transaction)"""
+        conn.executemany('''
+            INSERT INTO rollup_daily (day, site, analyses, particles, size_small, size_medium, size_large)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (day, site) DO UPDATE SET
+                analyses = analyses + excluded.analyses,
+                particles = particles + excluded.particles,
+                size_small = size_small + excluded.size_small,
+                size_medium = size_medium + excluded.size_medium,
+                size_large = size_large + excluded.size_large
+        ''', [key + tuple(totals) for key, totals in self.daily.items()])
+        conn.executemany('''
+            INSERT INTO rollup_daily_types (day, site, particle_type, particles)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT (day, site, particle_type) DO UPDATE SET
+                particles = particles + excluded.particles
+        ''', [key + (count,) for key, count in self.types.items()])
+
+def shannon_index(type_counts):
+    """Shannon diversity H = -sum(p ln p) over the type counts, rounded like DataComparator"""
+    total = sum(type_counts.values())
+    if total <= 0:
+        return 0.0
+    # p ln(1/p) form so a single type gives 0.0 rather than -0.0
+    return round(sum((count / total) * math.log(total / count) for count in type_counts.values() if count > 0), 3)
+
+def query_trends(conn, since=None, until=None, site=None, group_by='day'):
+    """Aggregate the rollups over a window of days
+    
+    since and until are 'YYYY-MM-DD' days (until is exclusive); group_by is
+    'day', 'site' or None for a single bucket. Each bucket reports analysis
+    and particle totals, size classes, counts per type and the Shannon
+    diversity of the pooled type counts. Cost grows with the number of
+    (day, site, type) buckets in the window, not with the analyses.
+    """
+    if group_by not in ('day', 'site', None):
+        raise ValueError(f"Unknown grouping: {group_by!r}")
+    
+    conditions = []
+    params = []
+    for clause, value in (('day >= ?', since), ('day < ?', until), ('site = ?', site)):
+        if value is not None:
+            conditions.append(clause)
+            params.append(value)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+    bucket = group_by or "'all'"
+    
+    buckets = {}
+    for row in conn.execute(f'''
+        SELECT {bucket} AS bucket, SUM(analyses), SUM(particles),
+               SUM(size_small), SUM(size_medium), SUM(size_large)
+        FROM rollup_daily {where} GROUP BY bucket ORDER BY bucket
+    ''', params):
+        entry = {group_by: row[0]} if group_by else {}
+        entry.update({
+            'analyses': row[1],
+            'particle_count': row[2],
+            'size_distribution': dict(zip(SIZE_CLASSES, row[3:6])),
+            'type_counts': {}
+        })
+        buckets[row[0]] = entry
+    
+    for bucket_value, particle_type, count in conn.execute(f'''
+        SELECT {bucket} AS bucket, particle_type, SUM(particles)
+        FROM rollup_daily_types {where} GROUP BY bucket, particle_type
+    ''', params):
+        if bucket_value in buckets:
+            buckets[bucket_value]['type_counts'][particle_type] = count
+    
+    results = []
+    for entry in buckets.values():
+        type_counts = entry['type_counts']
+        entry['dominant_type'] = max(type_counts, key=type_counts.get) if type_counts else None
+        entry['diversity_index'] = shannon_index(type_counts)
+        results.append(entry)
+    return results
+
+def backfill(conn):
+    """Rebuild both rollup tables from the stored analyses and particles
+    
+    Type counts come from the particles table, so analyses stored before
+    per-particle rows existed only contribute to the daily totals.
+    """
+    with conn:
+        create_tables(conn)
+        conn.execute('DELETE FROM rollup_daily')
+        conn.execute('DELETE FROM rollup_daily_types')
+        conn.execute(f'''
+            INSERT INTO rollup_daily (day, site, analyses, particles, size_small, size_medium, size_large)
+            SELECT substr(analysis_date, 1, 10), COALESCE(site, '{NO_SITE}'), COUNT(*),
+                   COALESCE(SUM(particle_count), 0),
+                   COALESCE(SUM(json_extract(size_distribution, '$.small')), 0),
+                   COALESCE(SUM(json_extract(size_distribution, '$.medium')), 0),
+                   COALESCE(SUM(json_extract(size_distribution, '$.large')), 0)
+            FROM analyses GROUP BY 1, 2
+        ''')
+        conn.execute(f'''
+            INSERT INTO rollup_daily_types (day, site, particle_type, particles)
+            SELECT substr(p.analysis_date, 1, 10), COALESCE(a.site, '{NO_SITE}'), p.particle_type, COUNT(*)
+            FROM particles p JOIN analyses a ON a.id = p.analysis_id
+            GROUP BY 1, 2, 3
+        ''')
+    return conn.execute('SELECT COUNT(*) FROM rollup_daily').fetchone()[0]
+
+def main(argv=None):
+    """python trend_rollups.py backfill [--database PATH]"""
+    from config import Config
+    from persistence import AnalysisStore
+    
+    parser = argparse.ArgumentParser(description="Maintain trend rollups")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    backfill_parser = subparsers.add_parser('backfill', help="Rebuild the rollups from all stored analyses")
+    backfill_parser.add_argument('--database', default=Config.DATABASE_PATH)
+    args = parser.parse_args(argv)
+    
+    store = AnalysisStore(args.database, write_behind=False)
+    store.init_db()
+    start = time.perf_counter()
+    buckets = backfill(store.connection())
+    print(f"Rebuilt {buckets} daily rollup buckets in {time.perf_counter() - start:.2f}s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
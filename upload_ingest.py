@@ -0,0 +1,193 @@
+"""
+Upload ingestion for the Microplastic Analysis System
+Streams uploaded files into a spooled buffer while hashing them and sniffing the image header, rejecting oversized or non-image bodies early
+"""
+
+import contextlib
+import hashlib
+import io
+import mmap
+import os
+import tempfile
+
+from flask import Request
+from werkzeug.exceptions import RequestEntityTooLarge, UnsupportedMediaType
+
+from config import Config
+
+# Leading bytes of each accepted format, with the extensions that name it
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpeg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+    (b'BM', 'bmp'),
+    (b'II*\x00', 'tiff'),
+    (b'MM\x00*', 'tiff'),
+    (b'II+\x00', 'tiff'),  # BigTIFF
+    (b'MM\x00+', 'tiff')
+)
+FORMAT_EXTENSIONS = {
+    'png': ('png',),
+    'jpeg': ('jpg', 'jpeg'),
+    'gif': ('gif',),
+    'bmp': ('bmp',),
+    'tiff': ('tif', 'tiff')
+}
+SNIFF_BYTES = max(len(signature) for signature, _ in IMAGE_SIGNATURES)
+
+def file_extension(filename):
+    return filename.rsplit('.', 1)[1].lower() if filename and '.' in filename else ''
+
+def allowed_file(filename):
+    """True when the filename has one of Config.ALLOWED_EXTENSIONS"""
+    return file_extension(filename) in Config.ALLOWED_EXTENSIONS
+
+def sniff_image_format(head):
+    """The image format named by the leading bytes, or None when they are not an accepted image"""
+    for signature, image_format in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            if Config.ALLOWED_EXTENSIONS.isdisjoint(FORMAT_EXTENSIONS[image_format]):
+                return None
+            return image_format
+    return None
+
+class UploadBuffer(io.RawIOBase):
+    """Writable, readable buffer for one uploaded file
+    
+    Data stays in memory up to spool_bytes and moves to an anonymous
+    temporary file beyond that. Every write updates the SHA-256 digest and
+    the size check, and the image header is checked as soon as enough bytes
+    have arrived, so a bad upload is rejected before the rest is read.
+    """
+    
+    def __init__(self, filename=None, max_bytes=None, spool_bytes=None):
+        super().__init__()
+        self.filename = filename
+        self.max_bytes = max_bytes if max_bytes is not None else Config.MAX_CONTENT_LENGTH
+        self.spool_bytes = spool_bytes if spool_bytes is not None else Config.UPLOAD_SPOOL_BYTES
+        self.size = 0
+        self.image_format = None
+        self._head = b''
+        self._hash = hashlib.sha256()
+        self._file = io.BytesIO()
+        self._views = []
+    
+    @property
+    def sha256(self):
+        return self._hash.hexdigest()
+    
+    @property
+    def spooled_to_disk(self):
+        return not isinstance(self._file, io.BytesIO)
+    
+    def readable(self):
+        return True
+    
+    def writable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_bytes:
+            raise RequestEntityTooLarge(f"File exceeds the {self.max_bytes} byte upload limit")
+        
+        if self.image_format is None and len(self._head) < SNIFF_BYTES:
+            self._head += bytes(data[:SNIFF_BYTES - len(self._head)])
+            self._check_header(complete=False)
+        
+        self._hash.update(data)
+        if not self.spooled_to_disk and self.size > self.spool_bytes:
+            spooled = tempfile.TemporaryFile()
+            spooled.write(self._file.getbuffer())
+            self._file.close()
+            self._file = spooled
+        return self._file.write(data)
+    
+    def _check_header(self, complete):
+        """Set image_format once the header is known; complete means no more bytes will follow"""
+        self.image_format = sniff_image_format(self._head)
+        if self.image_format is None and (complete or len(self._head) >= SNIFF_BYTES):
+            raise UnsupportedMediaType("Uploaded file is not a supported image")
+    
+    def finish(self):
+        """Check a body that ended before a full header arrived; raises UnsupportedMediaType"""
+        if self.image_format is None:
+            self._check_header(complete=True)
+        return self
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        return self._file.seek(offset, whence)
+    
+    def tell(self):
+        return self._file.tell()
+    
+    def read(self, size=-1):
+        return self._file.read(size)
+    
+    def readinto(self, buffer):
+        return self._file.readinto(buffer)
+    
+    def view(self):
+        """The whole upload as a buffer, without copying it
+        
+        In-memory uploads are exposed directly and spooled uploads are memory
+        mapped. Views are released when the buffer is closed.
+        """
+        if self.spooled_to_disk:
+            self._file.flush()
+            mapped = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            view = memoryview(mapped)
+            self._views.append((view, mapped))
+        else:
+            view = self._file.getbuffer()
+            self._views.append((view, None))
+        return view
+    
+    def persist(self, directory):
+        """Store the upload under directory/<hash[:2]>/<hash>.<format> unless it is already there; returns the path"""
+        digest = self.sha256
+        folder = os.path.join(directory, digest[:2])
+        path = os.path.join(folder, f"{digest}.{FORMAT_EXTENSIONS.get(self.image_format, ('bin',))[0]}")
+        if os.path.exists(path):
+            return path
+        
+        os.makedirs(folder, exist_ok=True)
+        # Written under a temporary name so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=folder, prefix='.upload-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(self.view())
+            os.replace(temp_path, path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+            raise
+        return path
+    
+    def close(self):
+        if self.closed:
+            return
+        # Arrays made from a view may still be alive; the buffers are then freed with them
+        for view, mapped in self._views:
+            with contextlib.suppress(BufferError):
+                view.release()
+                if mapped is not None:
+                    mapped.close()
+        self._views = []
+        with contextlib.suppress(BufferError):
+            self._file.close()
+        super().close()
+
+class UploadRequest(Request):
+    """Flask request whose multipart file parts are streamed into UploadBuffers"""
+    
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        # Rejected from the part headers, before any of the file is read
+        if filename and not allowed_file(filename):
+            allowed = ', '.join(sorted(Config.ALLOWED_EXTENSIONS))
+            raise UnsupportedMediaType(f"File type not allowed; use one of: {allowed}")
+        return UploadBuffer(filename)
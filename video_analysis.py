@@ -0,0 +1,271 @@
+"""
+Video and time-lapse analysis for the Microplastic Analysis System
+Streams frames from video files or numbered image sequences, re-analyzes only regions that changed and tracks particles so each is counted and classified once
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from config import Config
+from pyramid_detection import downscale, rois_from_blocks
+
+def _natural_key(name):
+    """Sort key that orders frame_9.png before frame_10.png"""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+def open_frames(source, fps=None):
+    """Return (frames, fps); frames yields decoded BGR frames one at a time
+    
+    source is a video file, a directory of numbered images (ordered by
+    their numbers) or a printf-style pattern such as 'run1/frame_%05d.png'.
+    Image sequences carry no timing, so they use fps or
+    Config.VIDEO_SEQUENCE_FPS; for videos fps overrides the container's rate.
+    """
+    if os.path.isdir(source):
+        names = sorted(
+            (name for name in os.listdir(source)
+             if '.' in name and name.rsplit('.', 1)[1].lower() in Config.ALLOWED_EXTENSIONS),
+            key=_natural_key
+        )
+        return _read_images([os.path.join(source, name) for name in names]), fps or Config.VIDEO_SEQUENCE_FPS
+    
+    if '%' not in source and not os.path.exists(source):
+        raise FileNotFoundError(f"No such video or image sequence: {source}")
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video: {source}")
+    if fps is None:
+        fps = Config.VIDEO_SEQUENCE_FPS if '%' in source else capture.get(cv2.CAP_PROP_FPS) or Config.VIDEO_SEQUENCE_FPS
+    return _read_capture(capture), fps
+
+def _read_images(paths):
+    for path in paths:
+        frame = cv2.imread(path)
+        if frame is None:
+            raise ValueError(f"Could not read frame: {path}")
+        yield frame
+
+def _read_capture(capture):
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            yield frame
+    finally:
+        capture.release()
+
+def _inside(points, rois):
+    """Boolean array marking the points that fall inside any (x0, y0, x1, y1) box"""
+    if not len(rois) or not len(points):
+        return np.zeros(len(points), dtype=bool)
+    boxes = np.asarray(rois, dtype=np.float64)
+    x = points[:, 0:1]
+    y = points[:, 1:2]
+    return ((x >= boxes[:, 0]) & (x < boxes[:, 2]) & (y >= boxes[:, 1]) & (y < boxes[:, 3])).any(axis=1)
+
+class ParticleTracker:
+    """Nearest-neighbour tracker matching particle centroids from frame to frame
+    
+    Each track keeps its last position and velocity. Detections are matched
+    greedily, closest first, to where the tracks predict them, within
+    max_distance pixels per frame. A track left unmatched inside an analyzed
+    region is dropped after max_gap frames. A track that was current in the
+    previous frame and lies outside the analyzed regions stays current, since
+    an unchanged region means the particle has not moved.
+    """
+    
+    def __init__(self, max_distance=None, max_gap=None):
+        self.max_distance = max_distance if max_distance is not None else Config.VIDEO_TRACK_MAX_DISTANCE
+        self.max_gap = max_gap if max_gap is not None else Config.VIDEO_TRACK_MAX_GAP
+        self.positions = np.empty((0, 2))
+        self.velocities = np.empty((0, 2))
+        self.last_seen = np.empty(0, dtype=np.int64)
+        self.tracks_started = 0
+    
+    def __len__(self):
+        return len(self.positions)
+    
+    def update(self, frame_index, centroids, rois=None):
+        """Match one frame's detections; returns a boolean array marking detections that start new tracks
+        
+        rois are the regions analyzed in this frame, or None for the whole frame.
+        """
+        centroids = np.asarray(centroids, dtype=np.float64).reshape(-1, 2)
+        new = np.ones(len(centroids), dtype=bool)
+        matched = np.zeros(len(self.positions), dtype=bool)
+        
+        if len(centroids) and len(self.positions):
+            gaps = (frame_index - self.last_seen).astype(np.float64)
+            predicted = self.positions + self.velocities * gaps[:, None]
+            distances = np.linalg.norm(predicted[:, None, :] - centroids[None, :, :], axis=2)
+            tracks, detections = np.nonzero(distances <= self.max_distance * gaps[:, None])
+            order = np.argsort(distances[tracks, detections], kind='stable')
+            for track, detection in zip(tracks[order].tolist(), detections[order].tolist()):
+                if matched[track] or not new[detection]:
+                    continue
+                matched[track] = True
+                new[detection] = False
+                self.velocities[track] = (centroids[detection] - self.positions[track]) / gaps[track]
+                self.positions[track] = centroids[detection]
+                self.last_seen[track] = frame_index
+        
+        if rois is not None:
+            still = ~matched & (self.last_seen == frame_index - 1) & ~_inside(self.positions, rois)
+            self.last_seen[still] = frame_index
+            self.velocities[still] = 0.0
+        
+        alive = frame_index - self.last_seen <= self.max_gap
+        self.positions = np.concatenate([self.positions[alive], centroids[new]])
+        self.velocities = np.concatenate([self.velocities[alive], np.zeros((int(new.sum()), 2))])
+        self.last_seen = np.concatenate([self.last_seen[alive], np.full(int(new.sum()), frame_index, dtype=np.int64)])
+        self.tracks_started += int(new.sum())
+        return new
+
+class VideoAnalyzer:
+    """Runs detection, tracking and classification over a frame stream, one time window at a time
+    
+    Only the previous (downscaled) frame, the live tracks and the current
+    window's counts are kept, so memory does not grow with the video length.
+    """
+    
+    def __init__(self, analyzer=None, fps=None, window_seconds=None, motion_threshold=None,
+                 max_distance=None, max_gap=None):
+        if analyzer is None:
+            from model_registry import get_registry
+            analyzer = get_registry().get_analyzer()
+        self.analyzer = analyzer
+        self.fps = fps
+        self.window_seconds = window_seconds or Config.VIDEO_WINDOW_SECONDS
+        self.motion_threshold = motion_threshold if motion_threshold is not None else Config.VIDEO_MOTION_THRESHOLD
+        self.max_distance = max_distance
+        self.max_gap = max_gap
+        self.stats = {}
+    
+    def analyze(self, source):
+        """Yield one summary per time window, in order
+        
+        Each summary holds the particles first seen in that window (count,
+        type_counts, size_distribution), the frames read and skipped as
+        static, the live tracks at its end and the throughput in frames per
+        second. Totals for the whole stream are in self.stats afterwards.
+        """
+        frames, fps = open_frames(source, self.fps)
+        frames = iter(frames)
+        tracker = ParticleTracker(self.max_distance, self.max_gap)
+        self.stats = {'source': os.fspath(source), 'source_fps': fps, 'frames': 0, 'frames_skipped': 0,
+                      'particles': 0, 'busy_seconds': 0.0, 'fps': 0.0}
+        
+        previous = None
+        window = None
+        index = 0
+        while True:
+            # Timed from the read so decoding counts towards throughput but the consumer does not
+            start = time.perf_counter()
+            frame = next(frames, None)
+            if frame is None:
+                break
+            
+            window_index = int(index / fps // self.window_seconds)
+            if window is not None and window['window'] != window_index:
+                yield self._summarize(window, tracker)
+                window = None
+            if window is None:
+                window = {'window': window_index, 'frames': 0, 'frames_skipped': 0, 'particle_count': 0,
+                          'type_counts': {}, 'size_distribution': {'small': 0, 'medium': 0, 'large': 0},
+                          'busy_seconds': 0.0}
+            
+            previous = self._process_frame(frame, index, previous, tracker, window)
+            window['frames'] += 1
+            window['busy_seconds'] += time.perf_counter() - start
+            index += 1
+        
+        if window is not None:
+            yield self._summarize(window, tracker)
+        
+        busy = self.stats['busy_seconds']
+        self.stats['busy_seconds'] = round(busy, 3)
+        self.stats['fps'] = round(self.stats['frames'] / busy, 2) if busy > 0 else 0.0
+    
+    def _process_frame(self, frame, index, previous, tracker, window):
+        """Detect, track and classify one frame; returns its downscaled copy for the next difference"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        small, fx, fy = downscale(gray, Config.PYRAMID_SCALE)
+        
+        # The first frame (or one after a size change) is analyzed in full
+        rois = None
+        if previous is not None and previous.shape == small.shape:
+            rois = rois_from_blocks(cv2.absdiff(small, previous) >= self.motion_threshold, fx, fy, gray.shape)
+        
+        if rois == []:
+            tracker.update(index, (), rois)
+            window['frames_skipped'] += 1
+            return small
+        
+        particles = self.analyzer._find_particles(gray, rois=rois)
+        bbox = particles.bbox.astype(np.float64)
+        new = tracker.update(index, bbox[:, :2] + bbox[:, 2:] / 2.0, rois)
+        
+        if new.any():
+            # Only particles entering the field of view reach the model
+            fresh = particles.select(new)
+            for classification in self.analyzer.classify_particles(frame, fresh):
+                type_counts = window['type_counts']
+                type_counts[classification['type']] = type_counts.get(classification['type'], 0) + 1
+            for size_class, count in self.analyzer.calculate_size_distribution(fresh).items():
+                window['size_distribution'][size_class] += count
+            window['particle_count'] += len(fresh)
+        return small
+    
+    def _summarize(self, window, tracker):
+        busy = window.pop('busy_seconds')
+        self.stats['frames'] += window['frames']
+        self.stats['frames_skipped'] += window['frames_skipped']
+        self.stats['particles'] += window['particle_count']
+        self.stats['busy_seconds'] += busy
+        
+        window['start_seconds'] = window['window'] * self.window_seconds
+        window['end_seconds'] = (window['window'] + 1) * self.window_seconds
+        window['active_tracks'] = len(tracker)
+        window['fps'] = round(window['frames'] / busy, 2) if busy > 0 else 0.0
+        return window
+
+def main(argv=None):
+    """python video_analysis.py SOURCE [--fps N] [--window SECONDS] [-o results.jsonl]"""
+    import serialization
+    
+    parser = argparse.ArgumentParser(description="Count microplastic particles in a video or time-lapse sequence")
+    parser.add_argument('source', help="Video file, directory of numbered images or pattern like frame_%%05d.png")
+    parser.add_argument('--fps', type=float, help="Frame rate (default: the video's, or VIDEO_SEQUENCE_FPS)")
+    parser.add_argument('--window', type=float, help="Seconds per reported window (default VIDEO_WINDOW_SECONDS)")
+    parser.add_argument('-o', '--output', help="Also write one JSON line per window here")
+    args = parser.parse_args(argv)
+    
+    video_analyzer = VideoAnalyzer(fps=args.fps, window_seconds=args.window)
+    output = open(args.output, 'w') if args.output else None
+    try:
+        for window in video_analyzer.analyze(args.source):
+            counts = ', '.join(f"{name}: {count}" for name, count in sorted(window['type_counts'].items()))
+            print(f"[{window['start_seconds']:8.1f}s - {window['end_seconds']:8.1f}s] "
+                  f"{window['particle_count']} new particles ({counts or 'none'}), "
+                  f"{window['frames']} frames, {window['frames_skipped']} static, {window['fps']} frames/s")
+            if output is not None:
+                output.write(serialization.dumps_text(window) + '\n')
+                output.flush()
+    finally:
+        if output is not None:
+            output.close()
+    
+    stats = video_analyzer.stats
+    print(f"Analyzed {stats['frames']} frames ({stats['frames_skipped']} static) and counted "
+          f"{stats['particles']} particles at {stats['fps']} frames/s")
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())